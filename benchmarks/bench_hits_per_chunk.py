@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Regression benchmark: scoring time of a chunk against its number of hits.
+
+A synthetic regulatory element and per-base score file are generated, and
+chunks of SNVs all falling in the element are scored with
+'finsurf.intersect_chunk'. The time per regulatory hit should stay constant
+when the number of hits per chunk grows (linear scaling) ; the script exits
+with an error if the time per hit of the largest chunk exceeds the one of the
+smallest chunk by more than '--max_ratio'.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "scripts"))
+
+import finsurf
+import tabix_utils
+
+
+def make_fixtures(tmp_dir, n_positions, seed=0):
+    """ Write a regulatory bed and a score file covering 'n_positions' bases.
+    """
+    rng = random.Random(seed)
+    regulatory = os.path.join(tmp_dir, "regulatory.bed.gz")
+    score = os.path.join(tmp_dir, "scores.tsv.gz")
+    tabix_utils.write_tabix(["chr1\t1\t{}\tEL1\tGENE1".format(n_positions + 1)],
+                            regulatory)
+    tabix_utils.write_tabix(
+        ("chr1\t{0}\t{1}\tA\tG\t{2:.4f}\t{3:.4f}".format(
+            pos, pos + 1, rng.random(), rng.random())
+         for pos in range(1, n_positions + 1)),
+        score, zero_based=True)
+    return regulatory, score
+
+
+def make_chunk(n_variants, n_positions, seed=0):
+    """ Build the expanded positions (and variant table) of a chunk of
+    'n_variants' SNVs.
+
+    Variants are drawn from the same 'n_positions' bases whatever their number,
+    so that the cost of each index query stays the same between chunk sizes.
+    """
+    rng = random.Random(seed)
+    positions = rng.sample(range(2, n_positions), n_variants)
+    chunk = pd.DataFrame({"chrom": "chr1",
+                          "pos": sorted(positions),
+                          "id": ".",
+                          "ref": "A",
+                          "alt": [rng.choice("CGT") for _ in positions]})
+    chunk_regions = finsurf.create_records_vcf(chunk, finsurf.Record)
+    return (finsurf.expand_regions(chunk_regions, start=0),
+            finsurf.variant_table(chunk_regions, start=0))
+
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        help="Numbers of hits per chunk to benchmark.",
+                        default=[250, 500, 1000, 2000, 4000])
+    parser.add_argument("-e",
+                        "--engine",
+                        type=str,
+                        help="Intersection engine.",
+                        choices=sorted(finsurf.intersect_engines),
+                        default="tabix")
+    parser.add_argument("--repeat",
+                        type=int,
+                        help="Number of timings per size (the best is kept).",
+                        default=3)
+    parser.add_argument("--max_ratio",
+                        type=float,
+                        help="Maximum allowed ratio between the time per hit "
+                             "of the largest and of the smallest chunk.",
+                        default=2.5)
+    return parser
+
+
+def main():
+    args = argparser().parse_args()
+    tmp_dir = tempfile.mkdtemp(prefix="finsurf_bench_")
+    try:
+        n_positions = max(args.sizes) * 2
+        regulatory, score = make_fixtures(tmp_dir, n_positions)
+        per_hit = []
+        print("hits\tseconds\tus_per_hit")
+        for size in sorted(args.sizes):
+            df_regs, variants = make_chunk(size, n_positions)
+            timings = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                results = finsurf.intersect_chunk(df_regs, variants, score,
+                                                  regulatory, args.engine)
+                timings.append(time.perf_counter() - t0)
+            if len(results) != size:
+                raise RuntimeError("Expected {} results, got {}".format(
+                                    size, len(results)))
+            best = min(timings)
+            per_hit.append(best / size)
+            print("{}\t{:.3f}\t{:.1f}".format(size, best, 1e6 * best / size))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    ratio = per_hit[-1] / per_hit[0]
+    print("ratio of time per hit (largest/smallest chunk): {:.2f}".format(
+            ratio))
+    if ratio > args.max_ratio:
+        print("FAILED: scaling is not linear in the number of hits per chunk.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""Throughput benchmarks of FINSURF on synthetic data.
+
+A synthetic dataset is generated (see synthetic.py), then each benchmark is
+run in its own process, so that its peak memory use (RSS) is measured alone:
+
+- 'expand_regions': expansion of the variants into one row per base ;
+- 'bedfile_intersect_index': tabix queries of the expanded bases of one chunk
+  against the regulatory file ;
+- 'run_intersect': whole runs of finsurf.py on the VCF, for each engine ;
+- 'do_plot': plots of plot_contribution.py (skipped if plotly is missing).
+
+Results (seconds, variants/s or queries/s, peak RSS) are printed and written
+as JSON, with the commit and the parameters, so that two commits can be
+compared on the same machine:
+
+    python benchmarks/bench_suite.py -o before.json
+    git checkout other_branch
+    python benchmarks/bench_suite.py -o after.json --compare before.json
+
+The dataset is kept in '--data_dir' if given, and only generated again when
+its parameters change. Everything runs offline.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import OrderedDict
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench_dir, "..", "scripts"))
+
+import finsurf
+import synthetic
+
+SUITE_VERSION = 1
+DATASET = "dataset.json"
+
+
+def best_time(function, repeat):
+    """ Best wall time of 'repeat' calls, and the result of the last one. """
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - t0)
+    return min(timings), result
+
+
+def read_records(vcf, n_variants):
+    reader = finsurf.build_reader(vcf, chunksize=n_variants)
+    chunk = next(iter(reader))
+    return finsurf.create_records_vcf(chunk, finsurf.Record)
+
+
+def bench_expand_regions(dataset, args):
+    records = read_records(dataset["vcf"], min(args.variants, 50000))
+    seconds, df = best_time(lambda: finsurf.expand_regions(records, start=0),
+                            args.repeat)
+    return OrderedDict([("seconds", seconds),
+                        ("variants", len(records)),
+                        ("bases", len(df)),
+                        ("variants_per_s", len(records) / seconds),
+                        ("bases_per_s", len(df) / seconds)])
+
+
+def bench_bedfile_intersect_index(dataset, args):
+    records = read_records(dataset["vcf"], args.chunksize)
+    df_regs = finsurf.expand_regions(records, start=0)
+    seconds, _ = best_time(lambda: finsurf.bedfile_intersect_index(
+                                        df_regs, dataset["regulatory"]),
+                           args.repeat)
+    return OrderedDict([("seconds", seconds),
+                        ("queries", len(df_regs)),
+                        ("queries_per_s", len(df_regs) / seconds)])
+
+
+def bench_run_intersect(dataset, args):
+    results = OrderedDict()
+    out_dir = tempfile.mkdtemp(prefix="finsurf_bench_")
+    try:
+        for engine in args.engines:
+            def run():
+                result_file = finsurf.run_intersect(
+                        dataset["score"], dataset["regulatory"],
+                        dataset["vcf"], args.chunksize, out_dir, engine)
+                if result_file.startswith("Error"):
+                    raise RuntimeError(result_file)
+                with open(result_file) as f:
+                    n_results = sum(1 for _ in f) - 1
+                os.remove(result_file)
+                return n_results
+            seconds, n_results = best_time(run, args.repeat)
+            results[engine] = OrderedDict([
+                    ("seconds", seconds),
+                    ("variants", args.variants),
+                    ("results", n_results),
+                    ("variants_per_s", args.variants / seconds)])
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return results
+
+
+def bench_do_plot(dataset, args):
+    try:
+        import plot_contribution
+    except ImportError as e:
+        return OrderedDict([("skipped", str(e))])
+    positions = dataset.get("plot_positions", [])[:args.plots]
+    if not positions:
+        return OrderedDict([("skipped", "no feature tables (--plots 0)")])
+
+    def run():
+        for chrom, pos in positions:
+            files = plot_contribution.do_plot(
+                    "{}:{}".format(chrom, pos), "transition",
+                    dataset["rename"], dataset["NUM_FEATURES"],
+                    dataset["SCALED_NUM_FEATURES"],
+                    dataset["FULL_FC_transition"],
+                    dataset["FULL_FC_transversion"])
+            if files[0] and files[0].startswith("Error"):
+                raise RuntimeError(files[0])
+            for path in files:
+                if path:
+                    os.remove(path)
+    seconds, _ = best_time(run, args.repeat)
+    return OrderedDict([("seconds", seconds),
+                        ("plots", len(positions)),
+                        ("plots_per_s", len(positions) / seconds)])
+
+
+benchmarks = OrderedDict([("expand_regions", bench_expand_regions),
+                          ("bedfile_intersect_index",
+                           bench_bedfile_intersect_index),
+                          ("run_intersect", bench_run_intersect),
+                          ("do_plot", bench_do_plot)])
+
+
+def dataset_parameters(args):
+    return OrderedDict([("version", SUITE_VERSION),
+                        ("variants", args.variants),
+                        ("mix", args.mix),
+                        ("chroms", args.chroms),
+                        ("chrom_size", args.chrom_size),
+                        ("elements", args.elements),
+                        ("element_length", args.element_length),
+                        ("in_elements", args.in_elements),
+                        ("feature_positions", args.plots),
+                        ("seed", args.seed)])
+
+
+def prepare_dataset(data_dir, args):
+    """ Generate the dataset, unless 'data_dir' holds one with the same
+    parameters.
+    """
+    parameters = dataset_parameters(args)
+    manifest = os.path.join(data_dir, DATASET)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            dataset = json.load(f)
+        if dataset["parameters"] == json.loads(json.dumps(parameters)):
+            return dataset
+    t0 = time.perf_counter()
+    paths = synthetic.make_dataset(data_dir, args.variants, args.mix,
+                                   args.chroms, args.chrom_size,
+                                   args.elements, args.element_length,
+                                   args.in_elements, args.plots, args.seed)
+    print("Dataset generated in {:.1f}s.".format(time.perf_counter() - t0),
+          file=sys.stderr)
+    dataset = dict(paths, parameters=parameters)
+    with open(manifest, "w") as f:
+        json.dump(dataset, f, indent=1)
+    return dataset
+
+
+def git_commit():
+    """ Commit of the working tree, and whether it has local changes. """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=bench_dir, stderr=subprocess.DEVNULL)
+        status = subprocess.check_output(["git", "status", "--porcelain",
+                                          "--untracked-files=no"],
+                                         cwd=bench_dir, stderr=subprocess.DEVNULL)
+        return commit.decode().strip(), bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_single(name, args):
+    """ Run one benchmark in this process and print its results (JSON). """
+    with open(os.path.join(args.data_dir, DATASET)) as f:
+        dataset = json.load(f)
+    results = benchmarks[name](dataset, args)
+    # Peak RSS of this process (kB on Linux).
+    results["peak_rss_mb"] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print(json.dumps(results))
+
+
+def child_arguments(args):
+    argv = ["--data_dir", args.data_dir, "--chunksize", str(args.chunksize),
+            "--repeat", str(args.repeat), "--plots", str(args.plots),
+            "--engines"] + args.engines
+    for option in ("variants", "chroms", "chrom_size", "elements",
+                   "element_length", "in_elements", "seed"):
+        argv += ["--" + option, str(getattr(args, option))]
+    return argv
+
+
+def rates(report):
+    """ Flatten the '*_per_s' values of a report: 'benchmark[.engine].rate'. """
+    flat = OrderedDict()
+    for name, results in report["results"].items():
+        items = [(name, results)]
+        if name == "run_intersect":
+            items = [(name + "." + engine, values)
+                     for engine, values in results.items()
+                     if isinstance(values, dict)]
+        for prefix, values in items:
+            for key, value in values.items():
+                if key.endswith("_per_s"):
+                    flat[prefix + "." + key] = value
+    return flat
+
+
+def compare(report, previous, max_slowdown):
+    """ Print the ratios of the rates of two reports.
+
+    Returns:
+        list of the rates slower than 'previous' by more than 'max_slowdown'.
+    """
+    old_rates = rates(previous)
+    regressions = []
+    print("\nbenchmark\tprevious\tcurrent\tratio")
+    for key, value in rates(report).items():
+        if key not in old_rates:
+            continue
+        ratio = value / old_rates[key]
+        print("{}\t{:.1f}\t{:.1f}\t{:.2f}".format(key, old_rates[key], value,
+                                                 ratio))
+        if ratio * max_slowdown < 1:
+            regressions.append(key)
+    return regressions
+
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o",
+                        "--output",
+                        type=str,
+                        help="JSON file of the results.")
+    parser.add_argument("--data_dir",
+                        type=str,
+                        help="Directory of the synthetic dataset (kept "
+                             "between runs) ; a temporary one by default.")
+    parser.add_argument("--benchmarks",
+                        type=str,
+                        nargs="+",
+                        choices=list(benchmarks),
+                        default=list(benchmarks),
+                        help="Benchmarks to run.")
+    parser.add_argument("--engines",
+                        type=str,
+                        nargs="+",
+                        choices=sorted(finsurf.intersect_engines),
+                        default=["tabix"],
+                        help="Engines of the 'run_intersect' benchmark.")
+    parser.add_argument("--chunksize",
+                        type=int,
+                        help="Number of variants scored as a block.",
+                        default=5000)
+    parser.add_argument("--plots",
+                        type=int,
+                        help="Number of plots of the 'do_plot' benchmark.",
+                        default=20)
+    parser.add_argument("--repeat",
+                        type=int,
+                        help="Number of timings of each benchmark (the best "
+                             "is kept).",
+                        default=3)
+    parser.add_argument("--compare",
+                        type=str,
+                        help="JSON results of a previous run to compare to.")
+    parser.add_argument("--max_slowdown",
+                        type=float,
+                        help="With --compare, fail if a rate is slower than "
+                             "the previous one by more than this factor.",
+                        default=1.5)
+    parser.add_argument("--run",
+                        type=str,
+                        choices=list(benchmarks),
+                        help=argparse.SUPPRESS)
+    return synthetic.add_dataset_arguments(parser)
+
+
+def main():
+    args = argparser().parse_args()
+    if args.run:
+        run_single(args.run, args)
+        return 0
+
+    tmp_dir = None
+    if args.data_dir is None:
+        tmp_dir = args.data_dir = tempfile.mkdtemp(prefix="finsurf_data_")
+    try:
+        dataset = prepare_dataset(args.data_dir, args)
+        commit, dirty = git_commit()
+        report = OrderedDict([
+                ("suite_version", SUITE_VERSION),
+                ("commit", commit),
+                ("dirty", dirty),
+                ("date", datetime.datetime.now().isoformat()),
+                ("host", platform.node()),
+                ("python", platform.python_version()),
+                ("parameters", dict(dataset["parameters"],
+                                    chunksize=args.chunksize,
+                                    repeat=args.repeat,
+                                    engines=args.engines)),
+                ("results", OrderedDict())])
+        for name in args.benchmarks:
+            output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), "--run", name]
+                    + child_arguments(args))
+            results = json.loads(output.decode().strip().splitlines()[-1],
+                                 object_pairs_hook=OrderedDict)
+            report["results"][name] = results
+            print("{}\t{}".format(name, json.dumps(results)))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f, object_pairs_hook=OrderedDict)
+        regressions = compare(report, previous, args.max_slowdown)
+        if regressions:
+            print("FAILED: slower than {} for {}.".format(
+                    args.compare, ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""Synthetic FINSURF data files, in the layout of the real ones.
+
+The real regulatory and score files (and the feature tables of
+plot_contribution.py) are too large to be used for quick measurements ; this
+script writes smaller files with the same columns, bgzipped and
+tabix-indexed, plus VCF inputs with a chosen size and variant type mix:
+
+    python benchmarks/synthetic.py -o /tmp/finsurf_data --variants 100000 \
+                                   --mix SNV=0.7,INS=0.1,DEL=0.1,INDEL=0.1
+
+- 'regulatory.bed.gz': chrom, start, end, element id, genes ;
+- 'scores.tsv.gz': one line per base of the regulatory elements (0-based),
+  chrom, start, end, ref, alt, transition score, transversion score ;
+- 'variants.vcf': a header line and the first five VCF columns, with a
+  fraction of the variants inside regulatory elements ;
+- with '--feature_positions', 'NUM_FEATURES.tsv.gz', 'SCALED_NUM_FEATURES
+  .tsv.gz', 'FULL_FC_transition.tsv.gz', 'FULL_FC_transversion.tsv.gz' and
+  'rename_columns_model.tsv' for the first bases of the elements.
+
+Files are generated from a seed, so that the same parameters always give the
+same files.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "scripts"))
+
+import tabix_utils
+
+BASES = "ACGT"
+variant_types = ("SNV", "INS", "DEL", "INDEL")
+
+
+def parse_mix(text):
+    """ Parse 'SNV=0.7,INS=0.1,...' into normalized weights. """
+    mix = dict((vartype, 0.0) for vartype in variant_types)
+    for item in text.split(","):
+        vartype, weight = item.split("=")
+        if vartype not in mix:
+            raise ValueError("Unknown variant type: {}".format(vartype))
+        mix[vartype] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Empty variant type mix: {}".format(text))
+    return dict((vartype, weight / total) for vartype, weight in mix.items())
+
+
+def make_elements(n_chroms, chrom_size, n_elements, mean_length, seed=0):
+    """ Draw sorted, possibly overlapping, regulatory elements.
+
+    Returns:
+        list of (chrom, start, end, element id, genes), 0-based starts.
+    """
+    rng = random.Random(seed)
+    chroms = ["chr{}".format(i + 1) for i in range(n_chroms)]
+    genes = ["GENE{}".format(i) for i in range(max(1, n_elements // 10))]
+    elements = []
+    for chrom in chroms:
+        starts = sorted(rng.randrange(0, chrom_size - 2 * mean_length)
+                        for _ in range(n_elements // n_chroms))
+        for start in starts:
+            length = max(1, int(rng.expovariate(1.0 / mean_length)))
+            elements.append((chrom, start, min(start + length, chrom_size),
+                             "EL{}".format(len(elements)),
+                             ",".join(rng.sample(genes, rng.randint(1, 3)))))
+    return elements
+
+
+def covered_bases(elements):
+    """ Yield (chrom, position) for each base covered by the elements. """
+    chrom = None
+    last = -1
+    for el_chrom, start, end, _, _ in elements:
+        if el_chrom != chrom:
+            chrom, last = el_chrom, -1
+        for pos in range(max(start, last), end):
+            yield chrom, pos
+        last = max(last, end)
+
+
+def write_regulatory(path, elements):
+    tabix_utils.write_tabix(("{}\t{}\t{}\t{}\t{}".format(*element)
+                             for element in elements), path)
+
+
+def write_scores(path, elements, seed=0):
+    rng = random.Random(seed)
+    tabix_utils.write_tabix(
+        ("{0}\t{1}\t{2}\t{3}\t{4}\t{5:.4f}\t{6:.4f}".format(
+            chrom, pos, pos + 1, rng.choice(BASES), rng.choice(BASES),
+            rng.random(), rng.random())
+         for chrom, pos in covered_bases(elements)),
+        path, zero_based=True)
+
+
+def draw_alleles(rng, vartype):
+    ref = rng.choice(BASES)
+    if vartype == "SNV":
+        return ref, rng.choice(BASES.replace(ref, ""))
+    inserted = "".join(rng.choice(BASES) for _ in range(rng.randint(1, 10)))
+    if vartype == "INS":
+        return ref, ref + inserted
+    if vartype == "DEL":
+        return ref + inserted, ref
+    return ref + inserted, "".join(rng.choice(BASES)
+                                   for _ in range(rng.randint(2, 10)))
+
+
+def write_vcf(path, elements, n_variants, mix, chrom_size, in_elements=0.5,
+              seed=0):
+    """ Write a VCF of 'n_variants', a fraction 'in_elements' of them starting
+    inside regulatory elements, the others anywhere on the chromosomes.
+    Variants are not sorted, as in the inputs of the web server.
+    """
+    rng = random.Random(seed)
+    chroms = sorted(set(element[0] for element in elements))
+    types = [vartype for vartype in variant_types if mix[vartype] > 0]
+    weights = [mix[vartype] for vartype in types]
+    with open(path, "w") as f:
+        f.write("#CHROM\tPOS\tID\tREF\tALT\n")
+        for k in range(n_variants):
+            if rng.random() < in_elements:
+                chrom, start, end, _, _ = rng.choice(elements)
+                pos = rng.randrange(start, end) + 1
+            else:
+                chrom, pos = rng.choice(chroms), rng.randrange(1, chrom_size)
+            vartype = rng.choices(types, weights)[0]
+            ref, alt = draw_alleles(rng, vartype)
+            f.write("{}\t{}\trs{}\t{}\t{}\n".format(chrom, pos, k, ref, alt))
+
+
+def write_feature_tables(out_dir, elements, n_positions, n_features=100,
+                         seed=0):
+    """ Write the tables of plot_contribution.py for the first bases covered
+    by the elements.
+
+    Returns:
+        list of the (chrom, 1-based position) in the tables.
+    """
+    rng = random.Random(seed)
+    positions = []
+    for chrom, pos in covered_bases(elements):
+        if len(positions) >= n_positions:
+            break
+        positions.append((chrom, pos))
+    for name in ("NUM_FEATURES", "SCALED_NUM_FEATURES", "FULL_FC_transition",
+                 "FULL_FC_transversion"):
+        tabix_utils.write_tabix(
+            ("{}\t{}\t{}\tN\t{}".format(
+                chrom, pos, pos + 1,
+                "\t".join("{:.4f}".format(rng.uniform(-1, 1))
+                          for _ in range(n_features)))
+             for chrom, pos in positions),
+            os.path.join(out_dir, name + ".tsv.gz"), zero_based=True)
+    with open(os.path.join(out_dir, "rename_columns_model.tsv"), "w") as f:
+        f.write("old\tnew\n")
+        f.write("col0\tVariant type\n")
+        for k in range(1, n_features):
+            f.write("col{0}\tfeature_{0}\n".format(k))
+    return [(chrom, pos + 1) for chrom, pos in positions]
+
+
+def make_dataset(out_dir, n_variants=100000, mix=None, n_chroms=2,
+                 chrom_size=10000000, n_elements=2000, mean_length=500,
+                 in_elements=0.5, feature_positions=0, seed=0):
+    """ Write all the files of a synthetic dataset in 'out_dir'.
+
+    Returns:
+        dict name -> path of the files (and 'plot_positions').
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if mix is None:
+        mix = parse_mix("SNV=0.7,INS=0.1,DEL=0.1,INDEL=0.1")
+    elements = make_elements(n_chroms, chrom_size, n_elements, mean_length,
+                             seed)
+    paths = {"regulatory": os.path.join(out_dir, "regulatory.bed.gz"),
+             "score": os.path.join(out_dir, "scores.tsv.gz"),
+             "vcf": os.path.join(out_dir, "variants.vcf")}
+    write_regulatory(paths["regulatory"], elements)
+    write_scores(paths["score"], elements, seed)
+    write_vcf(paths["vcf"], elements, n_variants, mix, chrom_size,
+              in_elements, seed)
+    if feature_positions:
+        paths["plot_positions"] = write_feature_tables(
+                out_dir, elements, feature_positions, seed=seed)
+        for name in ("NUM_FEATURES", "SCALED_NUM_FEATURES",
+                     "FULL_FC_transition", "FULL_FC_transversion"):
+            paths[name] = os.path.join(out_dir, name + ".tsv.gz")
+        paths["rename"] = os.path.join(out_dir, "rename_columns_model.tsv")
+    return paths
+
+
+def add_dataset_arguments(parser):
+    """ Options of 'make_dataset', shared with bench_suite.py. """
+    parser.add_argument("--variants",
+                        type=int,
+                        help="Number of variants of the VCF.",
+                        default=100000)
+    parser.add_argument("--mix",
+                        type=parse_mix,
+                        help="Proportions of the variant types.",
+                        default="SNV=0.7,INS=0.1,DEL=0.1,INDEL=0.1")
+    parser.add_argument("--chroms",
+                        type=int,
+                        help="Number of chromosomes.",
+                        default=2)
+    parser.add_argument("--chrom_size",
+                        type=int,
+                        help="Size of each chromosome.",
+                        default=10000000)
+    parser.add_argument("--elements",
+                        type=int,
+                        help="Number of regulatory elements.",
+                        default=2000)
+    parser.add_argument("--element_length",
+                        type=int,
+                        help="Mean length of the regulatory elements.",
+                        default=500)
+    parser.add_argument("--in_elements",
+                        type=float,
+                        help="Fraction of the variants drawn inside "
+                             "regulatory elements.",
+                        default=0.5)
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Seed of the random generator.",
+                        default=0)
+    return parser
+
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o",
+                        "--output_dir",
+                        type=str,
+                        help="Directory of the generated files.",
+                        required=True)
+    parser.add_argument("--feature_positions",
+                        type=int,
+                        help="Number of positions of the feature tables (none "
+                             "by default).",
+                        default=0)
+    return add_dataset_arguments(parser)
+
+
+def main():
+    args = argparser().parse_args()
+    paths = make_dataset(args.output_dir, args.variants, args.mix,
+                         args.chroms, args.chrom_size, args.elements,
+                         args.element_length, args.in_elements,
+                         args.feature_positions, args.seed)
+    for name, path in sorted(paths.items()):
+        if name != "plot_positions":
+            print("{}\t{}".format(name, path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Checkpoints of run_intersect, to resume an interrupted run.
+
+With a run directory, the results of each chunk of variants are saved once
+the chunk is scored ('chunk_<i>.tsv', one '<key>\\t<result row>' line per
+result), and 'manifest.json' records the completed chunks, with the number of
+variants read after each of them. Chunks complete in input order, even with
+worker processes, so the completed chunks are always the first ones.
+
+A resumed run reads the input again but skips the scoring of the completed
+chunks: their saved results are added back to the result sink, then the run
+goes on from the first chunk left, and ends with the usual merge and sort.
+
+The manifest also holds the size and modification time of the input, score
+and regulatory files, and the parameters the results depend on: a run is not
+resumed if any of them changed.
+"""
+
+import hashlib
+import json
+import os
+
+import result_cache
+
+CHECKPOINT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+class StaleCheckpointError(ValueError):
+    """ The checkpoint does not match the files or parameters of the run. """
+
+
+def file_stamps(files):
+    """ Stamps of the data files (see 'result_cache.file_stamp'). """
+    return dict((name, result_cache.file_stamp(path))
+                for name, path in files.items())
+
+
+def parameters_digest(parameters):
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True)
+                          .encode("utf8")).hexdigest()
+
+
+class Checkpoint(object):
+    """ Per-chunk results of a run, saved in 'run_dir'.
+
+    Args:
+        run_dir(str): directory of the checkpoint (created if needed).
+        files(dict): name ('input', 'score', 'regulatory') -> path of the
+                     files of the run.
+        parameters(list): other parameters the results depend on (JSON
+                          serializable).
+        resume(bool): resume from the chunks saved in 'run_dir' ; otherwise
+                      previous checkpoints are removed.
+    Raises:
+        StaleCheckpointError: when resuming, if there is no checkpoint in
+                              'run_dir' or if a file or parameter changed.
+    """
+
+    def __init__(self, run_dir, files, parameters, resume=False):
+        self.run_dir = run_dir
+        manifest = {"version": CHECKPOINT_VERSION,
+                    "files": file_stamps(files),
+                    "parameters": parameters_digest(parameters),
+                    "chunks": []}
+        path = os.path.join(run_dir, MANIFEST)
+        if resume:
+            if not os.path.exists(path):
+                raise StaleCheckpointError(
+                        "no checkpoint to resume from in {}.".format(run_dir))
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("version") != CHECKPOINT_VERSION:
+                raise StaleCheckpointError(
+                        "the checkpoint of {} was written by another "
+                        "version.".format(run_dir))
+            for name, stamp in manifest["files"].items():
+                if saved["files"].get(name) != stamp:
+                    raise StaleCheckpointError(
+                            "the {} file changed since the checkpoint of "
+                            "{}.".format(name, run_dir))
+            if saved["parameters"] != manifest["parameters"]:
+                raise StaleCheckpointError(
+                        "the parameters of the run differ from the ones of "
+                        "the checkpoint of {}.".format(run_dir))
+            manifest["chunks"] = saved["chunks"]
+        else:
+            if not os.path.exists(run_dir):
+                os.makedirs(run_dir)
+            for name in os.listdir(run_dir):
+                if name.startswith("chunk_"):
+                    os.remove(os.path.join(run_dir, name))
+        self.manifest = manifest
+        self._write_manifest()
+
+    @property
+    def n_completed(self):
+        return len(self.manifest["chunks"])
+
+    def chunk_path(self, chunk):
+        return os.path.join(self.run_dir, "chunk_{:06d}.tsv".format(chunk))
+
+    def check(self, chunk, variants):
+        """ Check a completed chunk read again from the input.
+
+        Returns:
+            None, or a str with the error message.
+        """
+        if self.manifest["chunks"][chunk]["variants"] != variants:
+            return ("Error: chunk {} of the input doesn't match the checkpoint "
+                    "of {}.".format(chunk, self.run_dir))
+        return None
+
+    def load(self, chunk):
+        """ Saved (key, results) items of a completed chunk (keys None for a
+        serial run, see 'save').
+        """
+        items = []
+        with open(self.chunk_path(chunk)) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                items.append((int(fields[0]) if fields[0] else None,
+                              fields[1:]))
+        return items
+
+    def save(self, chunk, variants, items):
+        """ Save the (key, results) items of the next chunk.
+
+        The chunk file is written before the manifest lists the chunk, both
+        under temporary names, so that an interrupted save is only lost.
+        """
+        path = self.chunk_path(chunk)
+        with open(path + ".part", "w") as f:
+            for key, results in items:
+                f.write(("" if key is None else str(key)) + "\t"
+                        + "\t".join(results) + "\n")
+        os.replace(path + ".part", path)
+        offset = variants
+        if self.manifest["chunks"]:
+            offset += self.manifest["chunks"][-1]["offset"]
+        self.manifest["chunks"].append({"variants": variants,
+                                        "offset": offset})
+        self._write_manifest()
+
+    def _write_manifest(self):
+        path = os.path.join(self.run_dir, MANIFEST)
+        with open(path + ".part", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(path + ".part", path)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Bitmaps of the bases covered by the FINSURF regulatory regions.
+
+Most variants of a VCF fall outside any regulatory element ; with a coverage
+bitmap, finsurf.py drops their bases before any index query is made:
+
+    python scripts/coverage_bitmap.py -g static/data/FINSURF_REGULATORY_REGIONS_GENES.bed.gz \
+                                      -o static/data/regulatory_coverage
+    python scripts/finsurf.py ... -cv static/data/regulatory_coverage
+
+For each chromosome, '<chrom>.npy' holds one bit per base (numpy.packbits
+order), set when a tabix query on that base returns at least one record of the
+regulatory file. 'manifest.json' records the format version and the size and
+modification time of the regulatory file, so that a bitmap built from another
+or an older file is refused.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import tabix_utils
+
+###############################################################################
+# DEFINITIONS
+
+COVERAGE_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+class StaleCoverageError(ValueError):
+    """ The bitmap does not match the regulatory file or this version. """
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return {"source_size": stat.st_size, "source_mtime": stat.st_mtime}
+
+
+def build_coverage(bed_file_path, out_dir):
+    """ Write the coverage bitmaps of a tabix-indexed file. """
+    index = tabix_utils.read_tbi(bed_file_path)
+    reader = tabix_utils.BgzfReader(bed_file_path)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        os.remove(os.path.join(out_dir, MANIFEST))
+
+    chroms = []
+    try:
+        for chrom in index.names:
+            # Same intervals as the ones tabix uses to select the records.
+            intervals = [(max(beg, 0), end) for beg, end, _ in
+                         tabix_utils.iter_records(reader, index, chrom)
+                         if end > max(beg, 0)]
+            if not intervals:
+                continue
+            covered = np.zeros(max(end for _, end in intervals), dtype=bool)
+            for beg, end in intervals:
+                covered[beg:end] = True
+            np.save(os.path.join(out_dir, chrom + ".npy"), np.packbits(covered))
+            chroms.append(chrom)
+    finally:
+        reader.close()
+
+    manifest = {"version": COVERAGE_VERSION,
+                "source": os.path.abspath(bed_file_path),
+                "chroms": chroms}
+    manifest.update(file_stamp(bed_file_path))
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+class CoverageMap(object):
+    """ Memory-mapped coverage bitmaps built by 'build_coverage'.
+
+    Args:
+        path(str): bitmap directory.
+        bed_file_path(str): regulatory file the bitmaps must correspond to.
+    Raises:
+        StaleCoverageError: if the bitmaps were built by another version, or
+                            from another or an older regulatory file.
+    """
+
+    def __init__(self, path, bed_file_path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != COVERAGE_VERSION:
+            raise StaleCoverageError(
+                "Coverage bitmap {} has version {}, expected {}: please "
+                "rebuild it.".format(path, self.manifest.get("version"),
+                                     COVERAGE_VERSION))
+        stamp = file_stamp(bed_file_path)
+        if any(self.manifest[k] != v for k, v in stamp.items()):
+            raise StaleCoverageError(
+                "Coverage bitmap {} was not built from {} (or the file changed "
+                "since): please rebuild it.".format(path, bed_file_path))
+        self.chroms = frozenset(self.manifest["chroms"])
+        self._bits = {}
+
+    def _chrom_bits(self, chrom):
+        if chrom not in self._bits:
+            self._bits[chrom] = np.load(os.path.join(self.path, chrom + ".npy"),
+                                        mmap_mode="r")
+        return self._bits[chrom]
+
+    def covered(self, chroms, positions):
+        """ Whether 0-based positions are covered by a regulatory record.
+
+        Args:
+            chroms(array-like): chromosome of each position.
+            positions(array-like): 0-based positions.
+        Returns:
+            array of bool.
+        """
+        chroms = np.asarray(chroms, dtype=object)
+        positions = np.asarray(positions, dtype="int64")
+        result = np.zeros(len(positions), dtype=bool)
+        for chrom in set(chroms.tolist()):
+            if chrom not in self.chroms:
+                continue
+            bits = self._chrom_bits(chrom)
+            select = np.nonzero(chroms == chrom)[0]
+            pos = positions[select]
+            inside = (pos >= 0) & (pos < 8 * len(bits))
+            select, pos = select[inside], pos[inside]
+            result[select] = (bits[pos >> 3] >> (7 - (pos & 7))) & 1 == 1
+        return result
+
+
+_coverages = {}
+
+def open_coverage(path, bed_file_path):
+    """ Open the bitmaps once per process. """
+    key = (os.path.abspath(path), os.path.abspath(bed_file_path))
+    if key not in _coverages:
+        _coverages[key] = CoverageMap(path, bed_file_path)
+    return _coverages[key]
+
+
+# Argument parser
+# ===============
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-g",
+                        "--gene",
+                        type=str,
+                        help="Path to the tabix-indexed regulatory gene file.",
+                        required=True)
+    parser.add_argument("-o",
+                        "--output_dir",
+                        type=str,
+                        help="Bitmap directory to create.",
+                        required=True)
+    return parser
+
+def main():
+    args = argparser().parse_args()
+    manifest = build_coverage(args.gene, args.output_dir)
+    print("Coverage bitmap written to {} ({} chromosomes).".format(
+            args.output_dir, len(manifest["chroms"])))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
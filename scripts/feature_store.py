@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""Compile the feature tables into a compressed, chunked columnar store.
+
+The tables used by plot_contribution.py (NUM_FEATURES, SCALED_NUM_FEATURES,
+FULL_FC_transition and FULL_FC_transversion) are bgzipped text, with about a
+hundred values per position. Each of them can be converted into a store of
+binary arrays, so that a lookup returns a vector of floats without parsing
+text:
+
+    python scripts/feature_store.py -t static/data/FULL_FC_transition.tsv.gz \
+                                    -o static/data/FULL_FC_transition.store
+
+The store directory is then given to plot_contribution.py in place of the
+table.
+
+Layout: the records of each chromosome are grouped, in file order, in chunks
+of '--chunk_rows' records. For each chunk, '<chrom>.bin' holds the start and
+end positions of the records and their values (column-major, float32 or
+float16), byte-shuffled and compressed with zlib. '<chrom>.chunks.npy' gives
+for each chunk its first start position, the largest end position up to it,
+its offset and size in '<chrom>.bin' and its number of records.
+'manifest.json' records the format version, the number of values per record,
+their type, and the size and modification time of the source table.
+
+The records found for a position are the ones a tabix query "chrom:pos-pos"
+returns.
+"""
+
+import argparse
+import json
+import os
+import sys
+import zlib
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import tabix_utils
+
+###############################################################################
+# DEFINITIONS
+
+STORE_VERSION = 1
+MANIFEST = "manifest.json"
+# Values start at the 5th column of the tables (chrom, start, end, ref).
+FIRST_VALUE_COLUMN = 4
+CHUNK_DTYPE = np.dtype([("beg", "int64"), ("max_end", "int64"),
+                        ("offset", "int64"), ("size", "int64"),
+                        ("rows", "int64")])
+
+
+class StaleStoreError(ValueError):
+    """ The store does not match its source table or this version. """
+
+
+def is_feature_store(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def shuffle_bytes(array):
+    """ Group the bytes of same rank of each value (compresses better). """
+    return np.ascontiguousarray(
+                array.reshape(-1).view("uint8")
+                     .reshape(-1, array.dtype.itemsize).T).tobytes()
+
+
+def unshuffle_bytes(data, dtype, count):
+    return np.frombuffer(data, dtype="uint8").reshape(dtype.itemsize, count) \
+             .T.copy().view(dtype).reshape(count)
+
+
+def encode_chunk(begs, ends, values):
+    # Positions are stored as deltas (mostly 1) and lengths, which compress
+    # to almost nothing.
+    return zlib.compress(shuffle_bytes(np.diff(begs, prepend=0))
+                         + shuffle_bytes(ends - begs)
+                         + shuffle_bytes(np.asfortranarray(values).T), 6)
+
+
+def decode_chunk(data, rows, n_values, dtype):
+    data = zlib.decompress(data)
+    position_size = 8 * rows
+    begs = np.cumsum(unshuffle_bytes(data[:position_size],
+                                     np.dtype("int64"), rows))
+    ends = begs + unshuffle_bytes(data[position_size:2 * position_size],
+                                  np.dtype("int64"), rows)
+    values = unshuffle_bytes(data[2 * position_size:], dtype,
+                             rows * n_values).reshape(n_values, rows).T
+    return begs, ends, values
+
+
+def build_store(table_path, out_dir, dtype="float32", chunk_rows=4096,
+                read_rows=1000000):
+    """ Convert a tabix-indexed table into a store directory. """
+    index = tabix_utils.read_tbi(table_path, header_only=True)
+    dtype = np.dtype(dtype)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        os.remove(os.path.join(out_dir, MANIFEST))
+
+    reader = pd.read_csv(table_path, sep="\t", header=None,
+                         comment=index.meta, chunksize=read_rows,
+                         compression="gzip")
+    chroms = OrderedDict()
+    n_values = None
+    state = {"chrom": None, "out": None, "chunks": [], "max_end": -1,
+             "pending": []}
+
+    def flush(final=False):
+        # Write the pending records by chunks of 'chunk_rows'.
+        if not state["pending"]:
+            return
+        begs = np.concatenate([p[0] for p in state["pending"]])
+        ends = np.concatenate([p[1] for p in state["pending"]])
+        values = np.concatenate([p[2] for p in state["pending"]])
+        stop = len(begs) if final else len(begs) - len(begs) % chunk_rows
+        for first in range(0, stop, chunk_rows):
+            last = min(first + chunk_rows, stop)
+            data = encode_chunk(begs[first:last], ends[first:last],
+                                values[first:last])
+            state["max_end"] = max(state["max_end"],
+                                   int(ends[first:last].max()))
+            state["chunks"].append((begs[first], state["max_end"],
+                                    state["out"].tell(), len(data),
+                                    last - first))
+            state["out"].write(data)
+        state["pending"] = ([(begs[stop:], ends[stop:], values[stop:])]
+                            if stop < len(begs) else [])
+
+    def close_chrom():
+        if state["chrom"] is None:
+            return
+        flush(final=True)
+        state["out"].close()
+        np.save(os.path.join(out_dir, state["chrom"] + ".chunks.npy"),
+                np.array(state["chunks"], dtype=CHUNK_DTYPE))
+        chroms[state["chrom"]] = sum(c[4] for c in state["chunks"])
+
+    for chunk in reader:
+        if n_values is None:
+            n_values = chunk.shape[1] - FIRST_VALUE_COLUMN
+        seqs = chunk.iloc[:, index.col_seq - 1].astype(str).to_numpy()
+        beg = chunk.iloc[:, index.col_beg - 1].to_numpy().astype("int64")
+        # Same rules as 'tabix_utils.record_interval'.
+        if index.format & tabix_utils.TBX_UCSC:
+            end = beg + 1
+        else:
+            beg = beg - 1
+            end = beg + 1
+        beg, end = np.maximum(beg, 0), np.maximum(end, 1)
+        if index.col_end:
+            end = chunk.iloc[:, index.col_end - 1].to_numpy().astype("int64")
+        values = chunk.iloc[:, FIRST_VALUE_COLUMN:].to_numpy(dtype=dtype)
+
+        boundaries = np.r_[0, np.nonzero(seqs[1:] != seqs[:-1])[0] + 1,
+                           len(seqs)]
+        for first, last in zip(boundaries[:-1], boundaries[1:]):
+            if seqs[first] != state["chrom"]:
+                close_chrom()
+                if seqs[first] in chroms:
+                    raise ValueError("Table is not sorted: {} found twice."
+                                     .format(seqs[first]))
+                state.update(chrom=seqs[first], chunks=[], max_end=-1,
+                             pending=[],
+                             out=open(os.path.join(out_dir,
+                                                   seqs[first] + ".bin"),
+                                      "wb"))
+            state["pending"].append((beg[first:last], end[first:last],
+                                     values[first:last]))
+        flush()
+    close_chrom()
+
+    stat = os.stat(table_path)
+    manifest = {"version": STORE_VERSION,
+                "source": os.path.abspath(table_path),
+                "source_size": stat.st_size,
+                "source_mtime": stat.st_mtime,
+                "dtype": dtype.name,
+                "n_values": n_values,
+                "records": chroms}
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+class FeatureStore(object):
+    """ Reader of a store built by 'build_store'.
+
+    Args:
+        path(str): store directory.
+        cache_chunks(int): number of decompressed chunks kept in memory.
+    Raises:
+        StaleStoreError: if the store was built by another version, or if its
+                         source table changed since (a missing source table is
+                         only reported on stderr).
+    """
+
+    def __init__(self, path, cache_chunks=64):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != STORE_VERSION:
+            raise StaleStoreError(
+                "Feature store {} has version {}, expected {}: please rebuild "
+                "it.".format(path, self.manifest.get("version"), STORE_VERSION))
+        source = self.manifest["source"]
+        if not os.path.exists(source):
+            print("Warning: source {} of feature store {} not found, the store "
+                  "can't be checked for staleness.".format(source, path),
+                  file=sys.stderr)
+        else:
+            stat = os.stat(source)
+            if (stat.st_size != self.manifest["source_size"]
+                    or stat.st_mtime != self.manifest["source_mtime"]):
+                raise StaleStoreError(
+                    "Feature store {} is older than its source {}: please "
+                    "rebuild it.".format(path, source))
+        self.dtype = np.dtype(self.manifest["dtype"])
+        self.n_values = self.manifest["n_values"]
+        self.cache_chunks = cache_chunks
+        self._chunks = {}
+        self._files = {}
+        self._cache = OrderedDict()
+
+    def _chrom_chunks(self, chrom):
+        if chrom not in self._chunks:
+            self._chunks[chrom] = np.load(os.path.join(self.path,
+                                                       chrom + ".chunks.npy"))
+            self._files[chrom] = open(os.path.join(self.path, chrom + ".bin"),
+                                      "rb")
+        return self._chunks[chrom]
+
+    def _chunk(self, chrom, k):
+        key = (chrom, k)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        chunk = self._chrom_chunks(chrom)[k]
+        f = self._files[chrom]
+        f.seek(int(chunk["offset"]))
+        decoded = decode_chunk(f.read(int(chunk["size"])), int(chunk["rows"]),
+                               self.n_values, self.dtype)
+        self._cache[key] = decoded
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return decoded
+
+    def _candidate_chunks(self, chrom, beg, end):
+        chunks = self._chrom_chunks(chrom)
+        # Chunks before 'first' only hold records ending before 'beg' ; chunks
+        # from 'last' on only hold records starting at or after 'end'.
+        first = np.searchsorted(chunks["max_end"], beg, side="right")
+        last = np.searchsorted(chunks["beg"], end, side="left")
+        return range(first, last)
+
+    def query(self, chrom, pos):
+        """ Value vectors of the records at a 1-based position.
+
+        Returns:
+            list of numpy arrays, one per record, in file order.
+        """
+        if chrom not in self.manifest["records"]:
+            return []
+        hits = []
+        for k in self._candidate_chunks(chrom, pos - 1, pos):
+            begs, ends, values = self._chunk(chrom, k)
+            selected = np.nonzero((begs < pos) & (ends > pos - 1))[0]
+            hits.extend(values[i] for i in selected)
+        return hits
+
+    def query_many(self, positions):
+        """ Value vectors of the records at many positions.
+
+        Positions are processed in sorted order, so that each chunk is
+        decompressed once.
+
+        Args:
+            positions(list): (chrom, pos) with 1-based positions.
+        Returns:
+            dict (chrom, pos) -> list of numpy arrays.
+        """
+        return OrderedDict((position, self.query(*position))
+                           for position in sorted(set(positions)))
+
+    def matrix(self, positions):
+        """ Matrix of the values at many positions.
+
+        Returns:
+            (matrix, counts): array (len(positions), n_values) with the values
+            of the record at each position (NaN unless exactly one record was
+            found), and the number of records found for each position.
+        """
+        found = self.query_many(positions)
+        matrix = np.full((len(positions), self.n_values), np.nan,
+                         dtype=self.dtype)
+        counts = np.zeros(len(positions), dtype="int64")
+        for row, position in enumerate(positions):
+            hits = found[position]
+            counts[row] = len(hits)
+            if len(hits) == 1:
+                matrix[row] = hits[0]
+        return matrix, counts
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._chunks = {}
+        self._cache = OrderedDict()
+
+
+_stores = {}
+
+def open_store(path):
+    """ Open a store once per process. """
+    key = (os.getpid(), os.path.abspath(path))
+    if key not in _stores:
+        _stores[key] = FeatureStore(path)
+    return _stores[key]
+
+
+# Argument parser
+# ===============
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-t",
+                        "--table",
+                        type=str,
+                        help="Path to the tabix-indexed feature table.",
+                        required=True)
+    parser.add_argument("-o",
+                        "--output_dir",
+                        type=str,
+                        help="Store directory to create.",
+                        required=True)
+    parser.add_argument("--dtype",
+                        type=str,
+                        help="Type of the stored values.",
+                        choices=["float16", "float32"],
+                        default="float32")
+    parser.add_argument("--chunk_rows",
+                        type=int,
+                        help="Number of records per compressed chunk.",
+                        default=4096)
+    return parser
+
+def main():
+    args = argparser().parse_args()
+    manifest = build_store(args.table, args.output_dir, args.dtype,
+                           args.chunk_rows)
+    size = sum(os.path.getsize(os.path.join(args.output_dir, f))
+               for f in os.listdir(args.output_dir))
+    print("Feature store written to {} ({} records, {:.1f} MB, table: "
+          "{:.1f} MB).".format(args.output_dir,
+                               sum(manifest["records"].values()), size / 1e6,
+                               os.path.getsize(args.table) / 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,18 +3,29 @@
 
 
 import argparse
+import bisect
+import gzip
+import json
+import multiprocessing
 import os
-import re
 import sys
-import subprocess
 
+import numpy as np
 import pandas as pd
 
-import tabix
-
+import checkpoint
+import coverage_bitmap
+import interval_index
+import profiling
+import result_cache
+import result_formats
+import score_store
+import tabix_utils
 import utils
+import vcf_reader
 
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict, deque, namedtuple
+from result_sink import ResultSink
 
 chroms_chr = ['chr'+str(i) for i in range(1, 23)]+['chrX','chrY']
 chroms = [chrom.strip('chr') for chrom in chroms_chr] 
@@ -22,15 +33,18 @@ chroms = [chrom.strip('chr') for chrom in chroms_chr]
 Record = namedtuple("Record",
             ["chrom","start","end","id","ref","alt","vartype", "vartrans"])
 
-colnames = ["chrom", "pos", "start", "end","id","ref","alt","local_var_id","vartype","vartrans","ucsc_link","el_id","genes"]
+# Columns of the expanded bases (see 'expand_regions').
+base_columns = ["chrom", "row_id", "start", "end"]
 chunksize = 5000
+# Maximum number of expanded bases intersected at once (see 'iter_expanded').
+expand_batch_size = 100000
 
 def tabix_list_chrom(bed_file_path):
     # This function might be necessary to face cases where the chromosome in
     # the bw file is encoded without the "chr" string. In which case variants
     # must be converted ('chr1' => '1')
-    process = subprocess.Popen(['tabix','-l',bed_file_path],stdout=subprocess.PIPE) 
-    return [chrom.strip() for chrom in process.stdout]
+    # Names are read from the '.tbi' file once per process (no 'tabix -l').
+    return tabix_utils.registry.chroms(bed_file_path)
 
 def bedfile_intersect_index(df_regions, bed_file_path):
     """ Annotate positions in dataframe with bedfile content (tabix indexed).
@@ -49,6 +63,11 @@ def bedfile_intersect_index(df_regions, bed_file_path):
     For each query, results are evaluated so that if a query did not match a
     region, it is associated to 'None'.
 
+    Consecutive rows covering contiguous positions (typically the bases of an
+    expanded deletion) are grouped into a single span: tabix is queried once
+    for the whole span, and the records returned are then split back to each
+    row in memory, with the same rules as a query for each row.
+
     Args:
         df_regions(dataframe): dataframe with regions to annotate.
         bed_file_path(str): path to bedfile ('.tbi' file should be in the same
@@ -57,131 +76,326 @@ def bedfile_intersect_index(df_regions, bed_file_path):
         list of annotations. eg [["chr","start","end","state"]] for 1 region.
 
     """
-    # Query with tabix library.
-    bed_tabix = tabix.open(bed_file_path)
+    # Query with tabix library (handles are opened once per process).
+    bed_tabix = tabix_utils.registry.tabix(bed_file_path)
+    index = tabix_utils.registry.index(bed_file_path)
     list_chrom_tbx = tabix_list_chrom(bed_file_path)
-    try:
-        list_chrom_tbx = [v.decode('utf8') for v in list_chrom_tbx]
-    except:
-        list_chrom_tbx = list_chrom_tbx
-    
+
     all_results = dict()
+    spans = [] # [chrom, beg, end, [(variant_key, beg, end), ...]]
     df_range = len(df_regions.columns)
-    for index,row in df_regions.iloc[:,range(0,df_range)].iterrows():
+    for row in df_regions.iloc[:,range(0,df_range)].itertuples(index=False):
         variant_key = "@".join(str(c) for c in row)
         if variant_key not in all_results:
             all_results[variant_key] = []
-        if row.chrom in list_chrom_tbx:
-            query_str = str(row.iloc[0]) + ":" + str(int(row.iloc[2])+1) + "-" + str(row.iloc[3])
-            query_res = bed_tabix.querys(query_str)
+        # Same interval as the tabix query "chrom:start+1-end".
+        chrom, beg, end = str(row[0]), int(row[2]), int(row[3])
+        span = spans[-1] if spans else None
+        if span and span[0] == chrom and beg <= span[2] and end >= span[1]:
+            span[1] = min(span[1], beg)
+            span[2] = max(span[2], end)
+            span[3].append((variant_key, beg, end))
+        else:
+            spans.append([chrom, beg, end, [(variant_key, beg, end)]])
 
-            res = list(query_res)
+    for chrom, span_beg, span_end, rows in spans:
+        if chrom not in list_chrom_tbx:
+            for variant_key, _, _ in rows:
+                all_results[variant_key].append(None)
+            continue
+
+        query_str = chrom + ":" + str(span_beg+1) + "-" + str(span_end)
+        query_res = bed_tabix.querys(query_str)
+        records = [tabix_utils.record_interval(fields, index) + (fields,)
+                   for fields in query_res]
+        profiling.count("tabix_queries")
+        profiling.count("tabix_records", len(records))
+        max_ends = []
+        for rec in records:
+            max_ends.append(max(rec[1], max_ends[-1]) if max_ends else rec[1])
+        hits = (records, [rec[0] for rec in records], max_ends)
+        for variant_key, beg, end in rows:
+            res = split_span_hits(hits, beg, end)
             # Need to evaluate whether query returned something or not.
             if res:
                 # Multi-hits are taken into account!
                 all_results[variant_key].append(res)
             else:
                 all_results[variant_key].append(None)
+
+    return all_results
+
+def split_span_hits(hits, beg, end):
+    """ Select the records of a span query overlapping [beg, end).
+
+    Args:
+        hits(tuple): (records, begs, max_ends) for the span, where 'records'
+                     are the (beg, end, fields) tuples returned by the query in
+                     file order, 'begs' their start positions, and 'max_ends'
+                     the running maximum of their end positions.
+        beg(int), end(int): 0-based interval of the row, inside the span.
+    Returns:
+        list of fields, in file order.
+    """
+    records, begs, max_ends = hits
+    # Records before 'first' all end before 'beg' ; records from 'last' on all
+    # start after 'end'.
+    first = bisect.bisect_right(max_ends, beg)
+    last = bisect.bisect_left(begs, end)
+    return [fields for rec_beg, rec_end, fields in records[first:last]
+            if rec_end > beg]
+
+def bedfile_intersect_sweep(df_regions, bed_file_path):
+    """ Annotate positions in dataframe with bedfile content (sorted sweep).
+
+    Alternative to 'bedfile_intersect_index' for dense inputs: instead of one
+    tabix query per row, the rows are sorted by (chrom, start) and a single
+    forward merge-join is made over the bgzipped, coordinate-sorted file,
+    starting from the block given by the tabix linear index. Sequential reads
+    thus replace the random seeks of the per-row queries ; across a gap
+    between two rows, the scan skips to the block of the next row.
+
+    The hits are the same as with 'bedfile_intersect_index', including the
+    inclusive behavior of tabix, and are returned in the same structure.
+
+    Args:
+        df_regions(dataframe): dataframe with regions to annotate.
+        bed_file_path(str): path to bedfile ('.tbi' file should be in the same
+                            directory)
+    Returns:
+        dict of annotations, as returned by 'bedfile_intersect_index'.
+
+    """
+    index = tabix_utils.registry.index(bed_file_path)
+    reader = tabix_utils.registry.reader(bed_file_path)
+    list_chrom_tbx = tabix_list_chrom(bed_file_path)
+
+    all_results = dict()
+    queries = []
+    df_range = len(df_regions.columns)
+    for row in df_regions.iloc[:,range(0,df_range)].itertuples(index=False):
+        variant_key = "@".join(str(c) for c in row)
+        if variant_key not in all_results:
+            all_results[variant_key] = []
+        # Same interval as the tabix query "chrom:start+1-end".
+        queries.append((str(row[0]), int(row[2]), int(row[3]), variant_key))
+
+    # Rows are processed by chromosome, in increasing start order.
+    queries.sort(key=lambda q: (q[0], q[1]))
+    pos = 0
+    while pos < len(queries):
+        chrom = queries[pos][0]
+        stop = pos
+        while stop < len(queries) and queries[stop][0] == chrom:
+            stop += 1
+
+        if chrom not in list_chrom_tbx:
+            for _, _, _, variant_key in queries[pos:stop]:
+                all_results[variant_key].append(None)
+            pos = stop
+            continue
+
+        records = tabix_utils.iter_records(reader, index, chrom,
+                                           queries[pos][1])
+        active = [] # records that may still overlap a query, in file order.
+        pending = next(records, None)
+        for _, q_beg, q_end, variant_key in queries[pos:stop]:
+            # Past a gap, records before the block of this query end before
+            # it: the scan starts again from this block.
+            voffset = tabix_utils.start_offset(index, chrom, q_beg)
+            if voffset >> 16 > reader.block_offset:
+                records.close()
+                records = tabix_utils.iter_records(reader, index, chrom, q_beg)
+                active = []
+                pending = next(records, None)
+            while pending is not None and pending[0] < q_end:
+                active.append(pending)
+                pending = next(records, None)
+            # Queries come by increasing start: records ending before this one
+            # won't overlap any of the following queries.
+            active = [r for r in active if r[1] > q_beg]
+            res = [r[2] for r in active if r[0] < q_end]
+            if res:
+                all_results[variant_key].append(res)
+            else:
+                all_results[variant_key].append(None)
+        records.close()
+        pos = stop
+
+    return all_results
+
+def bedfile_intersect_interval(df_regions, bed_file_path):
+    """ Annotate positions in dataframe with bedfile content (interval index).
+
+    The whole file is loaded in memory (see 'interval_index.py'), so this is
+    meant for small files such as the regulatory regions. The overlaps of all
+    the rows are found in a single vectorized query ; the hits are the same
+    as with 'bedfile_intersect_index', including the inclusive behavior of
+    tabix, and are returned in the same structure.
+
+    Args:
+        df_regions(dataframe): dataframe with regions to annotate.
+        bed_file_path(str): path to bedfile ('.tbi' file should be in the same
+                            directory)
+    Returns:
+        dict of annotations, as returned by 'bedfile_intersect_index'.
+
+    """
+    index = interval_index.open_index(bed_file_path)
+
+    all_results = dict()
+    variant_keys = []
+    df_range = len(df_regions.columns)
+    for row in df_regions.iloc[:,range(0,df_range)].itertuples(index=False):
+        variant_key = "@".join(str(c) for c in row)
+        if variant_key not in all_results:
+            all_results[variant_key] = []
+        variant_keys.append(variant_key)
+
+    # Same intervals as the tabix queries "chrom:start+1-end".
+    hits = index.query(df_regions.iloc[:,0].astype(str).to_numpy(),
+                       df_regions.iloc[:,2].astype(int).to_numpy(),
+                       df_regions.iloc[:,3].astype(int).to_numpy())
+    for variant_key, res in zip(variant_keys, hits):
+        if res:
+            all_results[variant_key].append(res)
         else:
             all_results[variant_key].append(None)
 
     return all_results
 
+intersect_engines = {"tabix": bedfile_intersect_index,
+                     "sweep": bedfile_intersect_sweep,
+                     "interval": bedfile_intersect_interval}
 
 
-def build_reader(input_file, chunksize):
-    """ Read a few lines of the input file to build a reader. 
+def build_reader(input_file, chunksize, threads=1, regions=None,
+                 contigs=None):
+    """ Build a streaming reader of the input VCF file.
 
-    Two things are checked:
-    - whether the first line starts with a "#", indicating a potential header
-    - or whether the first line first field is "chrom", indicating again a
-      potential header.
+    The meta-information and header lines are skipped (as well as a first
+    line which is not a variant, for files with a header not starting with
+    "#"), and multi-allelic records are split, see 'vcf_reader'.
+
+    Args:
+        threads(int): number of threads decompressing bgzipped inputs.
+        regions(dict): optional, chromosome -> 0-based intervals the variants
+                       must overlap (read with tabix if the input is indexed).
+        contigs(iterable): optional, known chromosomes ; variants on other
+                           contigs are dropped while parsing.
+    Returns:
+        VcfReader yielding DataFrames of 'chunksize' variants, or a str with
+        the error message.
     """
-    lines = "" 
     try:
-        if bool(re.search(".gz$", input_file)):
-            lines = pd.read_csv(input_file, compression='gzip', nrows=3, header=None, sep="\t", error_bad_lines=False)
-        else:
-            lines = pd.read_csv(input_file, nrows=3, sep="\t", header=None)
+        return vcf_reader.VcfReader(input_file, chunksize=chunksize,
+                                    threads=threads, regions=regions,
+                                    contigs=contigs)
+    except vcf_reader.VcfFormatError as e:
+        return "Error: " + str(e)
     except Exception as e:
         return "Error: " + str(e) + "Please see sample for the right file format."
-    if lines.shape[1]<5:
-        msg = ("Error: in reading your VCF input file: Only {} fields detected, using TAB ; the expected "
-               "number should be at least 5."
-               ).format(lines.shape[1])
-
-        #raise ValueError(msg)
-        return msg
-        
-    first_cell = lines.iloc[0,0]
-
-    if first_cell.startswith("#") or not (first_cell in chroms_chr or first_cell in chroms):
-        # Likely detected the header ; we skip it.
-        reader = pd.read_csv(input_file,
-                             skiprows=1,
-                             chunksize=chunksize,
-                             header=None,
-                             usecols=list(range(0,5)),
-                             names=['chrom','pos','id','ref','alt'],
-                             sep="\t")
 
-    else:
-        reader = pd.read_csv(input_file,
-                             chunksize=chunksize,
-                             header=None,
-                             usecols=list(range(0,5)),
-                             names=['chrom','pos','id','ref','alt'],
-                             sep="\t")
-
-    return reader
-
-def expand_regions(regions, start):
+def expand_regions(regions, start, add_chr=False):
     """Return dataframe with one row per base in a set of regions.
 
     Given a list of regions elements (defined by chromosome, start, and end
-    positions, plus the "ref" and "alt" alleles), this function expands each
-    region and store each 1-base interval in a dataframe.
+    positions), this function expands each region and store each 1-base
+    interval in a dataframe, with the index of its region ("row_id").
 
-    This dataframe thus contain the columns: "chrom", "start", "end", "ref",
-    and "alt".
+    Only the columns "chrom", "row_id", "start" and "end" are repeated for
+    each base: the other fields of the variants are stored once per region,
+    see 'variant_table'.
 
     Args:
         regions(list): a list of "Record" elements, with "chrom", "start",
-                       "end", "ref", and "alt" fields.
+                       and "end" fields.
 
         start(int): idx of the first row from the original dataset (when
                     working with chunks.
 
+        add_chr(bool): whether 'chr' is added to the chromosome names.
+
     Returns:
-        DataFrame: 5 columns, 1-base intervals on each row.
+        DataFrame: 4 columns, 1-base intervals on each row.
 
     """
+    return next(iter_expanded(regions, start, add_chr=add_chr),
+                pd.DataFrame(columns=base_columns))
 
-    columns_varinfo=["chrom","pos","start","end","id",
-                     "ref","alt","row_id","vartype","vartrans"]
+def iter_expanded(regions, start, max_bases=None, add_chr=False, skip=None,
+                  coverage_map=None):
+    """ Expand a list of regions lazily, by batches of bases.
 
-    list_pos = []
-    for row_id, reg in enumerate(regions, start):
-        try:
-            for position in range(reg.start, reg.end):
-            
-                list_pos.append([reg.chrom,
-                    reg.start+1,
-                             position,
-                             position+1,
-                             reg.id,
-                             reg.ref,
-                             reg.alt,
-                             #reg.chrom+'_'+str(row_id), # <chrom>_<index>
-                             str(row_id), # NOTE: modified here for SQL indexing.
-                             reg.vartype,
-                             reg.vartrans])
-        except Exception as e:
-            return "Error"+ e +": at line " + str(row_id + 1) + ": \n" + str(reg)      
-    #
-    expanded_df = pd.DataFrame(list_pos,
-                               columns=columns_varinfo)
-    return expanded_df
+    Same rows as 'expand_regions', yielded as DataFrames of at most
+    'max_bases' rows (all of them in one DataFrame if None): a long deletion
+    is split between batches, so that the memory used doesn't depend on the
+    length of the variants.
+
+    Args:
+        skip(set): optional, indexes (in 'regions') of regions left out, such
+                   as the variants found in the result cache.
+        coverage_map(CoverageMap): optional, bases it doesn't cover are
+                                   dropped from each batch as it is expanded
+                                   (see 'coverage_bitmap.py').
+    """
+    starts = np.array([reg.start for reg in regions], dtype="int64")
+    lengths = np.maximum(np.array([reg.end for reg in regions],
+                                  dtype="int64") - starts, 0)
+    if skip:
+        lengths[sorted(skip)] = 0
+    ends = np.cumsum(lengths)
+    begs = ends - lengths
+    total = int(ends[-1]) if len(ends) else 0
+    if max_bases is None:
+        max_bases = max(total, 1)
+
+    prefix = "chr" if add_chr else ""
+    rec_chroms = np.array([prefix + str(reg.chrom) for reg in regions],
+                          dtype=object)
+    # Bases kept from the windows expanded so far, not yielded yet.
+    kept_idx, kept_pos, n_kept = [], [], 0
+    for first_base in range(0, total, max_bases):
+        bases = np.arange(first_base, min(first_base + max_bases, total))
+        rec_idx = np.searchsorted(ends, bases, side="right")
+        base_pos = starts[rec_idx] + bases - begs[rec_idx]
+        if coverage_map is not None:
+            keep = coverage_map.covered(rec_chroms[rec_idx], base_pos)
+            rec_idx, base_pos = rec_idx[keep], base_pos[keep]
+        kept_idx.append(rec_idx)
+        kept_pos.append(base_pos)
+        n_kept += len(rec_idx)
+        last = first_base + max_bases >= total
+        if n_kept < max_bases and not last:
+            continue
+        rec_idx, base_pos = np.concatenate(kept_idx), np.concatenate(kept_pos)
+        for cut in range(0, len(rec_idx), max_bases):
+            if len(rec_idx) - cut < max_bases and not last:
+                # Completed by the next windows.
+                kept_idx, kept_pos = [rec_idx[cut:]], [base_pos[cut:]]
+                n_kept = len(rec_idx) - cut
+                break
+            batch_idx = rec_idx[cut:cut + max_bases]
+            batch_pos = base_pos[cut:cut + max_bases]
+            yield pd.DataFrame(OrderedDict([("chrom", rec_chroms[batch_idx]),
+                                            ("row_id", batch_idx + start),
+                                            ("start", batch_pos),
+                                            ("end", batch_pos + 1)]))
+        else:
+            kept_idx, kept_pos, n_kept = [], [], 0
+
+def variant_table(regions, start, add_chr=False):
+    """ Fields of the result rows which only depend on the variant.
+
+    Returns:
+        dict row_id -> [chrom, pos, id, ref, alt, vartype, vartrans, chrom of
+        the UCSC link] (str), see 'result_row'.
+    """
+    prefix = "chr" if add_chr else ""
+    return dict((row_id, [prefix + str(reg.chrom), str(reg.start + 1),
+                          str(reg.id), str(reg.ref), str(reg.alt),
+                          str(reg.vartype), str(reg.vartrans), str(reg.chrom)])
+                for row_id, reg in enumerate(regions, start))
 
 def create_record_vcf(row, Record):
     """ Process a row read from a VCF into a Record with additional fields.
@@ -234,6 +448,86 @@ def create_record_vcf(row, Record):
         return "Error: Problem in your VCF input file at line: " + str(row) + str(e)
     return myvariant
 
+def create_records_vcf(chunk, Record):
+    """ Process a chunk read from a VCF into Records, column-wise.
+
+    Equivalent to applying 'create_record_vcf' on each row, but START, END,
+    variant type, transition/transversion status and "chr" prefix are
+    computed for the whole chunk with pandas vectorized operations.
+
+    Rows which cannot be processed this way (non-integer position, missing
+    alleles) are passed to 'create_record_vcf', so that the error message
+    reported for the first malformed row is the same.
+
+    Returns:
+        list of Records, or a str with the error message.
+    """
+    chrom, pos, varid, ref, alt = (chunk.iloc[:,k] for k in range(5))
+
+    # Positions: numeric columns only need to be defined ; str ones need to be
+    # valid integers, as 'int()' would require.
+    if pd.api.types.is_numeric_dtype(pos):
+        end = pd.to_numeric(pos, errors="coerce")
+    else:
+        is_int = pos.astype(str).str.fullmatch(r"\s*[+-]?\d+\s*")
+        end = pd.to_numeric(pos.where(is_int), errors="coerce")
+    valid = end.notna()
+
+    try:
+        ref_len = ref.str.len()
+        alt_len = alt.str.len()
+    except AttributeError:
+        # Not a column of strings.
+        ref_len = alt_len = pd.Series(float("nan"), index=chunk.index)
+    valid &= ref_len.notna() & alt_len.notna()
+    ref_len = ref_len.where(valid, 1).astype("int64")
+    alt_len = alt_len.where(valid, 1).astype("int64")
+    end = end.where(valid, 1).astype("int64")
+
+    ref_snv = ref_len == 1
+    alt_snv = alt_len == 1
+    vartype = pd.Series("INDEL", index=chunk.index)
+    vartype[ref_snv & alt_snv] = "SNV"
+    vartype[ref_snv & ~alt_snv] = "INS"
+    vartype[~ref_snv & alt_snv] = "DEL"
+
+    # Same rules as 'get_vartrans'.
+    is_snv = vartype == "SNV"
+    known = ref.isin(list("ACGTacgt")) & alt.isin(list("ACGTacgt"))
+    pair = ref.where(valid, "").astype(str).str.upper() \
+           + alt.where(valid, "").astype(str).str.upper()
+    transition = pair.isin(["AG", "CT", "GA", "TA"])
+    vartrans = pd.Series("not_SNV", index=chunk.index)
+    vartrans[is_snv & known & transition] = "transition"
+    vartrans[is_snv & known & ~transition] = "transversion"
+    vartrans[is_snv & ~known] = "unknown"
+
+    start = end - 1
+    end = end.where(~vartype.isin(["DEL", "INDEL"]), start + ref_len + 1)
+    end = end.where(vartype != "INS", start + 2)
+
+    chrom = chrom.astype(str)
+    chrom = chrom.where(chrom.str[:3] == "chr", "chr" + chrom)
+
+    records = [Record(*fields) for fields in zip(chrom.tolist(),
+                                                 start.tolist(),
+                                                 end.tolist(),
+                                                 varid.tolist(),
+                                                 ref.tolist(),
+                                                 alt.tolist(),
+                                                 vartype.tolist(),
+                                                 vartrans.tolist())]
+
+    # Rows that could not be processed column-wise go through the row-wise
+    # function, which reports the error for malformed rows.
+    for k in (~valid).to_numpy().nonzero()[0]:
+        record = chunk.iloc[[k]].apply(lambda row: create_record_vcf(row, Record),
+                                       axis=1).iloc[0]
+        if type(record) is str:
+            return record
+        records[k] = record
+    return records
+
 def get_vartype(ref,alt):
     if len(ref)==1:
         if len(alt)==1:
@@ -288,84 +582,612 @@ def get_vartrans(ref,alt):
     else:
         return 'not_SNV'
 
-def format_variant_info(df_regions):
-    """ Copy an input variant df and add a UCSC link to each.
-    """
+def ucsc_link(chrom, start, end):
+    """ UCSC genome browser link around a base. """
     ucsc_website = "https://genome.ucsc.edu/cgi-bin/hgTracks?"\
                    "db=hg19&position={0}%3A{1}-{2}"
+    return ucsc_website.format(chrom, start - 100, end + 100)
+
+def result_row(variant, start, end, value, reg_fields):
+    """ Result fields of a scored base, following 'utils.header'.
+
+    Args:
+        variant(list): fields of the variant, see 'variant_table'.
+        start(int), end(int): 0-based interval of the base.
+        value(str): score of the base.
+        reg_fields(list): fields of the regulatory element, from the 4th.
+    """
+    return (variant[:2] + [str(end), value] + variant[2:7]
+            + [ucsc_link(variant[7], start, end)] + list(reg_fields))
 
-    ucsc_links = [ucsc_website.format(r.chrom,r.start - 100,r.end + 100)
-                   for n,r in df_regions.iterrows()] 
+def flatten(l):
+    return [item for sublist in l for item in sublist]
 
-    # Here each variant is identified by its index. Multiple table will group
-    # related information together.
-    variants_info = df_regions.copy()
-    variants_info["ucsc_gb"] = ucsc_links
+def read_gene_list(gene_file):
+    """ Genes of a gene list file (first field of each non-empty line). """
+    with open(gene_file) as f:
+        return set(line.split()[0] for line in f if line.strip())
 
-    return variants_info
+def check_gene_list(genes, gene_table):
+    """Check if genes are in the FINSURF database.
 
-def run_intersect(score, regulatory, vcf, chunksize, output):
-    reader = build_reader(vcf, chunksize=chunksize)
+    Args:
+        genes(set): gene names.
+        gene_table(str): table of the FINSURF genes, with 1 in the second
+                         column for genes with associated regulatory regions.
+    Returns:
+        (asso_genes, no_asso_genes, undef_genes): sorted lists of the genes
+        with associated regulatory regions, without, and unrecognized.
+    """
+    table = pd.read_csv(gene_table, sep="\t", header=None, usecols=[0, 1],
+                        dtype=str, comment="#")
+    asso = set(table[0][table[1] == "1"])
+    known = set(table[0])
+    return (sorted(genes & asso), sorted((genes & known) - asso),
+            sorted(genes - known))
+
+def gene_elements(regulatory, genes):
+    """ Ids of the regulatory elements linked to some genes.
+
+    The regulatory file is read once, line by line, and only the ids of the
+    elements whose 'genes' column (comma separated) holds one of 'genes' are
+    kept.
+    """
+    genes = set(genes)
+    elements = set()
+    with gzip.open(regulatory, "rt") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 4 and not genes.isdisjoint(fields[4].split(",")):
+                elements.add(fields[3])
+    return elements
+
+def target_elements(gene_file, regulatory, gene_table=None):
+    """ Ids of the regulatory elements linked to the genes of a gene list.
+
+    Genes without regulatory regions, or unknown to FINSURF (when the gene
+    table is available), are reported on stderr.
+    """
+    genes = read_gene_list(gene_file)
+    if gene_table is not None and os.path.exists(gene_table):
+        _, no_asso_genes, undef_genes = check_gene_list(genes, gene_table)
+        if no_asso_genes:
+            print("Warning: no regulatory region for the genes: "
+                  + ", ".join(no_asso_genes), file=sys.stderr)
+        if undef_genes:
+            print("Warning: unrecognized genes: " + ", ".join(undef_genes),
+                  file=sys.stderr)
+    return gene_elements(regulatory, genes)
+
+def above_min_score(value, min_score):
+    """ Whether a score (str) passes the '--min_score' threshold. """
+    if min_score is None:
+        return True
+    try:
+        return float(value) >= min_score
+    except ValueError:
+        return False
+
+def intersect_chunk(df_regs, variants, score, regulatory, engine="tabix",
+                    elements=None, min_score=None):
+    """ Score the expanded positions of a chunk of variants.
+
+    Positions are first intersected with the regulatory file ; all the
+    regulatory hits of the chunk are then collected, and intersected with the
+    score file in a single batched lookup.
+
+    Args:
+        df_regs(dataframe): expanded positions, as returned by
+                            'expand_regions'.
+        variants(dict): fields of the variants, as returned by
+                        'variant_table'.
+        score(str): path to the score file, or to a score store directory
+                    (see 'score_store.py').
+        regulatory(str): path to the regulatory gene file.
+        engine(str): name of the intersection engine ('tabix', 'sweep' or
+                     'interval').
+        elements(set): optional, ids of the regulatory elements to keep (see
+                       'target_elements') ; hits on other elements are
+                       dropped before the score lookup.
+        min_score(float): optional, scores below it are dropped before the
+                          result rows are built.
+    Returns:
+        list of (row_id, results) pairs in order of appearance, where
+        'results' follow 'utils.header' and 'row_id' is the index given to
+        the variant by 'expand_regions'.
+    """
+    intersect = intersect_engines[engine]
+    # The score file is too large to be held in memory: with the 'interval'
+    # engine it is still queried with tabix (or see 'score_store.py').
+    score_intersect = intersect_engines["tabix" if engine == "interval"
+                                        else engine]
+
+    ### intersect with regulatory gene file
+    # Hits are (chrom, row_id, start, end, fields of the element from the
+    # 4th).
+    with profiling.stage("regulatory_query"):
+        intersection = intersect(df_regs, regulatory)
+        processed_res = []
+        for res in intersection:
+            if intersection[res] == [None]:  continue
+            chrom, row_id, beg, end = res.split("@")
+            base = (chrom, int(row_id), int(beg), int(end))
+            for y in flatten(intersection[res]):
+                if elements is not None and y[3] not in elements: continue
+                processed_res.append(base + (y[3:],))
+    profiling.count("regulatory_hits", len(processed_res))
+
+    if not processed_res:
+        return []
+
+    with profiling.stage("score_query"):
+        chunk_results = score_hits(processed_res, variants, score,
+                                   score_intersect, min_score)
+    profiling.count("results", len(chunk_results))
+    return chunk_results
+
+def score_hits(processed_res, variants, score, score_intersect,
+               min_score=None):
+    """ Intersect the regulatory hits of a chunk with the score file.
+
+    Returns:
+        list of (row_id, results) pairs, see 'intersect_chunk'.
+    """
+    ### intersect with score file
+    chunk_results = []
+    if score_store.is_score_store(score):
+        # Memory-mapped score store: one score per record, already selected
+        # according to the transition / transversion status.
+        store = score_store.open_store(score)
+        scores = store.lookup([hit[0] for hit in processed_res],
+                              [hit[2] for hit in processed_res],
+                              [variants[hit[1]][6] == "transition"
+                               for hit in processed_res])
+        for hit, hit_scores in zip(processed_res, scores):
+            chrom, row_id, beg, end, reg_fields = hit
+            for value in hit_scores:
+                if not above_min_score(value, min_score): continue
+                chunk_results.append((row_id, result_row(
+                        variants[row_id], beg, end, value, reg_fields)))
+        return chunk_results
+
+    # Identical hits (same base and element fields) are queried once, and
+    # their results repeated for each of them.
+    hit_ids = OrderedDict()
+    for hit in processed_res:
+        key = hit[:4] + tuple(hit[4])
+        if key in hit_ids:
+            hit_ids[key][1] += 1
+        else:
+            hit_ids[key] = [hit, 1]
+    first_hits = list(hit_ids.values())
+    df_reg2 = pd.DataFrame(OrderedDict([
+                ("chrom", [hit[0] for hit, _ in first_hits]),
+                ("row_id", range(len(first_hits))),
+                ("start", [hit[2] for hit, _ in first_hits]),
+                ("end", [hit[3] for hit, _ in first_hits])]))
+    intersection2 = score_intersect(df_reg2, score)
+    for res in intersection2:
+        if intersection2[res] == [None]: continue
+        hit, repeats = first_hits[int(res.split("@")[1])]
+        chrom, row_id, beg, end, reg_fields = hit
+        variant = variants[row_id]
+        hit_results = []
+        for y in flatten(intersection2[res]):
+            value = y[5] if variant[6] == "transition" else y[-1]
+            if not above_min_score(value, min_score): continue
+            hit_results.append((row_id, result_row(variant, beg, end, value,
+                                                   reg_fields)))
+        chunk_results.extend(hit_results * repeats)
+    return chunk_results
+
+def score_records(records, score, regulatory, engine="tabix", start=0,
+                  coverage_path=None, elements=None, min_score=None,
+                  cache=None, max_bases=expand_batch_size):
+    """ Expand a list of Records and score their positions.
+
+    Args:
+        coverage_path(str): optional coverage bitmap of the regulatory file ;
+                            bases outside regulatory regions are then dropped
+                            before any query.
+        elements(set): optional, regulatory elements to keep (see
+                       'intersect_chunk').
+        min_score(float): optional, minimum score of the results.
+        cache(tuple): optional (path, fingerprint) of a result cache (see
+                      'result_cache.py') ; cached variants are not queried,
+                      and the results of the others are added to the cache.
+        max_bases(int): maximum number of bases expanded and intersected at
+                        once.
+    Returns:
+        list of (row_id, results) pairs, as returned by 'intersect_chunk', or
+        a str with the error message.
+    """
+    # Check that the chromosomes have 'chr' or not (from the first base).
+    first = next((reg for reg in records if reg.end > reg.start), None)
+    if first is None:
+        return []
+    add_chr = not str(first.chrom).startswith('chr')
+
+    coverage_map = None
+    if coverage_path is not None:
+        coverage_map = coverage_bitmap.open_coverage(coverage_path, regulatory)
+
+    hits = {}
+    if cache is not None:
+        variant_cache = result_cache.open_cache(*cache)
+        with profiling.stage("cache_lookup"):
+            hits = variant_cache.lookup(records, add_chr)
+
+    scored = []
+    if len(hits) < len(records):
+        variants = variant_table(records, start, add_chr)
+        # Long deletions are split between batches of at most 'max_bases'
+        # bases, and bases outside regulatory regions dropped from each.
+        for df_regs in profiling.timed("expand_regions", iter_expanded(
+                    records, start, max_bases, add_chr, hits, coverage_map)):
+            profiling.count("rows_expanded", len(df_regs))
+            scored += intersect_chunk(df_regs, variants, score, regulatory,
+                                      engine, elements, min_score)
+
+    if cache is None:
+        return scored
+    with profiling.stage("cache_store"):
+        return merge_cached_results(records, start, scored, hits,
+                                    variant_cache, add_chr)
+
+def merge_cached_results(records, start, scored, hits, variant_cache,
+                         add_chr):
+    """ Merge cached and computed results, and cache the computed ones.
+
+    Results are grouped by variant, in the order of the Records, as
+    'intersect_chunk' returns them.
+    """
+    computed = {}
+    for row_id, results in scored:
+        computed.setdefault(row_id, []).append(results)
+    variant_cache.store([(reg, computed.get(start + k, []))
+                         for k, reg in enumerate(records) if k not in hits],
+                        add_chr)
+
+    merged = []
+    for k in range(len(records)):
+        rows = hits[k] if k in hits else computed.get(start + k, [])
+        merged.extend((start + k, results) for results in rows)
+    return merged
+
+# Size of the genomic bins used to split chromosomes between parallel tasks.
+partition_bin_size = 10000000
+
+def partition_records(records, first_line):
+    """ Group the Records of a chunk by chromosome and genomic bin.
+
+    Args:
+        records(list): Records of the chunk.
+        first_line(int): index of the first Record in the input file.
+    Returns:
+        list of (records, line_indexes) for each partition, in order of first
+        appearance.
+    """
+    partitions = OrderedDict()
+    for line, record in enumerate(records, first_line):
+        part = partitions.setdefault(
+                    (record.chrom, record.start // partition_bin_size),
+                    ([], []))
+        part[0].append(record)
+        part[1].append(line)
+    return list(partitions.values())
+
+def score_partition(task):
+    """ Score a partition of Records in a worker process.
+
+    Each result is associated to a key, (line index << 32) + rank of the
+    result in the partition, ordering results of different partitions as in a
+    serial run.
+
+    Args:
+        task(tuple): (records, line_indexes, score, regulatory, engine,
+                     coverage_path, elements, min_score, cache, max_bases).
+    Returns:
+        (list of (key, results) pairs, (cache hits, cache misses), profiling
+        figures or None), or a str with the error message.
+    """
+    (records, lines, score, regulatory, engine, coverage_path, elements,
+     min_score, cache, max_bases) = task
+    if cache is not None:
+        variant_cache = result_cache.open_cache(*cache)
+        hits, misses = variant_cache.hits, variant_cache.misses
+    profiling.profiler.reset()
+    with profiling.chunk(len(records)):
+        scored = score_records(records, score, regulatory, engine,
+                               coverage_path=coverage_path, elements=elements,
+                               min_score=min_score, cache=cache,
+                               max_bases=max_bases)
+    if type(scored) is str:
+        return scored
+    stats = (0, 0)
+    if cache is not None:
+        stats = (variant_cache.hits - hits, variant_cache.misses - misses)
+    figures = None
+    if profiling.profiler.enabled:
+        figures = profiling.profiler.snapshot()
+    return ([((lines[row_id] << 32) + rank, results)
+             for rank, (row_id, results) in enumerate(scored)], stats, figures)
+
+def run_intersect(score, regulatory, vcf, chunksize, output, engine="tabix",
+                  sort_buffer=1000000, jobs=1, coverage_path=None,
+                  gene_file=None, gene_table=None, top=None, min_score=None,
+                  cache_path=None, cache_size=1000000, output_format="txt",
+                  read_threads=1, regions=None, chroms=None,
+                  max_bases=expand_batch_size, result_file=None,
+                  run_dir=None, resume=False, index_cache=None):
+    error = result_formats.check_format(output_format)
+    if error:
+        return error
+
+    # Restrict the variants to regions and / or chromosomes.
+    scope = None
+    if regions:
+        try:
+            scope = vcf_reader.read_regions(regions)
+        except (OSError, ValueError) as e:
+            return "Error: in reading your regions: " + str(e)
+    if chroms:
+        keys = set(vcf_reader.contig_key(chrom) for chrom in chroms)
+        if scope is None:
+            scope = {chrom: [(0, vcf_reader.MAX_POSITION)] for chrom in chroms}
+        else:
+            scope = {chrom: intervals for chrom, intervals in scope.items()
+                     if vcf_reader.contig_key(chrom) in keys}
+
+    # Variants on contigs absent from the regulatory file can't have results.
+    with profiling.stage("open_input"):
+        reader = build_reader(vcf, chunksize=chunksize, threads=read_threads,
+                              regions=scope,
+                              contigs=tabix_list_chrom(regulatory))
     
     # Check if there's error in reading vcf file
     if type(reader) is str:
         return reader
+
+    # Check that a score store is up to date before starting
+    if score_store.is_score_store(score):
+        try:
+            score_store.open_store(score)
+        except score_store.StaleStoreError as e:
+            return "Error: " + str(e)
+    if engine == "interval":
+        # Loaded once, before any worker process is started.
+        interval_index.open_index(regulatory, index_cache)
+    if coverage_path is not None:
+        try:
+            coverage_bitmap.open_coverage(coverage_path, regulatory)
+        except coverage_bitmap.StaleCoverageError as e:
+            return "Error: " + str(e)
+
+    # Restrict the results to the elements of the genes given by the user.
+    elements = None
+    if gene_file:
+        try:
+            elements = target_elements(gene_file, regulatory, gene_table)
+        except (OSError, IndexError, ValueError) as e:
+            return "Error: in reading your gene file: " + str(e)
+
+    # Results of the variants already scored with the same data.
+    cache = None
+    variant_cache = None
+    if cache_path:
+        cache = (cache_path, result_cache.fingerprint(score, regulatory,
+                                                      elements, min_score))
+        variant_cache = result_cache.open_cache(cache_path, cache[1],
+                                                cache_size)
+
+    # Results of each chunk saved in 'run_dir', to resume an interrupted run.
+    run_checkpoint = None
+    if run_dir:
+        try:
+            run_checkpoint = checkpoint.Checkpoint(
+                    run_dir, {"input": vcf, "score": score,
+                              "regulatory": regulatory},
+                    [chunksize, jobs > 1, sorted(elements or []), min_score,
+                     regions, chroms], resume)
+        except checkpoint.StaleCheckpointError as e:
+            return "Error: cannot resume: " + str(e)
+    elif resume:
+        return "Error: --resume needs the run directory (--run_dir)."
     
-    flatten = lambda l: [item for sublist in l for item in sublist]
-    
-    result_file = utils.make_tmp_file('result','txt',output)	
-    f = open(result_file,"w")	
-    f.write("#" + "\t".join(utils.header) + "\n")
-    all_results = []
-    for i, chunk in enumerate(reader):
-        chunk_regions = chunk.apply(lambda row: create_record_vcf(row, Record), axis=1).values # format the variants to the namedTuple structure.
-        df_regions = expand_regions(chunk_regions, start=i)
-        
-        # Check if there's error in VCF file
-        if type(df_regions) is str:
-            return df_regions
-            
-        df_regions = format_variant_info(df_regions)
-        df_regs = df_regions.copy()
-        if not df_regs.iloc[0,0].startswith('chr'): # Check that the chromosomes have 'chr' or not
-            df_regs.iloc[:,0] = 'chr' + df_regs.iloc[:,0].astype(str)
-		
-		### intersect with regulatory gene file
-        intersection = bedfile_intersect_index(df_regs, regulatory)
-        processed_res = []
-        for i,res in enumerate(intersection):
-            if intersection[res] == [None]:  continue 
-            else:
-                variant = res.split("@")
-                for y in flatten(intersection[res]):
-                    results = variant + y[3:]
-                    processed_res.append(results)
-
-            ### intersect with score file
-            if len(processed_res) > 0: 
-                df_reg2 = pd.DataFrame(OrderedDict(zip(colnames, zip(*processed_res))))
-                intersection2 = bedfile_intersect_index(df_reg2, score)
-                for i,res in enumerate(intersection2):
-                    if intersection2[res] == [None]: continue 
-                    else:
-                        variant = res.split("@")
-                        for y in flatten(intersection2[res]):
-                            if variant[9] == "transition":
-                                results = [variant[0], variant[1], variant[3], y[5]]
-                            else:
-                                results = [variant[0], variant[1], variant[3], y[-1]]
-                            results += variant[4:7] + variant[8:]
-                            if results not in all_results:
-                                all_results.append(results)
+    # A timestamped, random name by default ; shards of a cohort are written
+    # to a deterministic 'result_file' (see 'finsurf_shards.py').
+    if result_file is None:
+        result_file = utils.make_tmp_file('result',
+                                          result_formats.output_formats[output_format],
+                                          output)
+    # Results are deduplicated, and sorted runs are spilled to disk beyond
+    # 'sort_buffer' results.
+    # With 'top', only the best results are kept, in a bounded heap.
+    sink = ResultSink(buffer_size=sort_buffer, tmp_dir=output, top=top)
+    if jobs > 1:
+        error = run_intersect_parallel(reader, score, regulatory, engine, sink,
+                                       jobs, coverage_path, elements,
+                                       min_score, cache, max_bases,
+                                       run_checkpoint)
+    else:
+        error = run_intersect_serial(reader, score, regulatory, engine, sink,
+                                     coverage_path, elements, min_score,
+                                     cache, max_bases, run_checkpoint)
+    if variant_cache is not None:
+        variant_cache.evict()
+        print("Result cache: {} hits, {} misses".format(
+                variant_cache.hits, variant_cache.misses), file=sys.stderr)
+    if error:
+        sink.close()
+        return error
 	## remove temporary file
     #os.remove(vcf)
 
-    all_results = sorted(all_results, key = lambda x: x[3], reverse=True)
-    for i in all_results:
-        f.write("\t".join(i) + "\n")
-    f.close()
+    try:
+        with profiling.stage("write"):
+            result_formats.write_results(sink, result_file, output_format,
+                                         output)
+        profiling.count("duplicates_dropped", sink.n_duplicates)
+        profiling.count("results_written", sink.n_results)
+    finally:
+        sink.close()
     return result_file
 
+def run_intersect_serial(reader, score, regulatory, engine, sink,
+                         coverage_path=None, elements=None, min_score=None,
+                         cache=None, max_bases=expand_batch_size,
+                         run_checkpoint=None):
+    """ Score the chunks of 'reader' one after the other, adding the results
+    to 'sink'.
+
+    Args:
+        run_checkpoint(Checkpoint): optional, where the results of each chunk
+                                    are saved ; chunks it already holds are
+                                    not scored again.
+    Returns:
+        None, or a str with the error message.
+    """
+    for i, chunk in enumerate(profiling.timed("read", reader)):
+        if run_checkpoint is not None and i < run_checkpoint.n_completed:
+            error = restore_chunk(run_checkpoint, i, len(chunk), sink)
+            if error:
+                return error
+            continue
+        with profiling.chunk(len(chunk)):
+            with profiling.stage("create_records"):
+                chunk_regions = create_records_vcf(chunk, Record) # format the variants to the namedTuple structure.
+            if type(chunk_regions) is str:
+                return chunk_regions
+
+            scored = score_records(chunk_regions, score, regulatory, engine,
+                                   start=i, coverage_path=coverage_path,
+                                   elements=elements, min_score=min_score,
+                                   cache=cache, max_bases=max_bases)
+        if type(scored) is str:
+            return scored
+
+        if run_checkpoint is not None:
+            with profiling.stage("checkpoint"):
+                run_checkpoint.save(i, len(chunk),
+                                    [(None, results) for _, results in scored])
+        with profiling.stage("sort"):
+            for _, results in scored:
+                sink.add(results)
+    return None
+
+def restore_chunk(run_checkpoint, i, variants, sink):
+    """ Add the saved results of a completed chunk to 'sink'.
+
+    Returns:
+        None, or a str with the error message.
+    """
+    error = run_checkpoint.check(i, variants)
+    if error:
+        return error
+    with profiling.stage("restore"):
+        for key, results in run_checkpoint.load(i):
+            sink.add(results, key)
+    return None
+
+def run_intersect_parallel(reader, score, regulatory, engine, sink, jobs,
+                           coverage_path=None, elements=None,
+                           min_score=None, cache=None,
+                           max_bases=expand_batch_size, run_checkpoint=None):
+    """ Score the chunks of 'reader' in 'jobs' worker processes.
+
+    Each chunk is split by chromosome and genomic bin, and each partition is
+    scored by a worker, with its own index handles. Partial results are added
+    to 'sink' in the order the partitions were submitted, with keys giving the
+    same final order as a serial run. Identical results always belong to the
+    same partition (they share chromosome and position), so deduplication
+    keeps the same occurrence as a serial run.
+
+    With 'run_checkpoint', the results of a chunk are saved once all its
+    partitions are added (see 'run_intersect_serial').
+
+    Returns:
+        None, or a str with the error message.
+    """
+    pool = multiprocessing.Pool(jobs)
+    pending = deque() # (chunk index, partition result)
+    # Chunk index -> [partitions left, variants, (key, results) items].
+    chunks = {}
+    error = None
+    first_line = 0
+    try:
+        for i, chunk in enumerate(profiling.timed("read", reader)):
+            if run_checkpoint is not None and i < run_checkpoint.n_completed:
+                error = restore_chunk(run_checkpoint, i, len(chunk), sink)
+                if error:
+                    break
+                first_line += len(chunk)
+                continue
+            with profiling.stage("create_records"):
+                chunk_regions = create_records_vcf(chunk, Record)
+            if type(chunk_regions) is str:
+                error = chunk_regions
+                break
+            partitions = partition_records(chunk_regions, first_line)
+            if run_checkpoint is not None:
+                chunks[i] = [len(partitions), len(chunk), []]
+            for records, lines in partitions:
+                pending.append((i, pool.apply_async(score_partition,
+                        ((records, lines, score, regulatory, engine,
+                          coverage_path, elements, min_score, cache,
+                          max_bases),))))
+            first_line += len(chunk_regions)
+
+            # Bound the number of partitions waiting in memory.
+            while len(pending) > 2 * jobs and error is None:
+                error = next_partition_results(pending, chunks, sink, cache,
+                                               run_checkpoint)
+            if error:
+                break
+
+        while pending and error is None:
+            error = next_partition_results(pending, chunks, sink, cache,
+                                           run_checkpoint)
+    finally:
+        pool.terminate()
+        pool.join()
+    return error
+
+def next_partition_results(pending, chunks, sink, cache=None,
+                           run_checkpoint=None):
+    """ Add the results of the first pending partition to 'sink', and save
+    its chunk once complete.
+    """
+    i, scored = pending.popleft()
+    scored = scored.get()
+    error = add_partition_results(scored, sink, cache)
+    if error or run_checkpoint is None:
+        return error
+    chunks[i][0] -= 1
+    chunks[i][2].extend(scored[0])
+    if chunks[i][0] == 0:
+        _, variants, items = chunks.pop(i)
+        with profiling.stage("checkpoint"):
+            run_checkpoint.save(i, variants, items)
+    return None
+
+def add_partition_results(scored, sink, cache=None):
+    if type(scored) is str:
+        return scored
+    scored, (hits, misses), figures = scored
+    for key, results in scored:
+        sink.add(results, key)
+    if figures is not None:
+        profiling.profiler.merge(figures)
+    # Cache statistics of the workers are reported by the main process.
+    if cache is not None:
+        variant_cache = result_cache.open_cache(*cache)
+        variant_cache.hits += hits
+        variant_cache.misses += misses
+    return None
+
 def argparser():
     parser = argparse.ArgumentParser(epilog=__doc__,
                                formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -378,13 +1200,24 @@ def argparser():
     parser.add_argument("-ig",
                         "--inputgene",
                         type=str,
-                        help="Path to gene input file (to filter result)",
+                        help="Path to gene input file (to filter result): "
+                             "only the regulatory elements linked to these "
+                             "genes are scored.",
+                        required=False)
+    parser.add_argument("-gt",
+                        "--gene_table",
+                        type=str,
+                        help="Table of the FINSURF genes, used to report the "
+                             "genes of --inputgene without regulatory regions "
+                             "(default: 2020-05-11_table_genes_FINSURF_regions."
+                             "tsv next to the regulatory gene file).",
                         required=False)
 
     parser.add_argument("-s",
                         "--score",
                         type=str,
-                        help="Path to score file.",
+                        help="Path to score file, or to a score store "
+                             "directory built with score_store.py.",
                         required=True)
 
 
@@ -406,17 +1239,175 @@ def argparser():
                         help="output directory",
                         required=False,
                         default="./res")
+    parser.add_argument("-e",
+                        "--engine",
+                        type=str,
+                        help="Intersection engine: 'tabix' queries the indexes "
+                             "for each position, 'sweep' sorts each chunk and "
+                             "reads the files forward (faster for dense "
+                             "inputs), 'interval' loads the regulatory file "
+                             "in memory (see --index_cache).",
+                        choices=sorted(intersect_engines),
+                        required=False,
+                        default="tabix")
+    parser.add_argument("--index_cache",
+                        type=str,
+                        help="Directory where the in-memory index of the "
+                             "regulatory file ('--engine interval') is "
+                             "cached between runs ; built at each run by "
+                             "default.",
+                        required=False)
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        help="Number of worker processes scoring the variants "
+                             "(split by chromosome and genomic bin).",
+                        required=False,
+                        default=1)
+    parser.add_argument("-sb",
+                        "--sort_buffer",
+                        type=int,
+                        help="Number of results kept in memory before sorted "
+                             "runs are written to disk (in the output "
+                             "directory) and merged at the end.",
+                        required=False,
+                        default=1000000)
+    parser.add_argument("-cv",
+                        "--coverage",
+                        type=str,
+                        help="Coverage bitmap of the regulatory gene file, "
+                             "built with coverage_bitmap.py: bases outside "
+                             "regulatory regions are dropped before any query.",
+                        required=False)
+    parser.add_argument("-k",
+                        "--top",
+                        type=int,
+                        help="Only write the K best results (in a bounded "
+                             "heap, instead of sorting all the results).",
+                        required=False)
+    parser.add_argument("-ms",
+                        "--min_score",
+                        type=float,
+                        help="Only write the results with a score of at least "
+                             "this value.",
+                        required=False)
+    parser.add_argument("-rc",
+                        "--result_cache",
+                        type=str,
+                        help="SQLite file caching the results of each variant "
+                             "across runs (created if needed).",
+                        required=False)
+    parser.add_argument("--cache_size",
+                        type=int,
+                        help="Maximum number of variants kept in the result "
+                             "cache (least recently used ones are evicted).",
+                        required=False,
+                        default=1000000)
+    parser.add_argument("-of",
+                        "--output_format",
+                        type=str,
+                        help="Format of the result file: 'txt' (sorted by "
+                             "score), 'tabix' (sorted by position, bgzipped "
+                             "and tabix-indexed), 'parquet' or 'arrow' (typed "
+                             "columns, need pyarrow).",
+                        choices=list(result_formats.output_formats),
+                        required=False,
+                        default="txt")
+    parser.add_argument("-rt",
+                        "--read_threads",
+                        type=int,
+                        help="Number of threads decompressing a bgzipped "
+                             "input file.",
+                        required=False,
+                        default=4)
+    parser.add_argument("-rg",
+                        "--regions",
+                        type=str,
+                        nargs="+",
+                        help="Only score the variants overlapping these "
+                             "regions: 'chrom:start-end' (1-based), or files "
+                             "of such regions or BED files. A bgzipped input "
+                             "with a '.tbi' index is read only there.",
+                        required=False)
+    parser.add_argument("-ch",
+                        "--chrom",
+                        type=str,
+                        nargs="+",
+                        help="Only score the variants of these chromosomes.",
+                        required=False)
+    parser.add_argument("-mb",
+                        "--max_bases",
+                        type=int,
+                        help="Maximum number of bases of the variants "
+                             "expanded and intersected at once: chunks with "
+                             "long deletions are split beyond it.",
+                        required=False,
+                        default=expand_batch_size)
+    parser.add_argument("-rd",
+                        "--run_dir",
+                        type=str,
+                        help="Directory where the results of each chunk are "
+                             "saved as soon as it is scored, to resume the "
+                             "run with --resume if it is interrupted.",
+                        required=False)
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume the run saved in --run_dir: completed "
+                             "chunks are not scored again. The input, score "
+                             "and regulatory files and the parameters must "
+                             "be the same.")
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="Print the time, calls and memory (RSS) growth "
+                             "of each stage, the process peak RSS so far, and "
+                             "the counters of the run, on stderr at exit. With "
+                             "--jobs, the stages of the workers are listed "
+                             "apart, their time summed over the workers.")
+    parser.add_argument("--metrics_json",
+                        type=str,
+                        help="Write the figures of --profile, and those of "
+                             "each chunk, to this JSON file.",
+                        required=False)
     return parser
 
+def run_arguments(args, result_file=None):
+	""" Call 'run_intersect' with the parsed command line arguments. """
+	gene_table = args.gene_table
+	if gene_table is None:
+		gene_table = os.path.join(os.path.dirname(args.gene), "2020-05-11_table_genes_FINSURF_regions.tsv")
+	return run_intersect(score=args.score, regulatory=args.gene, vcf=args.input,
+	                     chunksize=args.chunksize, output=args.output_dir,
+	                     engine=args.engine, sort_buffer=args.sort_buffer,
+	                     jobs=args.jobs, coverage_path=args.coverage,
+	                     gene_file=args.inputgene, gene_table=gene_table,
+	                     top=args.top, min_score=args.min_score,
+	                     cache_path=args.result_cache,
+	                     cache_size=args.cache_size,
+	                     output_format=args.output_format,
+	                     read_threads=args.read_threads, regions=args.regions,
+	                     chroms=args.chrom, max_bases=args.max_bases,
+	                     result_file=result_file, run_dir=args.run_dir,
+	                     resume=args.resume, index_cache=args.index_cache)
+
 def main():
 	parser = argparser()
 	args = parser.parse_args()
-	result_file = run_intersect(args.score, args.gene, args.input, args.chunksize, args.output_dir)
+	if args.profile or args.metrics_json:
+		profiling.profiler.enable()
+	result_file = run_arguments(args)
 
 	return_str = result_file.strip()
 	if args.inputgene and args.inputgene != '':
 		return_str += ":" + args.inputgene.strip()
 	print(return_str)
+
+	if profiling.profiler.enabled:
+		report = profiling.profiler.report()
+		if args.metrics_json:
+			with open(args.metrics_json, "w") as f:
+				json.dump(report, f, indent=1)
+		if args.profile:
+			print(profiling.summary(report), file=sys.stderr)
 	return 0
 
 if __name__ == "__main__":
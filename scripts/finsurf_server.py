@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""Long-running FINSURF scoring service.
+
+The score and regulatory files are opened once, and batches of variants are
+scored on request, without paying the start-up cost of finsurf.py for each of
+them:
+
+    python scripts/finsurf_server.py -s static/data/scores_all_chroms_1e-4.tsv.gz \
+                                     -g static/data/FINSURF_REGULATORY_REGIONS_GENES.bed.gz \
+                                     --port 8080
+
+Variants are sent with a POST request on '/score', either as VCF text (plain
+or gzipped, same format as the finsurf.py input) or as JSON: a list of
+[chrom, pos, id, ref, alt] lists, or of objects with these keys, possibly
+under a "variants" key.
+
+    curl --data-binary @static/data/samples/variant.vcf http://127.0.0.1:8080/score
+
+The response is the content of the result file of finsurf.py (header
+'#' + utils.header, then one row per result, sorted by score), streamed as it
+is written. Errors are reported with a status 400 and the message of
+finsurf.py (500 for errors not caused by the batch). 'GET /health' answers
+'ok'.
+
+With '--socket PATH', the service listens on a UNIX socket instead:
+
+    curl --unix-socket /tmp/finsurf.sock --data-binary @variants.vcf http://localhost/score
+
+Requests are handled concurrently ; scoring is done by '--threads' worker
+threads, each with its own tabix handles.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socketserver
+import sys
+import tempfile
+import traceback
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import coverage_bitmap
+import finsurf
+import interval_index
+import score_store
+import tabix_utils
+import utils
+
+from result_sink import ResultSink
+
+variant_keys = ["chrom", "pos", "id", "ref", "alt"]
+
+# Errors raised by malformed batches (answered with a status 400, other
+# errors with a status 500).
+bad_input_errors = (ValueError, EOFError, zlib.error)
+
+
+def json_to_vcf(data):
+    """ Convert a JSON batch of variants to VCF lines (5 columns).
+
+    Raises:
+        ValueError: if the variants are not given as expected.
+    """
+    if isinstance(data, dict):
+        data = data.get("variants")
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of variants.")
+    lines = []
+    for variant in data:
+        if isinstance(variant, dict):
+            variant = [variant.get(key, ".") for key in variant_keys]
+        if not isinstance(variant, list) or len(variant) < 5:
+            raise ValueError("Invalid variant: {}".format(variant))
+        lines.append("\t".join(str(v) for v in variant[:5]) + "\n")
+    return "".join(lines).encode("utf8")
+
+
+class Scorer(object):
+    """ Score batches of variants with warm indexes.
+
+    Args:
+        score(str), regulatory(str), engine(str), coverage_path(str): as for
+            'finsurf.run_intersect'.
+        chunksize(int): number of variants scored at once.
+        sort_buffer(int): results kept in memory per request (see
+                          'ResultSink').
+        tmp_dir(str): directory of the uploaded batches and sorted runs.
+        threads(int): number of worker threads.
+    """
+
+    def __init__(self, score, regulatory, engine="tabix", coverage_path=None,
+                 chunksize=finsurf.chunksize, sort_buffer=1000000,
+                 tmp_dir=None, threads=4):
+        self.score = score
+        self.regulatory = regulatory
+        self.engine = engine
+        self.coverage_path = coverage_path
+        self.chunksize = chunksize
+        self.sort_buffer = sort_buffer
+        self.tmp_dir = tempfile.mkdtemp(prefix="finsurf_server_", dir=tmp_dir)
+        self.executor = ThreadPoolExecutor(threads)
+        self.warm_up()
+
+    def warm_up(self):
+        """ Load the shared indexes once, before the first request. """
+        for path in (self.score, self.regulatory):
+            if not score_store.is_score_store(path):
+                tabix_utils.registry.index(path)
+                tabix_utils.registry.chroms(path)
+        if score_store.is_score_store(self.score):
+            score_store.open_store(self.score)
+        if self.engine == "interval":
+            interval_index.open_index(self.regulatory)
+        if self.coverage_path is not None:
+            coverage_bitmap.open_coverage(self.coverage_path, self.regulatory)
+
+    def score_batch(self, body):
+        """ Score a batch of variants (VCF text, possibly gzipped).
+
+        Returns:
+            ResultSink holding the results (to be closed by the caller), or a
+            str with the error message.
+        """
+        return self.executor.submit(self._score_batch, body).result()
+
+    def _score_batch(self, body):
+        suffix = ".vcf.gz" if body[:2] == b"\x1f\x8b" else ".vcf"
+        fd, vcf = tempfile.mkstemp(suffix, "batch_", self.tmp_dir)
+        reader = None
+        sink = None
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            reader = finsurf.build_reader(vcf, chunksize=self.chunksize)
+            if type(reader) is str:
+                return reader
+            sink = ResultSink(buffer_size=self.sort_buffer,
+                              tmp_dir=self.tmp_dir)
+            error = finsurf.run_intersect_serial(reader, self.score,
+                                                 self.regulatory, self.engine,
+                                                 sink, self.coverage_path)
+            if error:
+                sink.close()
+                return error
+            return sink
+        except Exception:
+            # The sorted runs of the sink are removed with it.
+            if sink is not None:
+                sink.close()
+            raise
+        finally:
+            if reader is not None and type(reader) is not str:
+                reader.close()
+            os.remove(vcf)
+
+    def close(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """ HTTP interface of the Scorer attached to the server. """
+
+    def address_string(self):
+        # UNIX sockets have no client address.
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "local"
+
+    def send_text(self, status, text):
+        body = text.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_text(200, "ok\n")
+        else:
+            self.send_text(404, "Unknown path: {}\n".format(self.path))
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.send_text(404, "Unknown path: {}\n".format(self.path))
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        if "json" in content_type or body.lstrip()[:1] in (b"[", b"{"):
+            try:
+                body = json_to_vcf(json.loads(body.decode("utf8")))
+            except ValueError as e:
+                self.send_text(400, "Error: {}\n".format(e))
+                return
+        if not body.strip():
+            self.send_text(400, "Error: no variant given.\n")
+            return
+
+        try:
+            sink = self.server.scorer.score_batch(body)
+        except bad_input_errors as e:
+            self.send_text(400, "Error: in reading your VCF input: {}\n"
+                                .format(e))
+            return
+        except Exception as e:
+            self.log_error("Error while scoring a batch: %s",
+                           traceback.format_exc())
+            self.send_text(500, "Error: the batch could not be scored: {}\n"
+                                .format(e))
+            return
+        if type(sink) is str:
+            self.send_text(400, sink + "\n")
+            return
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/tab-separated-values; charset=utf-8")
+            self.end_headers()
+            self.wfile.write(("#" + "\t".join(utils.header) + "\n")
+                             .encode("utf8"))
+            for _, row in sink:
+                self.wfile.write(("\t".join(row) + "\n").encode("utf8"))
+        finally:
+            sink.close()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(scorer, host="127.0.0.1", port=8080, socket_path=None):
+    """ Build the HTTP server (TCP, or UNIX socket if 'socket_path'). """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ScoringHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.scorer = scorer
+    return server
+
+
+# Argument parser
+# ===============
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s",
+                        "--score",
+                        type=str,
+                        help="Path to score file, or to a score store "
+                             "directory built with score_store.py.",
+                        required=True)
+    parser.add_argument("-g",
+                        "--gene",
+                        type=str,
+                        help="Path to regulatory gene file.",
+                        required=True)
+    parser.add_argument("-e",
+                        "--engine",
+                        type=str,
+                        help="Intersection engine (see finsurf.py).",
+                        choices=sorted(finsurf.intersect_engines),
+                        required=False,
+                        default="tabix")
+    parser.add_argument("-cv",
+                        "--coverage",
+                        type=str,
+                        help="Coverage bitmap of the regulatory gene file "
+                             "(see finsurf.py).",
+                        required=False)
+    parser.add_argument("-cs",
+                        "--chunksize",
+                        type=int,
+                        help="Number of variants scored as a block.",
+                        required=False,
+                        default=5000)
+    parser.add_argument("-sb",
+                        "--sort_buffer",
+                        type=int,
+                        help="Number of results of a request kept in memory "
+                             "before sorted runs are written to disk.",
+                        required=False,
+                        default=1000000)
+    parser.add_argument("-t",
+                        "--threads",
+                        type=int,
+                        help="Number of scoring threads.",
+                        required=False,
+                        default=4)
+    parser.add_argument("--host",
+                        type=str,
+                        help="Address to listen on.",
+                        required=False,
+                        default="127.0.0.1")
+    parser.add_argument("--port",
+                        type=int,
+                        help="Port to listen on.",
+                        required=False,
+                        default=8080)
+    parser.add_argument("--socket",
+                        type=str,
+                        help="Listen on this UNIX socket instead of a port.",
+                        required=False)
+    parser.add_argument("--tmp_dir",
+                        type=str,
+                        help="Directory for the uploaded batches and sorted "
+                             "runs (system default if not given).",
+                        required=False)
+    return parser
+
+def main():
+    args = argparser().parse_args()
+    try:
+        scorer = Scorer(args.score, args.gene, args.engine, args.coverage,
+                        args.chunksize, args.sort_buffer, args.tmp_dir,
+                        args.threads)
+    except (score_store.StaleStoreError, coverage_bitmap.StaleCoverageError) as e:
+        print("Error: " + str(e))
+        return 1
+    server = make_server(scorer, args.host, args.port, args.socket)
+    print("FINSURF scoring service listening on {}".format(
+            args.socket or "http://{}:{}".format(args.host, args.port)))
+    sys.stdout.flush()
+    # Clean up (temporary files, UNIX socket) when stopped with SIGTERM too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scorer.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+"""Score a cohort VCF as independent shards, on one or several nodes.
+
+The input is split into shards holding about the same number of expanded
+bases (the bases scored for each variant, so a long deletion weighs as much
+as many SNVs), each shard is scored by its own 'run_intersect', and the shard
+results are merged into one result file:
+
+    python scripts/finsurf_shards.py shard -i cohort.vcf.gz -n 100 -d shards/
+    # for k in 0..99, on any node sharing 'shards/':
+    python scripts/finsurf_shards.py score-shard -d shards/ -k $k \\
+                                     -s scores.tsv.gz -g regulatory.bed.gz
+    python scripts/finsurf_shards.py merge -d shards/
+
+'score-shard' takes the options of finsurf.py (besides -i, -od and -of), and
+writes 'result_<k>.txt' in the shard directory ; a shard already scored is
+skipped, so that failed shards can simply be submitted again.
+
+Shards are consecutive blocks of variants (genomic ranges for a sorted VCF),
+so that the merged file is the one of a single run: sorted by score, ties in
+order of first appearance in the input, duplicates removed.
+
+'run' does the three steps on this machine, with a local process launcher
+standing in for a cluster scheduler:
+
+    python scripts/finsurf_shards.py run -i cohort.vcf.gz -n 8 -p 4 \\
+                                     -d shards/ -s scores.tsv.gz \\
+                                     -g regulatory.bed.gz
+"""
+
+import argparse
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+
+from collections import deque
+
+import numpy as np
+
+import finsurf
+import result_formats
+import utils
+
+from result_sink import row_digest, sort_key
+
+SHARDS_VERSION = 1
+MANIFEST = "shards.json"
+VCF_HEADER = "#CHROM\tPOS\tID\tREF\tALT\n"
+# Bits of the merge keys holding the line of a result in its shard file.
+LINE_BITS = 40
+
+
+def shard_path(shard_dir, shard):
+    return os.path.join(shard_dir, "shard_{:04d}.vcf".format(shard))
+
+
+def result_path(shard_dir, shard):
+    return os.path.join(shard_dir, "result_{:04d}.txt".format(shard))
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "source_size": stat.st_size,
+            "source_mtime": stat.st_mtime}
+
+
+def read_manifest(shard_dir):
+    """ Return the manifest of a shard directory, or a str with the error
+    message.
+    """
+    path = os.path.join(shard_dir, MANIFEST)
+    if not os.path.exists(path):
+        return "Error: {} is not a shard directory (no {}).".format(shard_dir,
+                                                                    MANIFEST)
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SHARDS_VERSION:
+        return ("Error: the shards of {} were written by another version, "
+                "split the input again.".format(shard_dir))
+    return manifest
+
+
+def base_counts(chunk):
+    """ Number of bases expanded for each variant of a chunk (see
+    'finsurf.expand_regions'), or a str with the error message.
+    """
+    records = finsurf.create_records_vcf(chunk, finsurf.Record)
+    if type(records) is str:
+        return records
+    return np.array([max(reg.end - reg.start, 0) for reg in records],
+                    dtype="int64")
+
+
+def split_vcf(input_file, shard_dir, n_shards, chunksize=100000, threads=1):
+    """ Split a VCF into 'n_shards' shards of consecutive variants, balanced
+    by expanded bases.
+
+    The input is read twice: once to count the bases, then to write the
+    shards. Multi-allelic records are written as one line per ALT allele.
+
+    Returns:
+        the manifest written in 'shard_dir', or a str with the error message.
+    """
+    if n_shards < 1:
+        return "Error: the number of shards must be at least 1."
+    reader = finsurf.build_reader(input_file, chunksize=chunksize,
+                                  threads=threads)
+    if type(reader) is str:
+        return reader
+    total = 0
+    for chunk in reader:
+        counts = base_counts(chunk)
+        if type(counts) is str:
+            return counts
+        total += int(counts.sum())
+
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    shards = [{"file": os.path.basename(shard_path(shard_dir, k)),
+               "variants": 0, "bases": 0} for k in range(n_shards)]
+    done = 0
+    current = -1
+    f = None
+    try:
+        for chunk in finsurf.build_reader(input_file, chunksize=chunksize,
+                                          threads=threads):
+            counts = base_counts(chunk)
+            before = done + np.cumsum(counts) - counts
+            done += int(counts.sum())
+            # Shard of each variant, from the bases before it (increasing).
+            chunk_shards = np.minimum(before * n_shards // max(total, 1),
+                                      n_shards - 1)
+            rows = list(zip(*(chunk.iloc[:,k].tolist() for k in range(5))))
+            for shard in np.unique(chunk_shards).tolist():
+                first, last = np.searchsorted(chunk_shards, [shard, shard + 1])
+                while current < shard:
+                    if f is not None:
+                        f.close()
+                    current += 1
+                    f = open(shard_path(shard_dir, current), "w")
+                    f.write(VCF_HEADER)
+                f.writelines("\t".join(str(v) for v in row) + "\n"
+                             for row in rows[first:last])
+                shards[shard]["variants"] += int(last - first)
+                shards[shard]["bases"] += int(counts[first:last].sum())
+        # Shards left empty by very long variants.
+        while current < n_shards - 1:
+            if f is not None:
+                f.close()
+            current += 1
+            f = open(shard_path(shard_dir, current), "w")
+            f.write(VCF_HEADER)
+    finally:
+        if f is not None:
+            f.close()
+
+    manifest = dict(file_stamp(input_file), version=SHARDS_VERSION,
+                    n_shards=n_shards, bases=total, shards=shards)
+    with open(os.path.join(shard_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    # Results of a previous split are obsolete.
+    for k in range(n_shards):
+        if os.path.exists(result_path(shard_dir, k)):
+            os.remove(result_path(shard_dir, k))
+    return manifest
+
+
+def score_shard(shard_dir, shard, scoring_args):
+    """ Score one shard with 'finsurf.run_intersect'.
+
+    Args:
+        scoring_args(list): options of finsurf.py (besides -i, -od and -of).
+    Returns:
+        path of the result file of the shard, or a str with the error message.
+    """
+    manifest = read_manifest(shard_dir)
+    if type(manifest) is str:
+        return manifest
+    if not 0 <= shard < manifest["n_shards"]:
+        return "Error: no shard {} in {} ({} shards).".format(
+                    shard, shard_dir, manifest["n_shards"])
+    result_file = result_path(shard_dir, shard)
+    if os.path.exists(result_file):
+        return result_file
+
+    # Written under a temporary name, so that only complete results count.
+    part_file = result_file + ".part"
+    if manifest["shards"][shard]["variants"] == 0:
+        with open(part_file, "w") as f:
+            f.write("#" + "\t".join(utils.header) + "\n")
+    else:
+        args = finsurf.argparser().parse_args(
+                    scoring_args + ["-i", shard_path(shard_dir, shard),
+                                    "-od", shard_dir, "-of", "txt"])
+        error = finsurf.run_arguments(args, result_file=part_file)
+        if error.startswith("Error"):
+            return error
+    os.replace(part_file, result_file)
+    return result_file
+
+
+def read_shard_results(result_file, shard):
+    """ Yield the (key, row) items of a shard result file, keys ordering the
+    rows of different shards as in a single run.
+    """
+    with open(result_file) as f:
+        for line_no, line in enumerate(f):
+            if line.startswith("#"):
+                continue
+            yield (shard << LINE_BITS) + line_no, line.rstrip("\n").split("\t")
+
+
+class MergedResults(object):
+    """ Stream the results of all the shards, in output order, without
+    duplicates ; used as the sink of 'result_formats.write_results'.
+
+    Rows are read from the sorted shard files and k-way merged. Identical rows
+    have the same score, so only the digests of the rows with the current
+    score are kept in memory.
+    """
+
+    def __init__(self, result_files, top=None, buffer_size=1000000):
+        self.result_files = result_files
+        self.top = top
+        self.buffer_size = buffer_size
+        self.n_results = 0
+        self.n_duplicates = 0
+
+    def __iter__(self):
+        self.n_results = 0
+        self.n_duplicates = 0
+        merged = heapq.merge(*[read_shard_results(path, shard)
+                               for shard, path in enumerate(self.result_files)],
+                             key=sort_key, reverse=True)
+        score = None
+        seen = set()
+        for key, row in merged:
+            if self.top is not None and self.n_results >= self.top:
+                break
+            if row[3] != score:
+                score = row[3]
+                seen = set()
+            digest = row_digest(row)
+            if digest in seen:
+                self.n_duplicates += 1
+                continue
+            seen.add(digest)
+            self.n_results += 1
+            yield key, row
+
+    def write(self, result_file):
+        """ Write the header and all the rows, sorted, to 'result_file'. """
+        with open(result_file, "w") as f:
+            f.write("#" + "\t".join(utils.header) + "\n")
+            for _, row in self:
+                f.write("\t".join(row) + "\n")
+
+
+def merge_shards(shard_dir, output=None, output_format="txt", top=None):
+    """ Merge the results of all the shards into one result file.
+
+    Returns:
+        path of the merged file, or a str with the error message.
+    """
+    error = result_formats.check_format(output_format)
+    if error:
+        return error
+    manifest = read_manifest(shard_dir)
+    if type(manifest) is str:
+        return manifest
+    result_files = [result_path(shard_dir, k)
+                    for k in range(manifest["n_shards"])]
+    missing = [str(k) for k, path in enumerate(result_files)
+               if not os.path.exists(path)]
+    if missing:
+        return "Error: shards not scored yet in {}: {}.".format(
+                    shard_dir, ", ".join(missing))
+    if output is None:
+        output = os.path.join(shard_dir, "result." +
+                              result_formats.output_formats[output_format])
+    results = MergedResults(result_files, top=top)
+    result_formats.write_results(results, output, output_format, shard_dir)
+    print("Merged {} shards: {} results, {} duplicates dropped.".format(
+            len(result_files), results.n_results, results.n_duplicates),
+          file=sys.stderr)
+    return output
+
+
+def launch(commands, processes):
+    """ Run the commands, at most 'processes' at a time (a stand-in for the
+    job arrays of a cluster scheduler).
+
+    Returns:
+        list of the indexes of the failed commands.
+    """
+    pending = deque(enumerate(commands))
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < processes:
+            k, command = pending.popleft()
+            running[k] = subprocess.Popen(command)
+        for k, process in list(running.items()):
+            if process.poll() is not None:
+                if process.returncode != 0:
+                    failed.append(k)
+                del running[k]
+        time.sleep(0.1)
+    return sorted(failed)
+
+
+def run_local(input_file, shard_dir, n_shards, processes, scoring_args,
+              output=None, output_format="txt", top=None, chunksize=100000,
+              threads=1):
+    """ Split, score the shards in local processes, and merge.
+
+    The input is not split again if 'shard_dir' already holds its shards, and
+    the shards already scored are skipped.
+    """
+    manifest = read_manifest(shard_dir)
+    if (type(manifest) is str or manifest["n_shards"] != n_shards
+            or any(manifest[key] != value
+                   for key, value in file_stamp(input_file).items())):
+        manifest = split_vcf(input_file, shard_dir, n_shards, chunksize,
+                             threads)
+        if type(manifest) is str:
+            return manifest
+    script = os.path.abspath(__file__)
+    failed = launch([[sys.executable, script, "score-shard", "-d", shard_dir,
+                      "-k", str(k)] + scoring_args
+                     for k in range(n_shards)], processes)
+    if failed:
+        return "Error: shards {} failed.".format(
+                    ", ".join(str(k) for k in failed))
+    return merge_shards(shard_dir, output, output_format, top)
+
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    shard = commands.add_parser("shard", allow_abbrev=False,
+                                help="Split a VCF into shards.")
+    run = commands.add_parser("run", allow_abbrev=False,
+                              help="Split, score the shards in local "
+                                   "processes, and merge (other options are "
+                                   "passed to finsurf.py).")
+    for subparser in (shard, run):
+        subparser.add_argument("-i",
+                               "--input",
+                               type=str,
+                               help="Input VCF file.",
+                               required=True)
+        subparser.add_argument("-n",
+                               "--shards",
+                               type=int,
+                               help="Number of shards.",
+                               required=True)
+        subparser.add_argument("--split_chunksize",
+                               type=int,
+                               help="Number of variants read at once while "
+                                    "splitting.",
+                               default=100000)
+        subparser.add_argument("--split_threads",
+                               type=int,
+                               help="Number of threads decompressing a "
+                                    "bgzipped input.",
+                               default=4)
+    run.add_argument("-p",
+                     "--processes",
+                     type=int,
+                     help="Number of shards scored at the same time.",
+                     default=1)
+
+    score = commands.add_parser("score-shard", allow_abbrev=False,
+                                help="Score one shard (other options are "
+                                     "passed to finsurf.py).")
+    score.add_argument("-k",
+                       "--shard",
+                       type=int,
+                       help="Index of the shard, from 0.",
+                       required=True)
+
+    merge = commands.add_parser("merge", allow_abbrev=False,
+                                help="Merge the results of the shards.")
+    for subparser in (shard, run, score, merge):
+        subparser.add_argument("-d",
+                               "--shard_dir",
+                               type=str,
+                               help="Directory of the shards and of their "
+                                    "results.",
+                               required=True)
+    for subparser in (run, merge):
+        subparser.add_argument("-o",
+                               "--output",
+                               type=str,
+                               help="Merged result file (by default "
+                                    "'result.<format>' in the shard "
+                                    "directory).")
+        subparser.add_argument("-of",
+                               "--output_format",
+                               type=str,
+                               help="Format of the merged result file, see "
+                                    "finsurf.py.",
+                               choices=list(result_formats.output_formats),
+                               default="txt")
+        subparser.add_argument("--top",
+                               type=int,
+                               help="Only keep the K best results (given to "
+                                    "each shard by 'run').",
+                               required=False)
+    return parser
+
+
+def main():
+    args, scoring_args = argparser().parse_known_args()
+    if scoring_args and args.command in ("shard", "merge"):
+        print("Error: unknown arguments: " + " ".join(scoring_args))
+        return 1
+
+    if args.command == "shard":
+        result = split_vcf(args.input, args.shard_dir, args.shards,
+                           args.split_chunksize, args.split_threads)
+        if type(result) is not str:
+            for shard in result["shards"]:
+                print("{}\t{}\t{}".format(
+                        os.path.join(args.shard_dir, shard["file"]),
+                        shard["variants"], shard["bases"]))
+            return 0
+    elif args.command == "score-shard":
+        result = score_shard(args.shard_dir, args.shard, scoring_args)
+    elif args.command == "merge":
+        result = merge_shards(args.shard_dir, args.output,
+                              args.output_format, args.top)
+    else:
+        if args.top is not None:
+            scoring_args += ["--top", str(args.top)]
+        result = run_local(args.input, args.shard_dir, args.shards,
+                           args.processes, scoring_args, args.output,
+                           args.output_format, args.top,
+                           args.split_chunksize, args.split_threads)
+    print(result)
+    return 1 if result.startswith("Error") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
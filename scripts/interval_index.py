@@ -0,0 +1,181 @@
+"""In-memory interval index of a (small) tabix-indexed file.
+
+The records of the file are loaded once into per-chromosome arrays of start
+and end positions, sorted as in the file, and the overlaps of a whole set of
+positions are found with a few vectorized binary searches. The records are
+those and only those tabix would return: positions are converted with
+'tabix_utils.record_interval', and a query [beg, end) hits every record with
+rec_beg < end and rec_end > beg.
+
+The built index can be cached in a directory given by the user
+('--index_cache' of finsurf.py), as plain numpy arrays ('.npz', read without
+unpickling), and is rebuilt when the file changes (path, size or modification
+time) or when the cache format does.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import tabix_utils
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".fidx.npz"
+
+
+class IntervalIndex(object):
+    """ Interval index of the records of a tabix-indexed file.
+
+    Attributes:
+        chroms(dict): for each sequence name, a tuple (begs, ends, max_ends,
+                      fields) where 'begs' and 'ends' are the 0-based intervals
+                      of the records in file order, 'max_ends' the running
+                      maximum of 'ends', and 'fields' the records (lists of
+                      str).
+    """
+
+    def __init__(self, chroms):
+        self.chroms = chroms
+
+    @classmethod
+    def from_file(cls, path):
+        """ Read all the records of a tabix-indexed file. """
+        index = tabix_utils.read_tbi(path)
+        reader = tabix_utils.BgzfReader(path)
+        chroms = {}
+        try:
+            for chrom in index.names:
+                records = list(tabix_utils.iter_records(reader, index, chrom))
+                if not records:
+                    continue
+                begs = np.array([r[0] for r in records], dtype="int64")
+                ends = np.array([r[1] for r in records], dtype="int64")
+                chroms[chrom] = (begs, ends, np.maximum.accumulate(ends),
+                                 [r[2] for r in records])
+        finally:
+            reader.close()
+        return cls(chroms)
+
+    def query(self, chroms, begs, ends):
+        """ Find the records overlapping a set of 0-based intervals.
+
+        Args:
+            chroms(array-like): sequence name of each interval.
+            begs(array-like), ends(array-like): 0-based, half-open intervals.
+        Returns:
+            list with, for each interval, the list of the fields of the
+            records overlapping it, in file order (empty if none).
+        """
+        chroms = np.asarray(chroms, dtype=object)
+        begs = np.asarray(begs, dtype="int64")
+        ends = np.asarray(ends, dtype="int64")
+        hits = [[] for _ in range(len(begs))]
+        for chrom in set(chroms.tolist()):
+            if chrom not in self.chroms:
+                continue
+            rec_begs, rec_ends, max_ends, fields = self.chroms[chrom]
+            select = np.nonzero(chroms == chrom)[0]
+            q_begs, q_ends = begs[select], ends[select]
+            # Records before 'first' all end before the query ; records from
+            # 'last' on all start after it.
+            first = np.searchsorted(max_ends, q_begs, side="right")
+            last = np.searchsorted(rec_begs, q_ends, side="left")
+            counts = np.maximum(last - first, 0)
+            if not counts.any():
+                continue
+            query_idx = np.repeat(np.arange(len(select)), counts)
+            rec_idx = (np.repeat(first, counts) + np.arange(len(query_idx))
+                       - np.repeat(np.cumsum(counts) - counts, counts))
+            overlap = rec_ends[rec_idx] > q_begs[query_idx]
+            for k, r in zip(select[query_idx[overlap]].tolist(),
+                            rec_idx[overlap].tolist()):
+                hits[k].append(fields[r])
+        return hits
+
+
+def cache_path(path, cache_dir):
+    """ Cache file of the index of 'path' in 'cache_dir' (one per file). """
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf8")).hexdigest()
+    return os.path.join(cache_dir, digest[:32] + CACHE_SUFFIX)
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return json.dumps([CACHE_VERSION, os.path.abspath(path), stat.st_size,
+                       stat.st_mtime])
+
+
+def save(interval_index, path, stamp):
+    """ Write an index as plain arrays (numpy .npz, no pickled objects). """
+    arrays = {"stamp": np.array(stamp),
+              "chroms": np.array(sorted(interval_index.chroms))}
+    for k, chrom in enumerate(sorted(interval_index.chroms)):
+        begs, ends, _, fields = interval_index.chroms[chrom]
+        arrays["begs_{}".format(k)] = begs
+        arrays["ends_{}".format(k)] = ends
+        # Records as their tab-separated lines, one after the other.
+        arrays["lines_{}".format(k)] = np.frombuffer(
+                "\n".join("\t".join(rec) for rec in fields).encode("utf8"),
+                dtype="uint8")
+    tmp_path = path + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read(path, stamp):
+    """ Read an index written by 'save', or None if it is not up to date. """
+    with np.load(path, allow_pickle=False) as arrays:
+        if str(arrays["stamp"]) != stamp:
+            return None
+        chroms = {}
+        for k, chrom in enumerate(arrays["chroms"].tolist()):
+            ends = arrays["ends_{}".format(k)]
+            fields = [line.split("\t") for line in
+                      arrays["lines_{}".format(k)].tobytes().decode("utf8")
+                                                  .split("\n")]
+            chroms[chrom] = (arrays["begs_{}".format(k)], ends,
+                             np.maximum.accumulate(ends), fields)
+    return IntervalIndex(chroms)
+
+
+def load(path, cache_dir=None):
+    """ Load the interval index of a file, from the cache in 'cache_dir' when
+    given and up to date.
+
+    The cache is (re)written when possible ; a read-only cache directory only
+    means the index is built at each run.
+    """
+    if cache_dir is None:
+        return IntervalIndex.from_file(path)
+    stamp = file_stamp(path)
+    cached = cache_path(path, cache_dir)
+    try:
+        interval_index = read(cached, stamp)
+        if interval_index is not None:
+            return interval_index
+    except (OSError, KeyError, ValueError):
+        pass
+
+    interval_index = IntervalIndex.from_file(path)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        save(interval_index, cached, stamp)
+    except OSError:
+        pass
+    return interval_index
+
+
+_indexes = {}
+
+def open_index(path, cache_dir=None):
+    """ Load the interval index of a file once per process (the first call
+    decides whether 'cache_dir' is used).
+    """
+    key = os.path.abspath(path)
+    if key not in _indexes:
+        _indexes[key] = load(path, cache_dir)
+    return _indexes[key]
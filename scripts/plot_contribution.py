@@ -1,13 +1,17 @@
 import argparse
+import multiprocessing
 import os
 import sys
 
-import pandas as pd
+from collections import OrderedDict
 
-import tabix
+import pandas as pd
 
 import plotly.express as px
 import plotly
+import feature_store
+import finsurf
+import tabix_utils
 import utils
 
 ## text size
@@ -27,7 +31,294 @@ LOGGER = logging.getLogger(__name__)
 ###############################################################################
 # DEFINITIONS
 
-        
+_renamings = {}
+
+def read_renaming(rename_cols_table):
+    """ Map of the model columns to their names, read once per process. """
+    key = os.path.abspath(rename_cols_table)
+    if key not in _renamings:
+        renaming_table = pd.read_table(rename_cols_table,
+                                       header=0,
+                                       index_col=None,
+                                       sep="\t"
+                                      )
+        _renamings[key] = renaming_table.set_index("old")["new"]
+    return _renamings[key]
+
+def featCont_path(vartype, featCont_transition_path, featCont_transversion_path):
+    """ Table of feature contributions to use for a variant type. """
+    if vartype=='transition':
+        return featCont_transition_path
+    #TODO : UPDATE WITH THE REAL TABLE FOR INDELS ONCE GENERATED.
+    # The values should match the transversions' one though.
+    return featCont_transversion_path
+
+def query_values(table_path, variant_query):
+    """ Feature values of the records of a table at "chrom:pos-pos".
+
+    Args:
+        table_path(str): tabix-indexed table, or feature store directory built
+                         with feature_store.py.
+    Returns:
+        list of values (list of str, or numpy array for a store), one per
+        record found.
+    """
+    if feature_store.is_feature_store(table_path):
+        chrom, region = variant_query.rsplit(":", 1)
+        store = feature_store.open_store(table_path)
+        return store.query(chrom, int(region.split("-")[0]))
+    bed_tabix = tabix_utils.registry.tabix(table_path)
+    return [fields[feature_store.FIRST_VALUE_COLUMN:]
+            for fields in bed_tabix.querys(variant_query)]
+
+def feature_series(values, name, map_rename):
+    """ Series of feature values, parsed if needed.
+
+    Values read from a feature store keep their single precision, so that
+    they are written back as they were in the table.
+    """
+    series = pd.Series(values, name=name, index=map_rename)
+    if series.dtype.kind != "f":
+        return series.astype(float)
+    return series.astype("float32") if series.dtype.itemsize < 4 else series
+
+def feature_table(raw_values, scaled_values, featCont_values, vartype, map_rename):
+    """ Combine the records of the three tables for one variant.
+
+    Args:
+        raw_values, scaled_values, featCont_values: feature values (list of
+            str or numpy array, see 'query_values') of the numeric features,
+            scaled numeric features and feature contributions tables.
+        vartype(str): 'transition', 'transversion', 'indel' or other.
+        map_rename(Series): names of the features.
+    Returns:
+        DataFrame with the columns 'rawNum', 'scaledNum' and 'featCont',
+        indexed by feature name.
+    """
+    scaled_features = feature_series(scaled_values, 'scaledNum', map_rename)
+
+    # Here : we need to update the first feature value, corresponding to
+    # the variant type ordinal value. 0 (default) for transition, 0.5 for
+    # transversion, and 1 for indels.
+    if vartype == "transversion":
+        scaled_features.loc["Variant type"] = 0.5
+
+    elif vartype == "indel":
+        scaled_features.loc["Variant type"] = 1
+
+    else:
+        scaled_features.loc["Variant type"] = 0
+
+    feature_contributions = feature_series(featCont_values, 'featCont', map_rename)
+
+    raw_features = feature_series(raw_values, 'rawNum', map_rename)
+
+    if vartype == "transversion":
+        raw_features.loc["Variant type"] = 1
+
+    elif vartype == "indel":
+        raw_features.loc["Variant type"] = 2
+
+    else:
+        raw_features.loc["Variant type"] = 0
+
+    # Combine feature cotributions and scaled features
+    return pd.concat([raw_features, scaled_features,feature_contributions], axis=1)
+
+def make_figure(df, variant):
+    """ Bar chart of the scaled features, colored by contribution. """
+    fig = px.bar(df, x=df.index, y='scaledNum',color='featCont',
+                        color_continuous_scale=[[0,'#145787'],[0.5,'white'],[1,'red']], 
+                        range_color=[-0.06, 0.06])
+    fig.update_traces(marker_line_color='#888888', marker_line_width=1, 
+                        hovertemplate="<br>%{hovertext}",
+                        hovertext = [('Raw: {:.4f}<br>Contribution: {:.4f}<br>'
+                        ).format(row['rawNum'],
+                                 row['featCont'])
+                        for i, row in df.iterrows()],
+                    hoverinfo = 'none',
+                    hoverlabel={"namelength" :-1}, 
+                )
+    fig['layout']['yaxis1'].update(title='Scaled feature', range=[-1.1,1.1], autorange=False, titlefont=dict(size=MEDIUM_SIZE), tickfont=dict(size=SMALL_SIZE))
+    fig['layout']['xaxis1'].update(title='', tickfont=dict(size=SMALL_SIZE), tickangle=-45)
+    fig.update_layout(title= "Variant " + variant,  hovermode='x unified',  coloraxis_colorbar=dict(title="Feature Contribution", titlefont=dict(size=MEDIUM_SIZE), titleside='right', tickfont=dict(size=SMALL_SIZE), thicknessmode="pixels", thickness=15))
+    return fig
+
+# Output formats of the figures: 'html' is interactive, the others are static
+# images, exported with 'fig.write_image' (requires the kaleido package).
+figure_formats = ["html", "svg", "jpeg", "png"]
+
+def write_figure(fig, out_dir='', prefix='plot', formats=("html",)):
+    """ Write a figure in each of the requested formats.
+
+    Returns:
+        OrderedDict format -> path of the file written.
+    """
+    files = OrderedDict()
+    for out_format in formats:
+        out_file = utils.make_tmp_file(prefix,out_format,out_dir)
+        try:
+            if out_format == "html":
+                fig.write_html(out_file)
+            else:
+                fig.write_image(out_file, format=out_format)
+        except Exception:
+            os.remove(out_file)
+            raise
+        files[out_format] = out_file
+    return files
+
+def render_variant(task):
+    """ Plot and write the figure of one variant (in a worker process).
+
+    Args:
+        task(tuple): (df, variant, out_dir, prefix, formats).
+    Returns:
+        dict of files, as returned by 'write_figure', or a str with the error
+        message.
+    """
+    df, variant, out_dir, prefix, formats = task
+    try:
+        return write_figure(make_figure(df, variant), out_dir, prefix, formats)
+    except Exception as e:
+        LOGGER.exception("Error while writing the figure of " + variant)
+        return "Error while writing the figure: " + str(e)
+
+def read_batch_variants(batch_file):
+    """ Read the variants to plot from a FINSURF result file or a list.
+
+    Result files give one variant per scored base: the base is taken from the
+    'end' column, and the variant type from the 'vartrans' column. Variant
+    lists give one variant per line, as "chrom:pos" or "chrom<TAB>pos",
+    optionally followed by the variant type (default: transversion, as the
+    single-variant mode for other types).
+
+    Returns:
+        list of unique (chrom, pos, vartype), in order of appearance.
+    """
+    variants = []
+    with open(batch_file) as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= len(utils.header):
+                variants.append((fields[0], int(fields[2]), fields[8]))
+                continue
+            if ":" in fields[0]:
+                fields = fields[0].split(":") + fields[1:]
+            vartype = fields[2] if len(fields) > 2 else "transversion"
+            variants.append((fields[0], int(fields[1]), vartype))
+    return list(OrderedDict.fromkeys(variants))
+
+def fetch_records(positions, table_path, engine="tabix"):
+    """ Feature values of a table at sorted positions, in one ordered pass.
+
+    Args:
+        positions(list): sorted (chrom, pos) with 1-based positions.
+        table_path(str): tabix-indexed table, or feature store directory.
+        engine(str): 'finsurf.intersect_engines' engine used for the pass
+                     (tables only).
+    Returns:
+        dict (chrom, pos) -> list of values found (see 'query_values').
+    """
+    if not positions:
+        return {}
+    if feature_store.is_feature_store(table_path):
+        return feature_store.open_store(table_path).query_many(positions)
+    df_positions = pd.DataFrame(OrderedDict([
+                        ("chrom", [chrom for chrom, _ in positions]),
+                        ("pos", [pos for _, pos in positions]),
+                        ("start", [pos - 1 for _, pos in positions]),
+                        ("end", [pos for _, pos in positions])]))
+    intersection = finsurf.intersect_engines[engine](df_positions, table_path)
+    records = {}
+    for chrom, pos in positions:
+        key = "@".join([chrom, str(pos), str(pos - 1), str(pos)])
+        records[(chrom, pos)] = [
+                fields[feature_store.FIRST_VALUE_COLUMN:] for fields in
+                finsurf.flatten([res for res in intersection[key] if res])]
+    return records
+
+def do_plot_batch(batch_file, rename_cols_table, numFeat_path, scaled_numFeat_path, featCont_transition_path, featCont_transversion_path, out_dir='', engine="sweep", formats=("html",), jobs=1):
+    """ Plot the feature contributions of many variants.
+
+    Positions are sorted, and each table is read in a single ordered pass ;
+    the feature contributions of each variant are taken from the table of its
+    variant type. Figures are rendered in 'jobs' processes.
+
+    Returns:
+        (table_file, plots, errors): path to the combined table (one row per
+        variant and feature), list of (variant, dict format -> plot file) and
+        list of (variant, error message).
+    """
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    map_rename = read_renaming(rename_cols_table)
+    variants = read_batch_variants(batch_file)
+    positions = sorted(set((chrom, pos) for chrom, pos, _ in variants))
+
+    raw = fetch_records(positions, numFeat_path, engine)
+    scaled = fetch_records(positions, scaled_numFeat_path, engine)
+    # Keyed by variant type: both tables may be the same file.
+    featCont = {}
+    for vartype in sorted(set(vartype for _, _, vartype in variants)):
+        vartype_positions = sorted(set(
+            (chrom, pos) for chrom, pos, variant_type in variants
+            if variant_type == vartype))
+        featCont[vartype] = fetch_records(
+            vartype_positions, featCont_path(vartype, featCont_transition_path,
+                                             featCont_transversion_path),
+            engine)
+
+    tables = []
+    renders = []
+    errors = []
+    for chrom, pos, vartype in variants:
+        variant = chrom + ":" + str(pos)
+        records = [raw[(chrom, pos)], scaled[(chrom, pos)],
+                   featCont[vartype][(chrom, pos)]]
+        if any(len(res) != 1 for res in records):
+            LOGGER.warning("No record found or More than 1 hit for " + variant)
+            errors.append((variant, "Error: No record found or More than 1 hit."))
+            continue
+        try:
+            df = feature_table(records[0][0], records[1][0], records[2][0], vartype, map_rename)
+        except Exception as e:
+            LOGGER.exception("Error while reading the features of " + variant)
+            errors.append((variant, "Error while reading the features."))
+            continue
+        renders.append((df, variant, out_dir,
+                        "plot_{}_{}".format(chrom, pos), formats))
+
+        df = df.rename_axis("feature").reset_index()
+        df.insert(0, "vartype", vartype)
+        df.insert(0, "pos", pos)
+        df.insert(0, "chrom", chrom)
+        tables.append(df)
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            rendered = pool.map(render_variant, renders)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        rendered = [render_variant(task) for task in renders]
+    plots = []
+    for task, files in zip(renders, rendered):
+        if type(files) is str:
+            errors.append((task[1], files))
+        else:
+            plots.append((task[1], files))
+
+    table_file = utils.make_tmp_file('features','tsv',out_dir)
+    if tables:
+        pd.concat(tables).to_csv(table_file, sep="\t", index=False)
+    LOGGER.info("Plotted {} variants ({} errors).".format(len(plots), len(errors)))
+    return (table_file, plots, errors)
+
 # Argument parser
 # ===============
 
@@ -35,17 +326,24 @@ def argparser():
     parser = argparse.ArgumentParser(epilog=__doc__,
                                formatter_class=argparse.RawDescriptionHelpFormatter)
 
-    parser.add_argument('--variant',
+    variants = parser.add_mutually_exclusive_group(required=True)
+    variants.add_argument('--variant',
                         help='Variant position (format: "chrom:pos")',
-                        type=str,
-                        required=True
+                        type=str
+                        )
+
+    variants.add_argument('--batch',
+                        help='FINSURF result file, or list of variants ("chrom:pos" '
+                             'and optional variant type on each line), to plot '
+                             'all at once.',
+                        type=str
                         )
 
     parser.add_argument('--vartype',
-                        help='Variant type',
+                        help='Variant type (with --variant ; read from the '
+                             'vartrans column in --batch mode)',
                         type=str,
                         choices=['transition','transversion','not_SVN'],
-                        required=True
                        )
 
     parser.add_argument('--rename_cols_table',
@@ -55,35 +353,73 @@ def argparser():
                        )
     
     parser.add_argument('--numFeat_path',
-                        help='Path to tabix table of numeric features.',
+                        help='Path to tabix table of numeric features (or feature store directory built with feature_store.py).',
                         type=str,
                         required=True
                        )
                        
     parser.add_argument('--scaled_numFeat_path',
-                        help='Path to tabix table of *scaled* numeric features.',
+                        help='Path to tabix table of *scaled* numeric features (or feature store directory built with feature_store.py).',
                         type=str,
                         required=True
                        )
 
     parser.add_argument('--featCont_transition_path',
-                        help='Path to tabix table of tabix table of FC for transitions',
+                        help='Path to tabix table of tabix table of FC for transitions (or feature store directory built with feature_store.py).',
                         type=str,
                         required=True
                        )
 
     parser.add_argument('--featCont_transversion_path',
-                        help='Path to tabix table of tabix table of FC for transversions',
+                        help='Path to tabix table of tabix table of FC for transversions (or feature store directory built with feature_store.py).',
                         type=str,
                         required=True
                        )
 
+    parser.add_argument('--output_dir',
+                        help='Output directory (default: res/ in FINSURF directory).',
+                        type=str,
+                        default=''
+                       )
+
+    parser.add_argument('--engine',
+                        help='Intersection engine used for the --batch mode '
+                             '(see finsurf.py): the sorted positions are read '
+                             'in one pass with sweep, skipping the gaps '
+                             'between them ; tabix queries each position.',
+                        type=str,
+                        choices=['sweep', 'tabix'],
+                        default='sweep'
+                       )
+
+    parser.add_argument('--formats',
+                        help='Output formats of the figures (images require the '
+                             'kaleido package ; default: the four formats, '
+                             'e.g. --formats html for the interactive plot only).',
+                        type=str,
+                        nargs='+',
+                        choices=figure_formats,
+                        default=['svg', 'jpeg', 'png', 'html']
+                       )
+
+    parser.add_argument('--jobs',
+                        help='Number of processes rendering the figures in --batch mode.',
+                        type=int,
+                        default=1
+                       )
+
     return parser
 
 # Main and arguments
 # ------------------
 
-def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_numFeat_path, featCont_transition_path, featCont_transversion_path):
+def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_numFeat_path, featCont_transition_path, featCont_transversion_path, formats=("html",)):
+    """ Plot the feature contributions of one variant.
+
+    Returns:
+        (svg_file, jpeg_file, png_file, html_file), None for the formats not
+        requested, or (error message, None, None, None).
+    """
     try:
         pos = variant_query.split(":")[1]
         variant_query += "-"
@@ -92,39 +428,15 @@ def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_num
         LOGGER.exception("Error while trying to read the input variant string" + e )
         return ("Error while trying to read the input variant string",  None,  None,  None)
 
-    renaming_table = pd.read_table(rename_cols_table,
-                                   header=0,
-                                   index_col=None,
-                                   sep="\t"
-                                  )                 
-    map_rename = renaming_table.set_index("old")["new"]
+    map_rename = read_renaming(rename_cols_table)
 
     # Get the scaled numeric features
     try:
-        bed_tabix = tabix.open(scaled_numFeat_path)
-        query_res = bed_tabix.querys(variant_query)
-        res = list(query_res)
+        res = query_values(scaled_numFeat_path, variant_query)
         if not len(res)==1:
             raise RuntimeError("No record found or More than 1 hit.")
-            return ("Error: More than 1 hit.",  None,  None,  None)
-
-        scaled_features = pd.Series(res[0][4:],
-                                    name='scaledNum',
-                                    index=map_rename
-                                    ).astype(float)
-        
-        # Here : we need to update the first feature value, corresponding to
-        # the variant type ordinal value. 0 (default) for transition, 0.5 for
-        # transversion, and 1 for indels.
-        if vartype == "transversion":
-            scaled_features.loc["Variant type"] = 0.5
-
-        elif vartype == "indel":
-            scaled_features.loc["Variant type"] = 1
+        scaled_values = res[0]
 
-        else:
-            scaled_features.loc["Variant type"] = 0
-        
     except Exception as e:
         LOGGER.exception("Error while Getting the numeric features")
         return ("Error while Getting the numeric features",  None,  None,  None)
@@ -132,28 +444,10 @@ def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_num
 
     # Get the FC values
     try:
-        if vartype=='transition':
-            bed_tabix = tabix.open(featCont_transition_path)
-
-        elif vartype=='transversion' or vartype == 'not_SNV':
-            bed_tabix = tabix.open(featCont_transversion_path)
-
-        elif vartype=='indel':
-            #TODO : UPDATE WITH THE REAL TABLE ONCE GENERATED.
-            # The values should match the transversions' one though.
-            bed_tabix = tabix.open(featCont_transversion_path)
-
-        query_res = bed_tabix.querys(variant_query)
-        res = list(query_res)
+        res = query_values(featCont_path(vartype, featCont_transition_path, featCont_transversion_path), variant_query)
         if not len(res)==1:
             raise RuntimeError("No record found or More than 1 hit.")
-            return ("Error: No record found or More than 1 hit.",  None,  None,  None)
-
-        feature_contributions = pd.Series(res[0][4:],
-                                          name='featCont',
-                                          index=map_rename
-                                          ).astype(float)
-            
+        featCont_values = res[0]
 
     except Exception as e:
         LOGGER.exception("Error while getting the feature contributions")
@@ -161,64 +455,32 @@ def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_num
 
     # Tabix block to add for retrieving the "numeric features"
     try:
-        bed_tabix = tabix.open(numFeat_path)
-        query_res = bed_tabix.querys(variant_query)
-        res = list(query_res)
+        res = query_values(numFeat_path, variant_query)
         if not len(res)==1:
             raise RuntimeError("No record found or More than 1 hit.")
-            return ("Error: No record found or More than 1 hit.",  None,  None,  None)
-
-        raw_features = pd.Series(res[0][4:],
-                                    name='rawNum',
-                                    index=map_rename
-                                    ).astype(float)
-
-        if vartype == "transversion":
-            raw_features.loc["Variant type"] = 1
-
-        elif vartype == "indel":
-            raw_features.loc["Variant type"] = 2
+        raw_values = res[0]
 
-        else:
-            raw_features.loc["Variant type"] = 0 
-            
     except Exception as e:
         LOGGER.exception("Error while getting the numerice features")
         return ("Error while getting the numeric features.",  None,  None,  None)
-    
-    # Combine feature cotributions and scaled features
-    df =  pd.concat([raw_features, scaled_features,feature_contributions], axis=1) 
+
+    try:
+        df = feature_table(raw_values, scaled_values, featCont_values, vartype, map_rename)
+    except Exception as e:
+        LOGGER.exception("Error while reading the features")
+        return ("Error while reading the features.",  None,  None,  None)
+
     # Plot the bar chart
-    fig = px.bar(df, x=df.index, y='scaledNum',color='featCont',
-                        color_continuous_scale=[[0,'#145787'],[0.5,'white'],[1,'red']], 
-                        range_color=[-0.06, 0.06])
-    fig.update_traces(marker_line_color='#888888', marker_line_width=1, 
-                        hovertemplate="<br>%{hovertext}",
-                        hovertext = [('Raw: {:.4f}<br>Contribution: {:.4f}<br>'
-                        ).format(row['rawNum'],
-                                 row['featCont'])
-                        for i, row in df.iterrows()],
-                    hoverinfo = 'none',
-                    hoverlabel={"namelength" :-1}, 
-                )
-    fig['layout']['yaxis1'].update(title='Scaled feature', range=[-1.1,1.1], autorange=False, titlefont=dict(size=MEDIUM_SIZE), tickfont=dict(size=SMALL_SIZE))
-    fig['layout']['xaxis1'].update(title='', tickfont=dict(size=SMALL_SIZE), tickangle=-45)
-    fig.update_layout(title= "Variant " + variant_query.split("-")[0],  hovermode='x unified',  coloraxis_colorbar=dict(title="Feature Contribution", titlefont=dict(size=MEDIUM_SIZE), titleside='right', tickfont=dict(size=SMALL_SIZE), thicknessmode="pixels", thickness=15))
+    fig = make_figure(df, variant_query.split("-")[0])
     
-    #write to files
-    svg_file = utils.make_tmp_file('plot','svg','')	
-    jpeg_file = utils.make_tmp_file('plot','jpeg','')
-    png_file = utils.make_tmp_file('plot','png','')
-    html_file = utils.make_tmp_file('plot','html','')
-    plotly.offline.plot(fig, filename=svg_file+".html", image_filename=svg_file,  image='svg', auto_open=False)
-    plotly.offline.plot(fig, filename=jpeg_file+".html", image_filename=jpeg_file, image='jpeg', auto_open=False)
-    plotly.offline.plot(fig, filename=png_file+".html", image_filename=png_file, image='png', auto_open=False)
-    fig.write_html(html_file)
-    os.remove(svg_file)
-    os.remove(jpeg_file)
-    os.remove(png_file)
+    #write to files (only the requested formats)
+    try:
+        files = write_figure(fig, formats=formats)
+    except Exception as e:
+        LOGGER.exception("Error while writing the figure")
+        return ("Error while writing the figure: " + str(e),  None,  None,  None)
     LOGGER.info("Plotting the figure.")
-    return (svg_file, jpeg_file, png_file, html_file)
+    return (files.get("svg"), files.get("jpeg"), files.get("png"), files.get("html"))
 
 ###############################################################################
 # MAIN
@@ -226,12 +488,27 @@ def do_plot(variant_query, vartype, rename_cols_table, numFeat_path,  scaled_num
 if __name__ == "__main__":
     parser = argparser()
     args = parser.parse_args()
+
+    if args.batch:
+        (table_file, plots, errors) = do_plot_batch(args.batch, args.rename_cols_table, args.numFeat_path,  args.scaled_numFeat_path, args.featCont_transition_path, args.featCont_transversion_path, args.output_dir, args.engine, args.formats, args.jobs)
+        print("TABLE: " + table_file)
+        for variant, files in plots:
+            print(variant + "".join("\t{}: {}".format(out_format.upper(), out_file)
+                                    for out_format, out_file in files.items()))
+        for variant, error in errors:
+            print(variant + "\t" + error)
+        LOGGER.info("Script ended successfully.")
+        sys.exit(0)
+    if not args.vartype:
+        parser.error("--vartype is required with --variant.")
     
-    (svg_file,  jpeg_file,  png_file,  html_file) = do_plot(args.variant, args.vartype, args.rename_cols_table, args.numFeat_path,  args.scaled_numFeat_path, args.featCont_transition_path, args.featCont_transversion_path)
-    if jpeg_file == None:
+    (svg_file,  jpeg_file,  png_file,  html_file) = do_plot(args.variant, args.vartype, args.rename_cols_table, args.numFeat_path,  args.scaled_numFeat_path, args.featCont_transition_path, args.featCont_transversion_path, args.formats)
+    if svg_file is not None and svg_file.startswith("Error"):
         print(svg_file)
         LOGGER.info("Script ended with errors: " + svg_file )
     else:
-        print("SVG: " + svg_file + "\nJPEG: " + jpeg_file + "\nPNG: " + png_file + "\nHTML: " + html_file)
+        print("\n".join("{}: {}".format(name, out_file) for name, out_file in
+                        zip(["SVG", "JPEG", "PNG", "HTML"], [svg_file,  jpeg_file,  png_file,  html_file])
+                        if out_file is not None))
         LOGGER.info("Script ended successfully.")
     sys.exit(0)
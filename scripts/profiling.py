@@ -0,0 +1,268 @@
+"""Per-stage instrumentation of run_intersect.
+
+Stages (reading the input, building the Records, expanding the positions,
+querying the regulatory and score files, writing the results...) are timed
+with 'stage', and events (tabix queries, hits, rows expanded, duplicates...)
+are counted with 'count'; 'chunk' records the same figures for each chunk of
+variants. The memory (RSS, from /proc/self/statm) is read before and after
+each call of a stage, and each stage records its largest growth ; the report
+also gives the peak RSS of the main process over the whole run.
+
+Instrumentation is disabled by default: 'stage' and 'chunk' then return a
+shared no-op context manager, 'count' returns at once and 'timed' returns the
+iterable itself, so that the cost is a function call per stage.
+
+Worker processes send their figures back with 'snapshot', merged in the main
+process with 'merge'. Their stages are reported apart from the ones of the
+main process: their times add up over the workers, which run at the same
+time, so they are not a share of the wall time of the run. A worker scores a
+partition of a chunk at a time: its figures are reported as 'partitions'.
+"""
+
+import os
+import resource
+import time
+
+from collections import OrderedDict
+
+# Counters reported for each chunk.
+chunk_counters = ("rows_expanded", "tabix_queries", "tabix_records",
+                  "regulatory_hits", "results")
+
+
+PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+
+
+def peak_rss_mb():
+    """ Peak RSS of the process so far (ru_maxrss is in kB on Linux). """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def rss_mb():
+    """ Current RSS of the process, None if /proc/self/statm can't be read
+    (e.g. not on Linux).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_MB
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def rss_growth(rss0):
+    """ RSS growth since 'rss0' (None if the RSS can't be read). """
+    rss1 = rss_mb()
+    if rss0 is None or rss1 is None:
+        return None
+    return rss1 - rss0
+
+
+def max_growth(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class NullStage(object):
+    """ Context manager doing nothing (instrumentation disabled). """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+
+class Stage(object):
+    """ Time a block of code, added to the total of its stage. """
+
+    __slots__ = ("profiler", "name", "t0", "rss0")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.rss0 = rss_mb()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        self.profiler.add_stage(self.name, seconds,
+                                rss_growth=rss_growth(self.rss0))
+        return False
+
+
+class Chunk(object):
+    """ Record the time and counters of a chunk of variants. """
+
+    def __init__(self, profiler, variants):
+        self.profiler = profiler
+        self.variants = variants
+
+    def __enter__(self):
+        self.counters = dict(self.profiler.counters)
+        self.rss0 = rss_mb()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        counters = self.profiler.counters
+        entry = OrderedDict([("chunk", len(self.profiler.chunks)),
+                             ("variants", self.variants),
+                             ("seconds", time.perf_counter() - self.t0)])
+        for name in chunk_counters:
+            entry[name] = counters.get(name, 0) - self.counters.get(name, 0)
+        entry["rss_growth_mb"] = rss_growth(self.rss0)
+        self.profiler.chunks.append(entry)
+        return False
+
+
+class Profiler(object):
+    """ Wall time, calls and RSS growth per stage, counters, and per-chunk
+    figures of a run.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stages = OrderedDict()
+        self.worker_stages = OrderedDict()
+        self.workers = set()
+        self.counters = OrderedDict()
+        self.chunks = []
+        self.partitions = []
+        self.t0 = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def add_stage(self, name, seconds, calls=1, rss_growth=None,
+                  stages=None):
+        if stages is None:
+            stages = self.stages
+        entry = stages.get(name)
+        if entry is None:
+            entry = stages[name] = OrderedDict([("seconds", 0.0),
+                                                ("calls", 0),
+                                                ("rss_growth_mb", None)])
+        entry["seconds"] += seconds
+        entry["calls"] += calls
+        entry["rss_growth_mb"] = max_growth(entry["rss_growth_mb"],
+                                            rss_growth)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def chunk(self, variants):
+        if not self.enabled:
+            return NULL_STAGE
+        return Chunk(self, variants)
+
+    def timed(self, name, iterable):
+        """ Iterate, timing each step in the stage 'name'. """
+        if not self.enabled:
+            return iterable
+        return self._timed(name, iterable)
+
+    def _timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def snapshot(self):
+        """ Figures recorded so far (to be merged by another process). """
+        return {"pid": os.getpid(), "stages": self.stages,
+                "counters": self.counters, "chunks": self.chunks}
+
+    def merge(self, snapshot):
+        """ Add the figures of a worker process (see 'snapshot'). """
+        self.workers.add(snapshot["pid"])
+        for name, entry in snapshot["stages"].items():
+            self.add_stage(name, entry["seconds"], entry["calls"],
+                           entry["rss_growth_mb"], self.worker_stages)
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        # The 'chunks' of a worker are partitions of the chunks of the input.
+        for entry in snapshot["chunks"]:
+            entry = OrderedDict([("partition", len(self.partitions))]
+                                + [(name, value) for name, value in
+                                   entry.items() if name != "chunk"])
+            self.partitions.append(entry)
+
+    def report(self):
+        return OrderedDict([("total_seconds", time.perf_counter() - self.t0),
+                            ("process_peak_rss_mb", peak_rss_mb()),
+                            ("stages", self.stages),
+                            ("workers", len(self.workers)),
+                            ("worker_stages", self.worker_stages),
+                            ("counters", self.counters),
+                            ("chunks", self.chunks),
+                            ("partitions", self.partitions)])
+
+
+def format_growth(growth):
+    return "-" if growth is None else "{:.1f}".format(growth)
+
+
+def summary(report):
+    """ Human-readable summary of a report. """
+    header = "{:<22}{:>10}{:>12}{:>8}{:>18}"
+    row = "{:<22}{:>10}{:>12.3f}{:>8}{:>18}"
+    lines = [header.format("stage", "calls", "seconds", "%",
+                           "RSS growth (MB)")]
+    total = report["total_seconds"] or 1.0
+    for name, entry in report["stages"].items():
+        lines.append(row.format(
+                        name, entry["calls"], entry["seconds"],
+                        "{:.1f}".format(100.0 * entry["seconds"] / total),
+                        format_growth(entry["rss_growth_mb"])))
+    lines.append(row.format("total (wall)", "", report["total_seconds"], "",
+                            ""))
+    lines.append("process peak RSS so far: {:.1f} MB".format(
+                    report["process_peak_rss_mb"]))
+    if report["worker_stages"]:
+        lines.append("")
+        lines.append("worker processes ({}): seconds summed over the "
+                     "workers, not a share of the wall time".format(
+                        report["workers"]))
+        lines.append(header.format("stage", "calls", "seconds", "",
+                                   "RSS growth (MB)"))
+        for name, entry in report["worker_stages"].items():
+            lines.append(row.format(name, entry["calls"], entry["seconds"],
+                                    "", format_growth(entry["rss_growth_mb"])))
+    lines.append("")
+    for name, n in report["counters"].items():
+        lines.append("{:<22}{:>10}".format(name, n))
+    if report["chunks"] or not report["partitions"]:
+        lines.append("{:<22}{:>10}".format("chunks", len(report["chunks"])))
+    if report["partitions"]:
+        lines.append("{:<22}{:>10}".format("partitions",
+                                           len(report["partitions"])))
+    return "\n".join(lines)
+
+
+profiler = Profiler()
+stage = profiler.stage
+count = profiler.count
+chunk = profiler.chunk
+timed = profiler.timed
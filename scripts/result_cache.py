@@ -0,0 +1,143 @@
+"""Persistent cache of the results of each variant, across runs.
+
+The results of a variant only depend on the variant itself and on the data
+files (and filters) used to score it, so they are stored in a SQLite database,
+keyed by (chrom, pos, ref, alt) and by a fingerprint of the score and
+regulatory files, gene filter and minimum score. Variants without any result
+are cached too, as they are the most frequent.
+
+The database holds at most 'max_entries' variants: the least recently used
+ones are evicted at the end of each run.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import score_store
+
+CACHE_VERSION = 1
+# Maximum number of parameters in one SQLite query.
+QUERY_SIZE = 500
+
+
+def file_stamp(path):
+    """ Identify the version of a data file (or score store). """
+    if score_store.is_score_store(path):
+        with open(os.path.join(path, score_store.MANIFEST)) as f:
+            return ["store", json.load(f)["source_sha256"]]
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+
+def fingerprint(score, regulatory, elements=None, min_score=None):
+    """ Fingerprint of everything, besides the variant, results depend on. """
+    data = [CACHE_VERSION, file_stamp(score), file_stamp(regulatory),
+            sorted(elements) if elements is not None else None, min_score]
+    return hashlib.sha256(json.dumps(data).encode("utf8")).hexdigest()
+
+
+def variant_key(record, add_chr):
+    return "\t".join([str(record.chrom), str(int(add_chr)), str(record.start),
+                      str(record.ref), str(record.alt)])
+
+
+class ResultCache(object):
+    """ SQLite store of the results of each variant.
+
+    Args:
+        path(str): database file (created if needed).
+        fingerprint(str): version of the data, see 'fingerprint'.
+        max_entries(int): number of variants kept by 'evict'.
+    Attributes:
+        hits(int), misses(int): number of variants found or not in the cache.
+    """
+
+    def __init__(self, path, fingerprint, max_entries=1000000):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Several processes may use the cache at the same time.
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                        "fingerprint TEXT, key TEXT, rows TEXT, "
+                        "last_used REAL, PRIMARY KEY (fingerprint, key))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used "
+                        "ON results (last_used)")
+        self.db.commit()
+
+    def lookup(self, records, add_chr):
+        """ Find the cached results of Records.
+
+        Returns:
+            dict: index of the Record in 'records' -> list of result rows
+            (following 'utils.header', with the id of the Record).
+        """
+        keys = [variant_key(record, add_chr) for record in records]
+        found = {}
+        unique_keys = list(set(keys))
+        for i in range(0, len(unique_keys), QUERY_SIZE):
+            batch = unique_keys[i:i + QUERY_SIZE]
+            query = ("SELECT key, rows FROM results WHERE fingerprint = ? "
+                     "AND key IN ({})".format(",".join("?" * len(batch))))
+            for key, rows in self.db.execute(query,
+                                             [self.fingerprint] + batch):
+                found[key] = json.loads(rows)
+
+        hits = {}
+        for k, (record, key) in enumerate(zip(records, keys)):
+            if key in found:
+                # The id is the one of the current input.
+                hits[k] = [row[:4] + [str(record.id)] + row[4:]
+                           for row in found[key]]
+        self.hits += len(hits)
+        self.misses += len(records) - len(hits)
+
+        now = time.time()
+        self.db.executemany("UPDATE results SET last_used = ? "
+                            "WHERE fingerprint = ? AND key = ?",
+                            [(now, self.fingerprint, key) for key in found])
+        self.db.commit()
+        return hits
+
+    def store(self, items, add_chr):
+        """ Cache the results of Records.
+
+        Args:
+            items(list): (record, rows) pairs, where 'rows' are all the result
+                         rows of the Record (possibly none).
+        """
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            [(self.fingerprint, variant_key(record, add_chr),
+              json.dumps([row[:4] + row[5:] for row in rows]), now)
+             for record, rows in items])
+        self.db.commit()
+
+    def evict(self):
+        """ Remove the least recently used variants beyond 'max_entries'. """
+        count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM results WHERE rowid IN (SELECT rowid "
+                            "FROM results ORDER BY last_used LIMIT ?)",
+                            (count - self.max_entries,))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+_caches = {}
+
+def open_cache(path, fingerprint, max_entries=1000000):
+    """ Open the cache once per process. """
+    key = (os.getpid(), os.path.abspath(path), fingerprint)
+    if key not in _caches:
+        _caches[key] = ResultCache(path, fingerprint, max_entries)
+    return _caches[key]
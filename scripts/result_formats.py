@@ -0,0 +1,157 @@
+"""Output formats of the run_intersect results.
+
+- 'txt': the result file of the web server, sorted by score (default).
+- 'tabix': the same columns, sorted by coordinates (chrom, pos, end), bgzipped
+  and tabix-indexed on the chrom, pos and end columns, for region queries:
+  'tabix result_XXX.tsv.gz chr1:100000-200000'.
+- 'parquet' and 'arrow' (Arrow IPC file, also read as Feather): typed
+  columns following 'utils.header' (pos and end as int64, score as float64,
+  the others as strings), in score order, written by batches. They need the
+  pyarrow package.
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+from collections import OrderedDict
+
+import tabix_utils
+import utils
+
+# Format -> extension of the result file.
+output_formats = OrderedDict([("txt", "txt"),
+                              ("tabix", "tsv.gz"),
+                              ("parquet", "parquet"),
+                              ("arrow", "arrow")])
+int_columns = ("pos", "end")
+float_columns = ("score",)
+# Number of rows per Parquet row group / Arrow record batch.
+batch_size = 100000
+
+
+def check_format(output_format):
+    """ Return an error message if the format can't be written, else None. """
+    if output_format not in output_formats:
+        return "Error: unknown output format {}.".format(output_format)
+    if output_format in ("parquet", "arrow"):
+        try:
+            import pyarrow
+        except ImportError:
+            return ("Error: the {} output format needs the pyarrow package "
+                    "(pip install pyarrow).".format(output_format))
+    return None
+
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([(name, pa.int64() if name in int_columns else
+                             pa.float64() if name in float_columns else
+                             pa.string())
+                      for name in utils.header])
+
+
+def arrow_batches(rows, schema):
+    """ Record batches of 'batch_size' rows (lists of str). """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield rows_to_batch(batch, schema)
+            batch = []
+    if batch:
+        yield rows_to_batch(batch, schema)
+
+
+def rows_to_batch(rows, schema):
+    import pyarrow as pa
+    columns = []
+    for i, name in enumerate(utils.header):
+        values = [row[i] for row in rows]
+        if name in int_columns:
+            values = [int(v) for v in values]
+        elif name in float_columns:
+            values = [float(v) for v in values]
+        columns.append(pa.array(values, type=schema.field(name).type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def coordinate_key(rank, row):
+    return (row[0], int(row[1]), int(row[2]), rank)
+
+
+def coordinate_sorted(rows, buffer_size=1000000, tmp_dir=None):
+    """ Sort result rows by coordinates, keeping their order on ties.
+
+    Beyond 'buffer_size' rows, sorted runs are spilled to disk and merged.
+    """
+    buffer = []
+    runs = []
+    run_dir = None
+    try:
+        for rank, row in enumerate(rows):
+            buffer.append((rank, row))
+            if len(buffer) >= buffer_size:
+                if run_dir is None:
+                    run_dir = tempfile.mkdtemp(prefix="finsurf_runs_",
+                                               dir=tmp_dir)
+                buffer.sort(key=lambda item: coordinate_key(*item))
+                run_path = os.path.join(run_dir,
+                                        "run_{}.txt".format(len(runs)))
+                with open(run_path, "w") as f:
+                    for rank, row in buffer:
+                        f.write(str(rank) + "\t" + "\t".join(row) + "\n")
+                runs.append(run_path)
+                buffer = []
+        buffer.sort(key=lambda item: coordinate_key(*item))
+        merged = heapq.merge(iter(buffer),
+                             *[read_run(run_path) for run_path in runs],
+                             key=lambda item: coordinate_key(*item))
+        for _, row in merged:
+            yield row
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def read_run(run_path):
+    with open(run_path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            yield int(fields[0]), fields[1:]
+
+
+def write_results(sink, result_file, output_format="txt", tmp_dir=None):
+    """ Write the rows of a ResultSink in one of the 'output_formats'. """
+    if output_format == "txt":
+        sink.write(result_file)
+        return
+    rows = (row for _, row in sink)
+    if output_format == "tabix":
+        lines = ("\t".join(row) for row in
+                 coordinate_sorted(rows, sink.buffer_size, tmp_dir))
+        tabix_utils.write_tabix(
+                itertools.chain(["#" + "\t".join(utils.header)], lines),
+                result_file, col_seq=1, col_beg=2, col_end=3)
+    elif output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = arrow_schema()
+        writer = pq.ParquetWriter(result_file, schema)
+        try:
+            for batch in arrow_batches(rows, schema):
+                writer.write_table(pa.Table.from_batches([batch]))
+        finally:
+            writer.close()
+    elif output_format == "arrow":
+        import pyarrow as pa
+        schema = arrow_schema()
+        with pa.OSFile(result_file, "wb") as f:
+            writer = pa.ipc.new_file(f, schema)
+            try:
+                for batch in arrow_batches(rows, schema):
+                    writer.write_batch(batch)
+            finally:
+                writer.close()
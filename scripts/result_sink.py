@@ -0,0 +1,158 @@
+"""Collect, deduplicate and sort the results of run_intersect.
+
+Results are kept in memory up to a configurable number of rows ; beyond that,
+the buffer is sorted and spilled to disk as a 'run', and all runs are k-way
+merged when the final file is written. Duplicates are detected by hashing the
+rows, so only a small digest is kept in memory for each distinct result.
+
+The output order is the one of the original implementation: descending score
+(compared as strings), and order of first appearance between equal scores.
+
+When only the 'top' best results are needed, they are kept in a bounded heap
+instead, and memory use no longer depends on the number of results.
+"""
+
+import hashlib
+import heapq
+import os
+import shutil
+import tempfile
+
+import utils
+
+
+def row_digest(row):
+    """ Compact digest identifying a result row (list of str). """
+    return hashlib.blake2b("\x00".join(row).encode("utf8"),
+                           digest_size=16).digest()
+
+
+def sort_key(item):
+    """ Key ordering (key, row) items by descending score then ascending key,
+    when used with 'reverse=True'.
+    """
+    key, row = item
+    return (row[3], -key)
+
+
+class ResultSink(object):
+    """ Deduplicating, external-sort writer for result rows.
+
+    Args:
+        buffer_size(int): number of rows kept in memory before a sorted run is
+                          spilled to disk.
+        tmp_dir(str): directory where the runs are written (system default if
+                      None).
+        top(int): if given, only the 'top' first rows of the output are kept.
+    """
+
+    def __init__(self, buffer_size=1000000, tmp_dir=None, top=None):
+        self.buffer_size = buffer_size
+        self.tmp_dir = tmp_dir
+        self.top = top
+        self._heap = [] # (score, -key, key, row, digest), worst row first.
+        self._heap_digests = set()
+        self.n_results = 0
+        self.n_duplicates = 0
+        self._seen = set()
+        self._buffer = []
+        self._runs = []
+        self._run_dir = None
+        self._next_key = 0
+
+    def add(self, row, key=None):
+        """ Add a result row, unless an identical row was already added.
+
+        Args:
+            row(list): result fields (str), following 'utils.header'.
+            key(int): order of appearance of the row ; rows with equal scores
+                      are written by increasing key. Defaults to the order of
+                      the calls.
+        Returns:
+            bool: whether the row was added (False for a duplicate).
+        """
+        digest = row_digest(row)
+        if self.top is not None:
+            return self._add_top(row, key, digest)
+        if digest in self._seen:
+            self.n_duplicates += 1
+            return False
+        self._seen.add(digest)
+        if key is None:
+            key = self._next_key
+            self._next_key += 1
+        self._buffer.append((key, row))
+        self.n_results += 1
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+        return True
+
+    def _add_top(self, row, key, digest):
+        # Only the digests of the kept rows are needed: a duplicate comes
+        # after its first occurrence with the same score, so it can't enter
+        # the heap if the first occurrence was left out of it.
+        if digest in self._heap_digests:
+            self.n_duplicates += 1
+            return False
+        if key is None:
+            key = self._next_key
+            self._next_key += 1
+        item = (row[3], -key, key, row, digest)
+        if len(self._heap) < self.top:
+            heapq.heappush(self._heap, item)
+        elif self.top > 0 and item[:2] > self._heap[0][:2]:
+            removed = heapq.heapreplace(self._heap, item)
+            self._heap_digests.discard(removed[4])
+            self.n_results -= 1
+        else:
+            return False
+        self._heap_digests.add(digest)
+        self.n_results += 1
+        return True
+
+    def _spill(self):
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix="finsurf_runs_",
+                                             dir=self.tmp_dir)
+        self._buffer.sort(key=sort_key, reverse=True)
+        run_path = os.path.join(self._run_dir,
+                                "run_{}.txt".format(len(self._runs)))
+        with open(run_path, "w") as f:
+            for key, row in self._buffer:
+                f.write(str(key) + "\t" + "\t".join(row) + "\n")
+        self._runs.append(run_path)
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(run_path):
+        with open(run_path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                yield int(fields[0]), fields[1:]
+
+    def __iter__(self):
+        """ Iterate over the (key, row) items, in output order. """
+        if self.top is not None:
+            return ((item[2], item[3])
+                    for item in sorted(self._heap, reverse=True))
+        self._buffer.sort(key=sort_key, reverse=True)
+        runs = [self._read_run(run_path) for run_path in self._runs]
+        return heapq.merge(iter(self._buffer), *runs, key=sort_key,
+                           reverse=True)
+
+    def write(self, result_file):
+        """ Write the header and all the rows, sorted, to 'result_file'. """
+        with open(result_file, "w") as f:
+            f.write("#" + "\t".join(utils.header) + "\n")
+            for _, row in self:
+                f.write("\t".join(row) + "\n")
+
+    def close(self):
+        """ Remove the runs spilled to disk. """
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self._runs = []
+        self._buffer = []
+        self._heap = []
+        self._heap_digests = set()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+"""Compile the FINSURF score file into a memory-mapped, position-indexed store.
+
+The tabix-indexed score file (scores_all_chroms_1e-4.tsv.gz) is converted into
+per-chromosome binary arrays, so that the scores of a whole chunk of positions
+are fetched by array indexing instead of decompressing and parsing text:
+
+    python scripts/score_store.py -s static/data/scores_all_chroms_1e-4.tsv.gz \
+                                  -o static/data/scores_store
+
+The store directory can then be given to finsurf.py in place of the score file
+('-s static/data/scores_store').
+
+Layout: positions are grouped in blocks of 1024 bases ; for each chromosome,
+'<chrom>.dir.npy' gives the slot of each block in the value arrays (-1 when no
+score is defined in the block), and '<chrom>.mant.npy' / '<chrom>.dec.npy'
+hold, for each position of each slot, up to 'depth' records (the records tabix
+would return for that position, in file order) and for each record the
+transition and transversion scores. Scores are stored exactly, as an integer
+mantissa and a number of decimals, so they are written out as in the score
+file. Missing values have a number of decimals of 255.
+
+'manifest.json' records the format version and the size, modification time and
+sha256 checksum of the source file, so that stale stores are detected.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import tabix_utils
+
+###############################################################################
+# DEFINITIONS
+
+STORE_VERSION = 1
+MANIFEST = "manifest.json"
+BLOCK_SHIFT = 10
+BLOCK_SIZE = 1 << BLOCK_SHIFT
+MISSING = 255
+# Score columns (0-based) used by run_intersect: transition, transversion.
+SCORE_COLUMNS = (5, -1)
+
+
+class StaleStoreError(ValueError):
+    """ The store does not match its source file or this version. """
+
+
+def file_checksum(path, blocksize=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def is_score_store(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def parse_decimals(values):
+    """ Split decimal strings into integer mantissas and numbers of decimals.
+
+    Raises:
+        ValueError: if a value cannot be written back exactly from its
+                    mantissa and number of decimals.
+    """
+    values = values.astype(str)
+    valid = values.str.fullmatch(r"-?(0|[1-9]\d*)(\.\d+)?")
+    if not valid.all():
+        raise ValueError("Score '{}' can't be stored exactly.".format(
+                            values[~valid].iloc[0]))
+    parts = values.str.partition(".")
+    dec = parts[2].str.len().to_numpy()
+    mant = (parts[0] + parts[2]).astype("int64").to_numpy()
+    negative_zero = (mant == 0) & values.str.startswith("-").to_numpy()
+    if negative_zero.any() or (np.abs(mant) >= 2 ** 31).any() \
+            or (dec >= MISSING).any():
+        raise ValueError("Scores out of the range of the store.")
+    return mant.astype("int32"), dec.astype("uint8")
+
+
+def format_decimal(mant, dec):
+    """ Write back a score stored as (mantissa, number of decimals). """
+    if dec == 0:
+        return str(mant)
+    digits = str(abs(mant)).rjust(dec + 1, "0")
+    sign = "-" if mant < 0 else ""
+    return sign + digits[:-dec] + "." + digits[-dec:]
+
+
+class ChromBuilder(object):
+    """ Accumulate the blocks of one chromosome while converting. """
+
+    def __init__(self):
+        self.blocks = {}
+
+    def add(self, bases, mant, dec):
+        """ Add records (already expanded to one row per base, in file order).
+
+        Args:
+            bases(array): 0-based positions.
+            mant(array): (n, 2) mantissas for transition and transversion.
+            dec(array): (n, 2) numbers of decimals.
+        """
+        # Rows grouped by block, in file order within each block.
+        by_block = np.argsort(bases >> BLOCK_SHIFT, kind="stable")
+        sorted_blocks = bases[by_block] >> BLOCK_SHIFT
+        block_ids = np.unique(sorted_blocks)
+        bounds = np.searchsorted(sorted_blocks, block_ids)
+        bounds = np.r_[bounds, len(by_block)]
+        for k, block_id in enumerate(block_ids.tolist()):
+            select = by_block[bounds[k]:bounds[k + 1]]
+            offsets = bases[select] & (BLOCK_SIZE - 1)
+            if block_id not in self.blocks:
+                self.blocks[block_id] = [
+                    np.zeros((BLOCK_SIZE, 1, 2), dtype="int32"),
+                    np.full((BLOCK_SIZE, 1, 2), MISSING, dtype="uint8"),
+                    np.zeros(BLOCK_SIZE, dtype="int64")]
+            block = self.blocks[block_id]
+
+            # Rank of each record among the records of its position, in file
+            # order, following the records already stored.
+            order = np.argsort(offsets, kind="stable")
+            sorted_offsets = offsets[order]
+            group_start = np.r_[0, np.nonzero(np.diff(sorted_offsets))[0] + 1]
+            group_sizes = np.diff(np.r_[group_start, len(order)])
+            ranks = np.empty(len(order), dtype="int64")
+            ranks[order] = (np.arange(len(order))
+                            - np.repeat(group_start, group_sizes)
+                            + block[2][sorted_offsets])
+            np.add.at(block[2], offsets, 1)
+
+            depth = int(ranks.max()) + 1
+            if depth > block[0].shape[1]:
+                block[0] = np.concatenate(
+                    [block[0], np.zeros((BLOCK_SIZE,
+                                         depth - block[0].shape[1], 2),
+                                        dtype="int32")], axis=1)
+                block[1] = np.concatenate(
+                    [block[1], np.full((BLOCK_SIZE,
+                                        depth - block[1].shape[1], 2),
+                                       MISSING, dtype="uint8")], axis=1)
+            block[0][offsets, ranks] = mant[select]
+            block[1][offsets, ranks] = dec[select]
+
+    def save(self, out_dir, chrom):
+        """ Write the arrays of the chromosome, returns its depth. """
+        block_ids = sorted(self.blocks)
+        depth = max(self.blocks[b][0].shape[1] for b in block_ids)
+        directory = np.full(block_ids[-1] + 1, -1, dtype="int32")
+        directory[block_ids] = np.arange(len(block_ids), dtype="int32")
+        mant = np.zeros((len(block_ids) * BLOCK_SIZE, depth, 2), dtype="int32")
+        dec = np.full((len(block_ids) * BLOCK_SIZE, depth, 2), MISSING,
+                      dtype="uint8")
+        for slot, block_id in enumerate(block_ids):
+            block = self.blocks[block_id]
+            rows = slice(slot * BLOCK_SIZE, (slot + 1) * BLOCK_SIZE)
+            mant[rows, :block[0].shape[1]] = block[0]
+            dec[rows, :block[1].shape[1]] = block[1]
+        np.save(os.path.join(out_dir, chrom + ".dir.npy"), directory)
+        np.save(os.path.join(out_dir, chrom + ".mant.npy"), mant)
+        np.save(os.path.join(out_dir, chrom + ".dec.npy"), dec)
+        return depth
+
+
+def build_store(score_file_path, out_dir, chunksize=1000000):
+    """ Convert a tabix-indexed score file into a store directory.
+
+    Positions are associated to the records that a tabix query on that
+    position would return (see 'finsurf.bedfile_intersect_index').
+    """
+    index = tabix_utils.read_tbi(score_file_path, header_only=True)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    # An interrupted conversion must not leave a valid-looking store.
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        os.remove(os.path.join(out_dir, MANIFEST))
+
+    reader = pd.read_csv(score_file_path, sep="\t", header=None, dtype=str,
+                         comment=index.meta, chunksize=chunksize,
+                         compression="gzip")
+    depths = {}
+    builder = None
+    chrom = None
+    for chunk in reader:
+        chroms = chunk.iloc[:, index.col_seq - 1].to_numpy()
+        beg = chunk.iloc[:, index.col_beg - 1].astype("int64").to_numpy()
+        # Same rules as 'tabix_utils.record_interval'.
+        if index.format & tabix_utils.TBX_UCSC:
+            end = beg + 1
+        else:
+            beg = beg - 1
+            end = beg + 1
+        beg = np.maximum(beg, 0)
+        end = np.maximum(end, 1)
+        if index.col_end:
+            end = chunk.iloc[:, index.col_end - 1].astype("int64").to_numpy()
+
+        mant = np.empty((len(chunk), 2), dtype="int32")
+        dec = np.empty((len(chunk), 2), dtype="uint8")
+        for k, column in enumerate(SCORE_COLUMNS):
+            mant[:, k], dec[:, k] = parse_decimals(chunk.iloc[:, column])
+
+        # One row per base covered by each record.
+        lengths = np.maximum(end - beg, 0)
+        record_idx = np.repeat(np.arange(len(chunk)), lengths)
+        bases = beg[record_idx] + (np.arange(len(record_idx))
+                                   - np.repeat(np.cumsum(lengths) - lengths,
+                                               lengths))
+        base_chroms = chroms[record_idx]
+
+        boundaries = np.r_[0, np.nonzero(base_chroms[1:]
+                                         != base_chroms[:-1])[0] + 1,
+                           len(bases)]
+        for first, last in zip(boundaries[:-1], boundaries[1:]):
+            if first == last:
+                continue
+            if base_chroms[first] != chrom:
+                if builder is not None:
+                    depths[chrom] = builder.save(out_dir, chrom)
+                chrom = base_chroms[first]
+                if chrom in depths:
+                    raise ValueError("Score file is not sorted: {} found "
+                                     "twice.".format(chrom))
+                builder = ChromBuilder()
+            rows = record_idx[first:last]
+            builder.add(bases[first:last], mant[rows], dec[rows])
+    if builder is not None:
+        depths[chrom] = builder.save(out_dir, chrom)
+
+    stat = os.stat(score_file_path)
+    manifest = {"version": STORE_VERSION,
+                "block_shift": BLOCK_SHIFT,
+                "source": os.path.abspath(score_file_path),
+                "source_size": stat.st_size,
+                "source_mtime": stat.st_mtime,
+                "source_sha256": file_checksum(score_file_path),
+                "score_columns": list(SCORE_COLUMNS),
+                "depths": depths}
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+class ScoreStore(object):
+    """ Memory-mapped reader of a store built by 'build_store'.
+
+    Args:
+        path(str): store directory.
+        verify(bool): recompute the checksum of the source file (slow)
+                      instead of comparing its size and modification time.
+    Raises:
+        StaleStoreError: if the store was built by another version, or if its
+                         source file changed since (or, with 'verify', no
+                         longer exists ; otherwise a missing source is only
+                         reported on stderr).
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != STORE_VERSION:
+            raise StaleStoreError(
+                "Score store {} has version {}, expected {}: please rebuild it."
+                .format(path, self.manifest.get("version"), STORE_VERSION))
+        source = self.manifest["source"]
+        if not os.path.exists(source):
+            if verify:
+                raise StaleStoreError(
+                    "Source {} of score store {} not found: it can't be "
+                    "checked.".format(source, path))
+            print("Warning: source {} of score store {} not found, the store "
+                  "can't be checked for staleness.".format(source, path),
+                  file=sys.stderr)
+        else:
+            stat = os.stat(source)
+            if verify:
+                stale = file_checksum(source) != self.manifest["source_sha256"]
+            else:
+                stale = (stat.st_size != self.manifest["source_size"]
+                         or stat.st_mtime != self.manifest["source_mtime"])
+            if stale:
+                raise StaleStoreError(
+                    "Score store {} is older than its source {}: please "
+                    "rebuild it.".format(path, source))
+        self.chroms = frozenset(self.manifest["depths"])
+        self._arrays = {}
+
+    def _chrom_arrays(self, chrom):
+        if chrom not in self._arrays:
+            prefix = os.path.join(self.path, chrom)
+            self._arrays[chrom] = (
+                np.load(prefix + ".dir.npy"),
+                np.load(prefix + ".mant.npy", mmap_mode="r"),
+                np.load(prefix + ".dec.npy", mmap_mode="r"))
+        return self._arrays[chrom]
+
+    def lookup(self, chroms, positions, transition):
+        """ Scores of a set of positions, as tabix queries would return them.
+
+        Args:
+            chroms(array-like): chromosome of each position.
+            positions(array-like): 0-based positions.
+            transition(array-like): bool, True to get the transition score,
+                                    False for the transversion score.
+        Returns:
+            list with, for each position, the list of scores (str) of the
+            records found, in file order (empty if none).
+        """
+        chroms = np.asarray(chroms, dtype=object)
+        positions = np.asarray(positions, dtype="int64")
+        columns = np.where(np.asarray(transition, dtype=bool), 0, 1)
+        scores = [[] for _ in range(len(positions))]
+        for chrom in pd.unique(chroms):
+            if chrom not in self.chroms:
+                continue
+            directory, mant, dec = self._chrom_arrays(chrom)
+            select = np.nonzero(chroms == chrom)[0]
+            pos = positions[select]
+            blocks = pos >> BLOCK_SHIFT
+            inside = (blocks >= 0) & (blocks < len(directory))
+            slots = np.full(len(pos), -1, dtype="int64")
+            slots[inside] = directory[blocks[inside]]
+            found = slots >= 0
+            select, pos, slots = select[found], pos[found], slots[found]
+            rows = slots * BLOCK_SIZE + (pos & (BLOCK_SIZE - 1))
+            cols = columns[select]
+            row_mant = mant[rows, :, cols]
+            row_dec = dec[rows, :, cols]
+            for k, m, d in zip(select, row_mant.tolist(), row_dec.tolist()):
+                scores[k] = [format_decimal(mk, dk)
+                             for mk, dk in zip(m, d) if dk != MISSING]
+        return scores
+
+
+_stores = {}
+
+def open_store(path):
+    """ Open a store once per process. """
+    key = os.path.abspath(path)
+    if key not in _stores:
+        _stores[key] = ScoreStore(path)
+    return _stores[key]
+
+
+# Argument parser
+# ===============
+
+def argparser():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+                               formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s",
+                        "--score",
+                        type=str,
+                        help="Path to the tabix-indexed score file.",
+                        required=False)
+    parser.add_argument("-o",
+                        "--output_dir",
+                        type=str,
+                        help="Store directory to create.",
+                        required=False)
+    parser.add_argument("--check",
+                        type=str,
+                        help="Check that an existing store is up to date with "
+                             "its source file (full checksum), e.g. after the "
+                             "source was copied or touched.",
+                        required=False)
+    return parser
+
+def main():
+    parser = argparser()
+    args = parser.parse_args()
+    if args.check:
+        try:
+            store = ScoreStore(args.check, verify=True)
+        except StaleStoreError as e:
+            print(str(e))
+            return 1
+        # Same content: record the current modification time of the source,
+        # so that the quick check done by finsurf.py accepts the store again.
+        stat = os.stat(store.manifest["source"])
+        store.manifest["source_size"] = stat.st_size
+        store.manifest["source_mtime"] = stat.st_mtime
+        with open(os.path.join(args.check, MANIFEST), "w") as f:
+            json.dump(store.manifest, f, indent=1)
+        print("Score store {} is up to date.".format(args.check))
+        return 0
+    if not (args.score and args.output_dir):
+        parser.error("--score and --output_dir are required to build a store.")
+    manifest = build_store(args.score, args.output_dir)
+    print("Score store written to {} ({} chromosomes).".format(
+            args.output_dir, len(manifest["depths"])))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
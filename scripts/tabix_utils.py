@@ -0,0 +1,407 @@
+"""Pure python helpers to read bgzipped, tabix indexed files sequentially.
+
+These helpers do not replace the 'tabix' library for random queries ; they
+give access to the content of the '.tbi' index (sequence names, column
+configuration, linear index) so that a coordinate-sorted file can be scanned
+forward from the right block, as tabix would do it.
+
+The 'registry' keeps the tabix handles and parsed indexes of each file open
+for the lifetime of the process.
+"""
+
+import gzip
+import os
+import struct
+import threading
+import zlib
+
+from collections import namedtuple
+
+import tabix
+
+# Flag set in the 'format' field of the index when coordinates are 0-based
+# (bed-like files indexed with 'tabix -0' or '-p bed').
+TBX_UCSC = 0x10000
+# Bin holding the unmapped counts in htslib indexes (not a real bin).
+PSEUDO_BIN = 37450
+# Size of the windows of the linear index (16kb).
+LINEAR_SHIFT = 14
+
+TbiIndex = namedtuple("TbiIndex",
+            ["format", "col_seq", "col_beg", "col_end", "meta", "skip",
+             "names", "ref_offsets", "linear"])
+
+
+def read_tbi(bed_file_path, header_only=False):
+    """ Parse the '.tbi' index associated to a bgzipped file.
+
+    Args:
+        bed_file_path(str): path to the bgzipped file ('.tbi' file should be
+                            in the same directory)
+        header_only(bool): only read the column configuration and sequence
+                           names (the bins and linear index are left empty).
+    Returns:
+        TbiIndex: column configuration of the index, list of sequence names,
+                  first virtual offset of each sequence, and linear index of
+                  each sequence.
+    """
+    with gzip.open(bed_file_path + ".tbi", "rb") as f:
+        data = f.read(36)
+        if data[:4] != b"TBI\x01":
+            raise ValueError("Not a tabix index: {}.tbi".format(bed_file_path))
+        (n_ref, fmt, col_seq, col_beg, col_end,
+         meta, skip, l_nm) = struct.unpack_from("<8i", data, 4)
+        data += f.read(l_nm if header_only else -1)
+
+    offset = 36
+    names = [n.decode("utf8")
+             for n in data[offset:offset + l_nm].split(b"\x00") if n]
+    offset += l_nm
+    if header_only:
+        return TbiIndex(fmt, col_seq, col_beg, col_end, chr(meta), skip,
+                        names, [], [])
+
+    ref_offsets = []
+    linear = []
+    for _ in range(n_ref):
+        n_bin, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        first_offset = None
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            chunks = struct.unpack_from("<{}Q".format(2 * n_chunk), data,
+                                        offset)
+            offset += 16 * n_chunk
+            if bin_id == PSEUDO_BIN:
+                continue
+            chunk_min = min(chunks[0::2])
+            if first_offset is None or chunk_min < first_offset:
+                first_offset = chunk_min
+        n_intv, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        linear.append(struct.unpack_from("<{}Q".format(n_intv), data, offset))
+        offset += 8 * n_intv
+        ref_offsets.append(first_offset or 0)
+
+    return TbiIndex(fmt, col_seq, col_beg, col_end, chr(meta), skip,
+                    names, ref_offsets, linear)
+
+
+def record_interval(fields, index):
+    """ Return the [beg, end) interval tabix associates to a record.
+
+    This follows the rules of the tabix library: coordinates are converted to
+    0-based unless the index was built for 0-based files, and the end column
+    (if any) is used as is.
+    """
+    beg = end = int(fields[index.col_beg - 1])
+    if index.format & TBX_UCSC:
+        end += 1
+    else:
+        beg -= 1
+    if beg < 0:
+        beg = 0
+    if end < 1:
+        end = 1
+    if index.col_end:
+        end = int(fields[index.col_end - 1])
+    return beg, end
+
+
+class BgzfReader(object):
+    """ Sequential reader of a BGZF file, starting from a virtual offset.
+
+    'block_offset' is the file offset of the block 'lines' last read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.block_offset = None
+        self._handle = open(path, "rb")
+
+    def close(self):
+        self._handle.close()
+
+    def _read_block(self, coffset):
+        self._handle.seek(coffset)
+        header = self._handle.read(12)
+        if len(header) < 12:
+            return None, None
+        if header[:4] != b"\x1f\x8b\x08\x04":
+            raise ValueError("Not a BGZF block at offset {} in {}".format(
+                                coffset, self.path))
+        xlen, = struct.unpack("<H", header[10:12])
+        extra = self._handle.read(xlen)
+        bsize = None
+        pos = 0
+        while pos < xlen:
+            si1, si2, slen = struct.unpack_from("<BBH", extra, pos)
+            if si1 == 66 and si2 == 67:
+                bsize, = struct.unpack_from("<H", extra, pos + 4)
+            pos += 4 + slen
+        if bsize is None:
+            raise ValueError("Missing BGZF block size at offset {} in {}"
+                             .format(coffset, self.path))
+        cdata = self._handle.read(bsize - xlen - 19)
+        self._handle.read(8)  # CRC32 and ISIZE
+        return zlib.decompress(cdata, -15), coffset + bsize + 1
+
+    def lines(self, voffset=0):
+        """ Yield the lines of the file (as str) starting from 'voffset'.
+        """
+        coffset = voffset >> 16
+        uoffset = voffset & 0xFFFF
+        remainder = b""
+        while True:
+            self.block_offset = coffset
+            block, coffset = self._read_block(coffset)
+            if block is None:
+                break
+            if uoffset:
+                block = block[uoffset:]
+                uoffset = 0
+            lines = (remainder + block).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                yield line.decode("utf8")
+        if remainder:
+            yield remainder.decode("utf8")
+
+
+def start_offset(index, chrom, beg=0):
+    """ Virtual offset from which the records of 'chrom' overlapping 'beg' or
+    located after it are found, according to the linear index.
+    """
+    tid = index.names.index(chrom)
+    voffset = index.ref_offsets[tid]
+    linear = index.linear[tid]
+    if linear:
+        window = min(max(beg, 0) >> LINEAR_SHIFT, len(linear) - 1)
+        voffset = max(voffset, linear[window])
+    return voffset
+
+
+def iter_records(reader, index, chrom, beg=0):
+    """ Yield (beg, end, fields) for the records of 'chrom' in file order.
+
+    The scan starts at the block indicated by the linear index for position
+    'beg', so records located entirely before 'beg' may be skipped (as tabix
+    would do), but all records overlapping 'beg' or located after it are
+    returned. The generator stops at the end of the sequence.
+
+    Args:
+        reader(BgzfReader): reader opened on the bgzipped file.
+        index(TbiIndex): index of the file, as returned by 'read_tbi'.
+        chrom(str): sequence name, must be present in 'index.names'.
+        beg(int): 0-based position from which records are needed.
+    """
+    col_seq = index.col_seq - 1
+    seen_chrom = False
+    for line in reader.lines(start_offset(index, chrom, beg)):
+        if not line or line[0] == index.meta:
+            continue
+        fields = line.rstrip("\r").split("\t")
+        if fields[col_seq] != chrom:
+            if seen_chrom:
+                break
+            continue
+        seen_chrom = True
+        rec_beg, rec_end = record_interval(fields, index)
+        yield rec_beg, rec_end, fields
+
+
+class IndexRegistry(object):
+    """ Open each indexed file once per process, keyed by path.
+
+    Gives access to the tabix handle, the parsed '.tbi' index, the set of
+    sequence names (read from the '.tbi', without running 'tabix -l') and a
+    sequential BGZF reader of each file. Handles are dropped when used from a
+    new process (e.g. after a fork), as file offsets can't be shared ; for the
+    same reason, tabix handles and readers are opened once per thread, while
+    the parsed indexes are shared by all the threads.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._handles = {}
+        # One lock per process: a lock held by another thread at the time of
+        # a fork stays held in the child.
+        self._locks = {}
+
+    def _get(self, kind, path, opener, per_thread=False):
+        pid = os.getpid()
+        lock = self._locks.get(pid) or self._locks.setdefault(
+                                            pid, threading.Lock())
+        with lock:
+            if self._pid != pid:
+                self._pid = pid
+                self._handles = {}
+            key = (kind, os.path.abspath(path))
+            if per_thread:
+                key += (threading.get_ident(),)
+            if key not in self._handles:
+                self._handles[key] = opener(path)
+            return self._handles[key]
+
+    def tabix(self, path):
+        """ 'tabix' library handle, for random queries. """
+        return self._get("tabix", path, tabix.open, per_thread=True)
+
+    def index(self, path):
+        """ Full parsed index (TbiIndex). """
+        return self._get("index", path, read_tbi)
+
+    def chroms(self, path):
+        """ Set of the sequence names of the file. """
+        return self._get("chroms", path,
+                         lambda p: frozenset(read_tbi(p, True).names))
+
+    def reader(self, path):
+        """ Sequential BGZF reader (BgzfReader). """
+        return self._get("reader", path, BgzfReader, per_thread=True)
+
+
+registry = IndexRegistry()
+
+
+class BgzfWriter(object):
+    """ Minimal BGZF writer, keeping track of virtual offsets.
+    """
+
+    # Maximum amount of uncompressed data per block, as in htslib.
+    BLOCK_SIZE = 0xff00
+    EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000"
+                              "000000000000")
+
+    def __init__(self, path, level=6):
+        self._handle = open(path, "wb")
+        self._level = level
+        self._buffer = b""
+        self._coffset = 0
+
+    def tell(self):
+        """ Virtual offset of the next byte written. """
+        return (self._coffset << 16) | len(self._buffer)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.BLOCK_SIZE:
+            self._write_block(self._buffer[:self.BLOCK_SIZE])
+            self._buffer = self._buffer[self.BLOCK_SIZE:]
+
+    def flush(self):
+        if self._buffer:
+            self._write_block(self._buffer)
+            self._buffer = b""
+
+    def close(self):
+        self.flush()
+        self._handle.write(self.EOF_BLOCK)
+        self._handle.close()
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        bsize = len(cdata) + 25
+        block = (b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+                 + struct.pack("<H", bsize) + cdata
+                 + struct.pack("<II", zlib.crc32(data) & 0xffffffff,
+                               len(data)))
+        self._handle.write(block)
+        self._coffset += len(block)
+
+
+def reg2bin(beg, end):
+    """ Bin of the tabix/BAM binning scheme holding the [beg, end) interval.
+    """
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def write_tabix(lines, path, col_seq=1, col_beg=2, col_end=3,
+                zero_based=False, meta="#"):
+    """ Write lines to a bgzipped file and build its '.tbi' index.
+
+    This is the equivalent of 'bgzip' followed by 'tabix -s -b -e [-0]', for
+    environments where htslib is not available. Lines must be sorted by
+    sequence then start position ; lines starting with 'meta' are written but
+    not indexed.
+
+    Args:
+        lines(iterable): lines (str, without the trailing newline).
+        path(str): path of the bgzipped file to write.
+        col_seq, col_beg, col_end(int): 1-based columns of the sequence name,
+                                        start and end (0 for no end column).
+        zero_based(bool): whether the coordinates are 0-based (bed-like).
+        meta(str): character starting the header lines.
+    """
+    fmt = TBX_UCSC if zero_based else 0
+    config = TbiIndex(fmt, col_seq, col_beg, col_end, meta, 0, [], [], [])
+    writer = BgzfWriter(path)
+    names = []
+    bins = []
+    linear = []
+    for line in lines:
+        voffset_beg = writer.tell()
+        writer.write(line.encode("utf8") + b"\n")
+        if not line or line[0] == meta:
+            continue
+        voffset_end = writer.tell()
+        fields = line.split("\t")
+        chrom = fields[col_seq - 1]
+        if not names or names[-1] != chrom:
+            if chrom in names:
+                raise ValueError("File is not sorted: {} found twice."
+                                 .format(chrom))
+            names.append(chrom)
+            bins.append({})
+            linear.append([])
+        beg, end = record_interval(fields, config)
+        chunks = bins[-1].setdefault(reg2bin(beg, max(end, beg + 1)), [])
+        if chunks and chunks[-1][1] == voffset_beg:
+            chunks[-1][1] = voffset_end
+        else:
+            chunks.append([voffset_beg, voffset_end])
+        lin = linear[-1]
+        last_window = (max(end, beg + 1) - 1) >> LINEAR_SHIFT
+        if len(lin) <= last_window:
+            lin.extend([None] * (last_window + 1 - len(lin)))
+        for window in range(beg >> LINEAR_SHIFT, last_window + 1):
+            if lin[window] is None:
+                lin[window] = voffset_beg
+    writer.close()
+
+    names_blob = b"".join(n.encode("utf8") + b"\x00" for n in names)
+    data = [b"TBI\x01",
+            struct.pack("<8i", len(names), fmt, col_seq, col_beg, col_end,
+                        ord(meta), 0, len(names_blob)),
+            names_blob]
+    for ref_bins, lin in zip(bins, linear):
+        data.append(struct.pack("<i", len(ref_bins)))
+        for bin_id in sorted(ref_bins):
+            chunks = ref_bins[bin_id]
+            data.append(struct.pack("<Ii", bin_id, len(chunks)))
+            for chunk in chunks:
+                data.append(struct.pack("<QQ", *chunk))
+        # Empty windows point to the previous record, as tabix does.
+        previous = 0
+        for window, voffset in enumerate(lin):
+            if voffset is None:
+                lin[window] = previous
+            previous = lin[window]
+        data.append(struct.pack("<i", len(lin)))
+        data.append(struct.pack("<{}Q".format(len(lin)), *lin))
+    index_writer = BgzfWriter(path + ".tbi")
+    index_writer.write(b"".join(data))
+    index_writer.close()
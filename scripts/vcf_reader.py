@@ -0,0 +1,390 @@
+"""Streaming reader of the VCF input files of finsurf.py.
+
+The input (plain text, gzip or BGZF-compressed) is read once, sequentially:
+the meta-information ('##') and header ('#CHROM') lines are skipped, and the
+variant lines are parsed, piece by piece, into DataFrames of the first five
+columns (chrom, pos, id, ref, alt) by the pandas C parser. Multi-allelic
+records are split into one row per ALT allele, and the variants are yielded
+by chunks of 'chunksize' rows.
+
+BGZF blocks (bgzip, the usual compression of VCF files) are independent, so
+they are decompressed by batches in a pool of threads.
+
+The variants can be restricted to genomic regions (see 'read_regions'): for a
+bgzipped input with a '.tbi' index, only the requested ranges are read ;
+otherwise the variants out of the regions are dropped from each parsed piece.
+Variants on contigs absent from the data files (alternate haplotypes, decoys,
+chrM, ...) can be dropped in the same step.
+"""
+
+import csv
+import gzip
+import io
+import os
+import re
+import struct
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import tabix
+import tabix_utils
+
+columns = ["chrom", "pos", "id", "ref", "alt"]
+# Size of the pieces of the file read at once.
+READ_SIZE = 1 << 22
+# Number of BGZF blocks (64kb each at most) decompressed at once.
+BGZF_BATCH = 64
+# Largest position of a tabix query (whole chromosomes).
+MAX_POSITION = 1 << 29
+# Number of lines of a tabix query parsed at once.
+QUERY_BLOCK = 100000
+# Chromosomes expected on the first line when the input has no '#' header.
+known_chroms = set(["chr" + str(i) for i in range(1, 23)] + ["chrX", "chrY"]
+                   + [str(i) for i in range(1, 23)] + ["X", "Y"])
+
+
+class VcfFormatError(ValueError):
+    """ The input can't be read as a VCF file. """
+
+
+def is_bgzf(header):
+    """ Whether the first bytes of a file are the header of a BGZF block. """
+    if len(header) < 16 or header[:4] != b"\x1f\x8b\x08\x04":
+        return False
+    return header[12:14] == b"BC"
+
+
+def read_bgzf_blocks(handle):
+    """ Yield the compressed data of the BGZF blocks of a file. """
+    while True:
+        header = handle.read(12)
+        if len(header) < 12:
+            return
+        if header[:4] != b"\x1f\x8b\x08\x04":
+            raise VcfFormatError("Invalid BGZF block in the input file.")
+        xlen, = struct.unpack("<H", header[10:12])
+        extra = handle.read(xlen)
+        bsize = None
+        pos = 0
+        while pos < xlen:
+            si1, si2, slen = struct.unpack_from("<BBH", extra, pos)
+            if si1 == 66 and si2 == 67:
+                bsize, = struct.unpack_from("<H", extra, pos + 4)
+            pos += 4 + slen
+        if bsize is None:
+            raise VcfFormatError("Missing BGZF block size in the input file.")
+        yield handle.read(bsize - xlen - 19)
+        handle.read(8)  # CRC32 and ISIZE
+
+
+def inflate(cdata):
+    return zlib.decompress(cdata, -15)
+
+
+def read_pieces(path, threads=1):
+    """ Yield the decompressed content of a file, piece by piece (bytes). """
+    with open(path, "rb") as handle:
+        header = handle.read(18)
+        handle.seek(0)
+        if is_bgzf(header) and threads > 1:
+            # zlib releases the GIL: blocks are inflated in parallel.
+            with ThreadPoolExecutor(threads) as executor:
+                batch = []
+                for cdata in read_bgzf_blocks(handle):
+                    batch.append(cdata)
+                    if len(batch) == BGZF_BATCH:
+                        yield b"".join(executor.map(inflate, batch))
+                        batch = []
+                if batch:
+                    yield b"".join(executor.map(inflate, batch))
+            return
+        if header[:2] == b"\x1f\x8b":
+            handle = gzip.GzipFile(fileobj=handle)
+        while True:
+            piece = handle.read(READ_SIZE)
+            if not piece:
+                return
+            yield piece
+
+
+def contig_key(chrom):
+    """ Chromosome name without its 'chr' prefix, to match '1' and 'chr1'. """
+    chrom = str(chrom)
+    return chrom[3:] if chrom.startswith("chr") else chrom
+
+
+def read_regions(regions):
+    """ Parse a list of regions.
+
+    Args:
+        regions(list): regions 'chrom:start-end' (1-based, inclusive) or
+                       'chrom', or files with one such region per line, or
+                       BED files (0-based starts).
+    Returns:
+        dict chromosome -> list of 0-based [beg, end) intervals.
+    Raises:
+        ValueError: if a region can't be read.
+    """
+    items = []
+    for region in regions:
+        if os.path.isfile(region):
+            with open(region) as f:
+                items.extend(line.strip() for line in f)
+        else:
+            items.append(region.strip())
+    parsed = {}
+    for item in items:
+        if not item or item.startswith("#") or item.startswith("track") \
+                or item.startswith("browser"):
+            continue
+        fields = item.split()
+        if len(fields) >= 3:
+            chrom, beg, end = fields[0], int(fields[1]), int(fields[2])
+        else:
+            match = re.match(r"^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$", item)
+            if match is None:
+                raise ValueError("Invalid region: {}".format(item))
+            chrom, beg, end = match.group(1), match.group(2), match.group(3)
+            beg = int(beg.replace(",", "")) - 1 if beg else 0
+            end = (int(end.replace(",", "")) if end else
+                   beg + 1 if match.group(2) else MAX_POSITION)
+        if end <= beg:
+            raise ValueError("Invalid region: {}".format(item))
+        parsed.setdefault(chrom, []).append((beg, end))
+    return parsed
+
+
+def merge_regions(regions):
+    """ Sorted, disjoint intervals of each chromosome (keyed by 'contig_key').
+
+    Returns:
+        dict -> (begs, ends) arrays.
+    """
+    merged = {}
+    for chrom, intervals in regions.items():
+        key = contig_key(chrom)
+        intervals = sorted(intervals + merged.get(key, []))
+        result = []
+        for beg, end in intervals:
+            if result and beg <= result[-1][1]:
+                result[-1][1] = max(result[-1][1], end)
+            else:
+                result.append([beg, end])
+        merged[key] = result
+    return {key: (np.array([r[0] for r in result], dtype="int64"),
+                  np.array([r[1] for r in result], dtype="int64"))
+            for key, result in merged.items()}
+
+
+def select_variants(chunk, regions=None, contigs=None):
+    """ Drop the variants out of the regions or on unknown contigs.
+
+    A variant is kept when its REF allele overlaps a region, as for a tabix
+    query. Rows with an invalid position are kept, so that the error is
+    reported.
+
+    Args:
+        chunk(DataFrame): parsed variants, see 'parse_chunk'.
+        regions(dict): as returned by 'merge_regions'.
+        contigs(set): 'contig_key' of the known chromosomes.
+    """
+    chroms = chunk["chrom"]
+    names = pd.unique(chroms)
+    if contigs is not None:
+        known = [name for name in names if contig_key(name) in contigs]
+        if len(known) < len(names):
+            chunk = chunk[chroms.isin(known)]
+            chroms = chunk["chrom"]
+            names = known
+    if regions is None or not len(chunk):
+        return chunk
+
+    begs = pd.to_numeric(chunk["pos"], errors="coerce").to_numpy(dtype=float) - 1
+    lengths = chunk["ref"].str.len().to_numpy(dtype=float)
+    ends = begs + np.where(np.isnan(lengths), 1, np.maximum(lengths, 1))
+    keep = np.zeros(len(chunk), dtype=bool)
+    for name in names:
+        rows = np.flatnonzero((chroms == name).to_numpy())
+        if contig_key(name) not in regions:
+            continue
+        region_begs, region_ends = regions[contig_key(name)]
+        # First region ending after the start of the variant.
+        idx = np.searchsorted(region_ends, begs[rows], side="right")
+        inside = idx < len(region_ends)
+        inside[inside] = region_begs[idx[inside]] < ends[rows][inside]
+        keep[rows] = inside | np.isnan(begs[rows])
+    return chunk[keep]
+
+
+def is_header_line(fields):
+    """ Whether the first variant line is rather a header without '#'. """
+    return (fields[0] not in known_chroms
+            and not (len(fields) > 1 and fields[1].strip().isdigit()))
+
+
+def parse_chunk(data):
+    """ Parse variant lines (bytes) into a DataFrame of the VCF columns.
+
+    Multi-allelic records are split into one row per ALT allele.
+    """
+    chunk = pd.read_csv(io.BytesIO(data),
+                        header=None,
+                        usecols=list(range(0,5)),
+                        names=columns,
+                        dtype={"chrom": object, "id": object, "ref": object,
+                               "alt": object},
+                        quoting=csv.QUOTE_NONE,
+                        sep="\t")
+    alt = chunk["alt"]
+    if any("," in a for a in alt.tolist() if type(a) is str):
+        chunk = chunk.assign(alt=alt.str.split(",")) \
+                     .explode("alt", ignore_index=True)
+    return chunk
+
+
+class VcfReader(object):
+    """ Iterate over the variants of a VCF file, by chunks.
+
+    The header is read when the reader is built, so that a file which can't
+    be a VCF is reported before any variant is scored.
+
+    Args:
+        path(str): VCF file (plain text, gzip or bgzip).
+        chunksize(int): number of variants per chunk.
+        threads(int): number of threads decompressing BGZF blocks.
+        regions(dict): optional, chromosome -> list of 0-based intervals (see
+                       'read_regions') the variants must overlap.
+        contigs(iterable): optional, chromosomes of the data files ; variants
+                           on other contigs are dropped ('1' matches 'chr1').
+    Raises:
+        VcfFormatError: if the file has no variant, or less than 5 columns.
+    """
+
+    def __init__(self, path, chunksize=5000, threads=1, regions=None,
+                 contigs=None):
+        self.path = path
+        self.chunksize = chunksize
+        self.regions = merge_regions(regions) if regions is not None else None
+        self.contigs = (set(contig_key(c) for c in contigs)
+                        if contigs is not None else None)
+        self._pieces = read_pieces(path, threads)
+        self._rest = self._skip_header()
+        with open(path, "rb") as f:
+            header = f.read(18)
+        self.indexed = (self.regions is not None
+                        and os.path.exists(path + ".tbi") and is_bgzf(header))
+        if self.indexed:
+            self._pieces.close()
+
+    def _skip_header(self):
+        data = b""
+        start = 0
+        first_line = True
+        pieces = iter(self._pieces)
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                piece = next(pieces, None)
+                if piece is None:
+                    # Last line, without a trailing newline.
+                    end = len(data)
+                    if start >= end:
+                        raise VcfFormatError("in reading your VCF input "
+                                             "file: no variant found.")
+                else:
+                    data = data[start:] + piece
+                    start = 0
+                    continue
+            line = data[start:end].rstrip(b"\r")
+            if line.startswith(b"#") or not line.strip():
+                start = end + 1
+                continue
+            fields = line.decode("utf8", "replace").split("\t")
+            if first_line and is_header_line(fields):
+                first_line = False
+                start = end + 1
+                continue
+            self.check_fields(fields)
+            return data[start:]
+
+    @staticmethod
+    def check_fields(fields):
+        if len(fields) < 5:
+            raise VcfFormatError(
+                "in reading your VCF input file: Only {} fields detected, "
+                "using TAB ; the expected number should be at least 5."
+                .format(len(fields)))
+
+    def _line_blocks(self):
+        """ Yield blocks of complete lines (bytes), of at least 'chunksize'
+        lines but the last one.
+        """
+        pieces = [self._rest]
+        count = self._rest.count(b"\n")
+        for piece in self._pieces:
+            pieces.append(piece)
+            count += piece.count(b"\n")
+            if count < self.chunksize:
+                continue
+            data = b"".join(pieces)
+            cut = data.rfind(b"\n") + 1
+            yield data[:cut]
+            pieces = [data[cut:]]
+            count = 0
+        data = b"".join(pieces)
+        if data.strip():
+            yield data
+
+    def _query_blocks(self):
+        """ Yield blocks of the lines overlapping the regions (bytes), read
+        with tabix queries, in the order of the file.
+        """
+        names = tabix_utils.read_tbi(self.path, header_only=True).names
+        handle = tabix.open(self.path)
+        lines = []
+        for name in names:
+            if contig_key(name) not in self.regions:
+                continue
+            previous_end = None
+            for beg, end in zip(*self.regions[contig_key(name)]):
+                query = "{}:{}-{}".format(name, beg + 1,
+                                          min(end, MAX_POSITION))
+                for fields in handle.querys(query):
+                    # Records overlapping the previous region were read with
+                    # it already.
+                    if previous_end is not None \
+                            and int(fields[1]) - 1 < previous_end:
+                        continue
+                    lines.append("\t".join(fields))
+                    if len(lines) >= QUERY_BLOCK:
+                        yield ("\n".join(lines) + "\n").encode("utf8")
+                        lines = []
+                previous_end = end
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf8")
+
+    def __iter__(self):
+        # Blocks are parsed at once (one pandas call per piece of the file
+        # rather than per chunk), then cut in chunks of 'chunksize' variants.
+        rest = None
+        blocks = self._query_blocks() if self.indexed else self._line_blocks()
+        for data in blocks:
+            block = select_variants(parse_chunk(data),
+                                    None if self.indexed else self.regions,
+                                    self.contigs)
+            if rest is not None:
+                block = pd.concat([rest, block], ignore_index=True)
+            stop = len(block) - len(block) % self.chunksize
+            for first in range(0, stop, self.chunksize):
+                yield block.iloc[first:first + self.chunksize] \
+                           .reset_index(drop=True)
+            rest = block.iloc[stop:] if stop < len(block) else None
+        if rest is not None:
+            yield rest.reset_index(drop=True)
+
+    def close(self):
+        self._pieces.close()
@@ -0,0 +1,77 @@
+"""Shared fixtures: the small regulatory file, score file and VCF of
+'tests/data', and the result file of the original finsurf.py on them (the
+baseline every code path is compared with, see 'tests/data/make_data.py').
+"""
+
+import gzip
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(TESTS_DIR, "data")
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "scripts"))
+
+import finsurf
+
+# Columns of the result file.
+SCORE, GENES = 3, 11
+
+
+def run_finsurf(data, out_dir, **options):
+    """ Run 'finsurf.run_intersect' on the test data, return the path of the
+    result file.
+    """
+    os.makedirs(str(out_dir), exist_ok=True)
+    options.setdefault("chunksize", 50)
+    result = finsurf.run_intersect(data["score"], data["regulatory"],
+                                   data["vcf"], output=str(out_dir),
+                                   **options)
+    assert not result.startswith("Error"), result
+    return result
+
+
+def queries_at_boundaries(path, n_records=200):
+    """ Regions starting and ending at, before and after some records of the
+    file, on its chromosomes and on a missing one, shuffled.
+    """
+    with gzip.open(path, "rt") as f:
+        records = [line.split("\t")[:3] for line in f]
+    records = records[::max(1, len(records) // n_records)]
+    rows = []
+    for chrom, beg, end in records:
+        beg, end = int(beg), int(end)
+        for start in (beg - 2, beg - 1, beg, end - 1, end, end + 1):
+            rows.append((chrom, len(rows), start, start + 1))
+        # Regions holding the whole record, and overlapping its neighbours.
+        rows.append((chrom, len(rows), beg - 1, end))
+        rows.append((chrom, len(rows), beg - 50, end + 50))
+    rows += [("chr3", len(rows), 100, 101), ("chrUn", len(rows) + 1, 5, 6)]
+    rows += rows[::7] # repeated regions
+    random.Random(0).shuffle(rows)
+    return pd.DataFrame(rows, columns=["chrom", "pos", "start", "end"])
+
+
+def read_lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+@pytest.fixture(scope="session")
+def data():
+    paths = {name: os.path.join(DATA_DIR, filename) for name, filename in [
+                ("regulatory", "regulatory.bed.gz"),
+                ("score", "score.tsv.gz"),
+                ("vcf", "variants.vcf"),
+                ("genes", "genes.txt")]}
+    paths["variants"] = len(read_lines(paths["vcf"])) - 1
+    return paths
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    """ Lines (header first) of the result file of the original finsurf.py. """
+    return read_lines(os.path.join(DATA_DIR, "expected_result.txt"))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Write the small data files of the tests (needs pysam for bgzip and tabix).
+
+    python tests/data/make_data.py
+
+'expected_result.txt' is the result file of the original finsurf.py (before
+any of the intersection engines, stores and caches were added) on these
+files:
+
+    python scripts/finsurf.py -i tests/data/variants.vcf \\
+                              -s tests/data/score.tsv.gz \\
+                              -g tests/data/regulatory.bed.gz -od out/
+
+It is kept as is: the tests check that every code path gives the same
+results.
+"""
+
+import os
+import random
+
+import pysam
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+CHROMS = [("chr1", 9000), ("chr2", 6000)]
+GENES = ["GENEA", "GENEB", "GENEC", "SOX9"]
+BASES = "ACGT"
+
+
+def bgzip_index(path, lines):
+    with open(path, "w") as f:
+        f.writelines(line + "\n" for line in lines)
+    pysam.tabix_compress(path, path + ".gz", force=True)
+    pysam.tabix_index(path + ".gz", seq_col=0, start_col=1, end_col=2,
+                      force=True)
+    os.remove(path)
+
+
+def main(seed=0):
+    rng = random.Random(seed)
+    elements = []
+    for chrom, length in CHROMS:
+        pos = 100
+        while pos < length - 300:
+            pos += rng.randint(50, 400)
+            size = rng.randint(20, 150)
+            elements.append((chrom, pos, pos + size,
+                             "EL{}".format(len(elements)),
+                             ",".join(rng.sample(GENES, rng.randint(1, 2)))))
+            # Overlapping elements, so that a base may hit several of them.
+            if rng.random() < 0.3:
+                elements.append((chrom, pos + 5, pos + size // 2,
+                                 "EL{}".format(len(elements)), "SOX9"))
+            pos += size
+    elements.sort(key=lambda el: (el[0], el[1]))
+    bgzip_index(os.path.join(DATA_DIR, "regulatory.bed"),
+                ["\t".join(map(str, el)) for el in elements])
+
+    # Scores with two decimals, so that many results have equal scores.
+    covered = sorted(set((chrom, pos) for chrom, beg, end, _, _ in elements
+                         for pos in range(beg, end + 1)))
+    bgzip_index(os.path.join(DATA_DIR, "score.tsv"),
+                ["{}\t{}\t{}\tA\tG\t{:.2f}\t{:.3f}\t{:.2f}".format(
+                    chrom, pos, pos + 1, rng.random(), rng.random(),
+                    rng.random())
+                 for chrom, pos in covered if rng.random() < 0.9])
+
+    # SNVs, deletions and insertions, mostly in the elements, unsorted, with
+    # chromosome names with and without 'chr', a contig absent from the
+    # regulatory file and some repeated variants.
+    rows = []
+    for i in range(120):
+        chrom = rng.choice([name for name, _ in CHROMS] + ["chr3"])
+        if chrom != "chr3" and rng.random() < 0.8:
+            el = rng.choice([el for el in elements if el[0] == chrom])
+            pos = rng.randint(el[1] - 5, el[2] + 5)
+        else:
+            pos = rng.randint(1, dict(CHROMS).get(chrom, 1000))
+        ref = rng.choice(BASES)
+        alt = rng.choice(BASES.replace(ref, ""))
+        kind = rng.random()
+        if kind < 0.15:
+            ref = "".join(rng.choice(BASES) for _ in range(rng.randint(2, 30)))
+        elif kind < 0.25:
+            alt = ref + "".join(rng.choice(BASES)
+                                for _ in range(rng.randint(1, 5)))
+        elif kind < 0.28:
+            alt = "N"
+        if rng.random() < 0.3:
+            chrom = chrom.replace("chr", "")
+        rows.append((chrom, pos, rng.choice([".", "rs{}".format(i)]), ref,
+                     alt))
+        if rng.random() < 0.05:
+            rows.append(rows[-1])
+    with open(os.path.join(DATA_DIR, "variants.vcf"), "w") as f:
+        f.write("#chrom\tpos\tid\tref\talt\n")
+        for row in rows:
+            f.write("\t".join(map(str, row)) + "\n")
+
+    with open(os.path.join(DATA_DIR, "genes.txt"), "w") as f:
+        f.write("GENEB\nSOX9\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Checkpoints of run_intersect: saved chunks, staleness, resumed runs."""
+
+import json
+import os
+
+import pytest
+
+import checkpoint
+import finsurf
+
+from conftest import run_finsurf, read_lines
+
+
+def interrupt(run_dir, completed):
+    """ Make 'run_dir' look like a run stopped after 'completed' chunks. """
+    path = os.path.join(run_dir, checkpoint.MANIFEST)
+    with open(path) as f:
+        manifest = json.load(f)
+    n_chunks = len(manifest["chunks"])
+    manifest["chunks"] = manifest["chunks"][:completed]
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+    for chunk in range(completed, n_chunks):
+        os.remove(os.path.join(run_dir, "chunk_{:06d}.tsv".format(chunk)))
+    return n_chunks
+
+
+def test_save_load(data, tmp_path):
+    run_dir = str(tmp_path / "run")
+    files = {"input": data["vcf"], "score": data["score"]}
+    saved = checkpoint.Checkpoint(run_dir, files, [50, None])
+    items = [(None, ["chr1", "10", "11", "0.50"]), (7 << 32, ["chr2", "5"])]
+    saved.save(0, 50, items[:1])
+    saved.save(1, 20, items[1:])
+
+    resumed = checkpoint.Checkpoint(run_dir, files, [50, None], resume=True)
+    assert resumed.n_completed == 2
+    assert resumed.load(0) + resumed.load(1) == items
+    assert resumed.manifest["chunks"][1]["offset"] == 70
+    assert resumed.check(1, 20) is None
+    assert resumed.check(1, 21).startswith("Error")
+
+    with pytest.raises(checkpoint.StaleCheckpointError):
+        checkpoint.Checkpoint(run_dir, files, [50, 0.5], resume=True)
+    with pytest.raises(checkpoint.StaleCheckpointError):
+        checkpoint.Checkpoint(run_dir, dict(files, score=data["regulatory"]),
+                              [50, None], resume=True)
+    with pytest.raises(checkpoint.StaleCheckpointError):
+        checkpoint.Checkpoint(str(tmp_path / "none"), files, [50, None],
+                              resume=True)
+
+    # A new run starts again from no chunk.
+    assert checkpoint.Checkpoint(run_dir, files, [50, None]).n_completed == 0
+    assert not [name for name in os.listdir(run_dir)
+                if name.startswith("chunk_")]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_resume_matches_baseline(data, baseline, tmp_path, monkeypatch, jobs):
+    run_dir = str(tmp_path / "run")
+    result = run_finsurf(data, tmp_path / "first", jobs=jobs, chunksize=20,
+                         run_dir=run_dir)
+    assert read_lines(result) == baseline
+    n_chunks = interrupt(run_dir, 2)
+    assert n_chunks > 3
+
+    scored = []
+    score_records = finsurf.score_records
+    def count_records(records, *args, **kwargs):
+        scored.append(len(records))
+        return score_records(records, *args, **kwargs)
+    monkeypatch.setattr(finsurf, "score_records", count_records)
+    result = run_finsurf(data, tmp_path / "resumed", jobs=jobs, chunksize=20,
+                         run_dir=run_dir, resume=True)
+    assert read_lines(result) == baseline
+    if jobs == 1:
+        # Only the chunks left are scored again (workers aren't counted).
+        assert len(scored) == n_chunks - 2
+    with open(os.path.join(run_dir, checkpoint.MANIFEST)) as f:
+        assert len(json.load(f)["chunks"]) == n_chunks
+
+
+def test_resume_refused(data, tmp_path):
+    run_dir = str(tmp_path / "run")
+    run_finsurf(data, tmp_path / "first", run_dir=run_dir)
+    error = finsurf.run_intersect(data["score"], data["regulatory"],
+                                  data["vcf"], 50, str(tmp_path / "first"),
+                                  min_score=0.5, run_dir=run_dir, resume=True)
+    assert error.startswith("Error: cannot resume")
+    error = finsurf.run_intersect(data["score"], data["regulatory"],
+                                  data["vcf"], 50, str(tmp_path / "first"),
+                                  resume=True)
+    assert error.startswith("Error")
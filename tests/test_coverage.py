@@ -0,0 +1,50 @@
+"""-cv/--coverage: bases outside the regulatory regions are skipped."""
+
+import os
+import shutil
+
+import pytest
+
+import coverage_bitmap
+import finsurf
+
+from conftest import queries_at_boundaries, run_finsurf, read_lines
+
+
+def test_covered_matches_tabix(data, tmp_path):
+    coverage_dir = str(tmp_path / "coverage")
+    coverage_bitmap.build_coverage(data["regulatory"], coverage_dir)
+    coverage_map = coverage_bitmap.CoverageMap(coverage_dir,
+                                               data["regulatory"])
+    df_regions = queries_at_boundaries(data["regulatory"])
+    df_regions = df_regions[df_regions.end - df_regions.start == 1]
+    hits = finsurf.bedfile_intersect_index(df_regions, data["regulatory"])
+    expected = [hits["@".join(map(str, row))][0] is not None
+                for row in df_regions.itertuples(index=False)]
+    covered = coverage_map.covered(df_regions.chrom, df_regions.start)
+    assert covered.tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_coverage_matches_baseline(data, baseline, tmp_path, jobs):
+    coverage_dir = str(tmp_path / "coverage")
+    coverage_bitmap.build_coverage(data["regulatory"], coverage_dir)
+    result = run_finsurf(data, tmp_path / "out", jobs=jobs,
+                         coverage_path=coverage_dir)
+    assert read_lines(result) == baseline
+
+
+def test_stale_coverage(data, tmp_path):
+    regulatory = str(tmp_path / "regulatory.bed.gz")
+    shutil.copy(data["regulatory"], regulatory)
+    shutil.copy(data["regulatory"] + ".tbi", regulatory + ".tbi")
+    coverage_dir = str(tmp_path / "coverage")
+    coverage_bitmap.build_coverage(regulatory, coverage_dir)
+    # Built from another file, or from an older version of this one.
+    stat = os.stat(regulatory)
+    for other in (data["regulatory"], regulatory):
+        error = finsurf.run_intersect(data["score"], other, data["vcf"], 50,
+                                      str(tmp_path), coverage_path=coverage_dir)
+        assert error.startswith("Error: ") and "rebuild" in error
+        os.utime(regulatory, (stat.st_atime, stat.st_mtime + 10))
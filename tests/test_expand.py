@@ -0,0 +1,39 @@
+"""--max_bases: variants expanded lazily, by batches of bases."""
+
+import pandas as pd
+import pytest
+
+import finsurf
+
+from conftest import run_finsurf, read_lines
+
+
+@pytest.fixture
+def records(data):
+    chunk = next(iter(finsurf.build_reader(data["vcf"], chunksize=10000)))
+    return finsurf.create_records_vcf(chunk, finsurf.Record)
+
+
+@pytest.mark.parametrize("max_bases", [1, 3, 7, 10 ** 6])
+@pytest.mark.parametrize("with_skip", [False, True])
+def test_batches(records, max_bases, with_skip):
+    expanded = finsurf.expand_regions(records, 7, add_chr=True)
+    skip = None
+    if with_skip:
+        # Regions left out, e.g. found in the result cache.
+        skip = set(range(0, len(records), 3))
+        expanded = expanded[~expanded.row_id.isin([k + 7 for k in skip])]
+        expanded = expanded.reset_index(drop=True)
+    batches = list(finsurf.iter_expanded(records, 7, max_bases, add_chr=True,
+                                         skip=skip))
+    assert all(len(batch) <= max_bases for batch in batches)
+    assert len(batches) == -(-len(expanded) // max_bases)
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True),
+                                  expanded, check_dtype=False)
+
+
+@pytest.mark.parametrize("engine", ["tabix", "sweep", "interval"])
+def test_small_batches_match_baseline(data, baseline, tmp_path, engine):
+    # Deletions are split between batches of 3 bases.
+    result = run_finsurf(data, tmp_path, engine=engine, max_bases=3)
+    assert read_lines(result) == baseline
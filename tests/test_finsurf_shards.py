@@ -0,0 +1,103 @@
+"""finsurf_shards: split, score each shard, merge into the file of one run."""
+
+import inspect
+import os
+
+import pytest
+
+import finsurf
+import finsurf_shards
+
+from conftest import read_lines
+
+
+def shard_and_merge(data, shard_dir, n_shards, top=None):
+    manifest = finsurf_shards.split_vcf(data["vcf"], shard_dir, n_shards,
+                                        chunksize=40)
+    assert type(manifest) is dict
+    args = ["-s", data["score"], "-g", data["regulatory"], "-cs", "50"]
+    if top is not None:
+        args += ["--top", str(top)]
+    for shard in range(n_shards):
+        result = finsurf_shards.score_shard(shard_dir, shard, args)
+        assert not result.startswith("Error"), result
+    merged = finsurf_shards.merge_shards(shard_dir, top=top)
+    assert not merged.startswith("Error"), merged
+    return manifest, read_lines(merged)
+
+
+def test_run_arguments(data, baseline, tmp_path, monkeypatch):
+    # Every option reaches its parameter of run_intersect.
+    args = finsurf.argparser().parse_args(
+        ["-i", data["vcf"], "-s", data["score"], "-g", data["regulatory"],
+         "-od", str(tmp_path), "-cs", "50", "--top", "30"])
+    result = finsurf.run_arguments(args)
+    assert read_lines(result) == baseline[:31]
+
+    parameters = inspect.signature(finsurf.run_intersect).parameters
+    calls = []
+    monkeypatch.setattr(finsurf, "run_intersect",
+                        lambda **kwargs: calls.append(kwargs))
+    finsurf.run_arguments(args, result_file="result_0.txt")
+    call, = calls
+    assert sorted(call) == sorted(parameters)
+    assert call["result_file"] == "result_0.txt" and call["top"] == 30
+
+
+@pytest.mark.parametrize("n_shards", [1, 4])
+def test_merge_matches_baseline(data, baseline, tmp_path, n_shards):
+    manifest, merged = shard_and_merge(data, str(tmp_path / "shards"),
+                                       n_shards)
+    assert merged == baseline
+    assert sum(shard["variants"] for shard in manifest["shards"]) \
+        == data["variants"]
+    # Shards hold consecutive blocks of the input.
+    lines = []
+    for shard in manifest["shards"]:
+        lines += read_lines(os.path.join(str(tmp_path / "shards"),
+                                         shard["file"]))[1:]
+    assert lines == read_lines(data["vcf"])[1:]
+
+
+def test_empty_shards(data, baseline, tmp_path):
+    # More shards than variants: the empty ones merge as nothing.
+    n_shards = data["variants"] + 5
+    manifest, merged = shard_and_merge(data, str(tmp_path / "shards"),
+                                       n_shards)
+    assert merged == baseline
+    assert any(shard["variants"] == 0 for shard in manifest["shards"])
+
+
+def test_top(data, baseline, tmp_path):
+    _, merged = shard_and_merge(data, str(tmp_path / "shards"), 3, top=30)
+    assert merged == baseline[:31]
+
+
+def test_shard_keys(tmp_path):
+    # Keys (shard << LINE_BITS) + line order the rows of different shards
+    # by shard first.
+    paths = []
+    for shard in range(3):
+        path = str(tmp_path / "result_{}.txt".format(shard))
+        with open(path, "w") as f:
+            f.write("#header\n")
+            for line in range(4):
+                f.write("chr1\t{}\t{}\t0.5\n".format(shard, line))
+        paths.append(path)
+    keys = [key for shard, path in enumerate(paths)
+            for key, _ in finsurf_shards.read_shard_results(path, shard)]
+    assert keys == sorted(keys)
+    assert [key >> finsurf_shards.LINE_BITS for key in keys] \
+        == [0] * 4 + [1] * 4 + [2] * 4
+    # Equal scores: merged in shard order, then line order.
+    merged = [row for _, row in finsurf_shards.MergedResults(paths)]
+    assert [(row[1], row[2]) for row in merged] \
+        == [(str(shard), str(line)) for shard in range(3)
+            for line in range(4)]
+
+
+def test_unscored_shards(data, tmp_path):
+    shard_dir = str(tmp_path / "shards")
+    finsurf_shards.split_vcf(data["vcf"], shard_dir, 2)
+    assert finsurf_shards.merge_shards(shard_dir).startswith("Error")
+    assert finsurf_shards.score_shard(shard_dir, 2, []).startswith("Error")
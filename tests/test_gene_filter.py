@@ -0,0 +1,36 @@
+"""-ig/--inputgene: only the results on the elements of the given genes."""
+
+import pytest
+
+from conftest import GENES, run_finsurf, read_lines
+
+
+def gene_rows(baseline, genes):
+    """ Rows of the baseline with one of 'genes' in their genes column. """
+    return baseline[:1] + [line for line in baseline[1:]
+                           if set(line.split("\t")[GENES].split(","))
+                           & set(genes)]
+
+
+@pytest.mark.parametrize("engine,jobs", [("tabix", 1), ("sweep", 1),
+                                         ("interval", 2)])
+def test_gene_filter_matches_baseline(data, baseline, tmp_path, engine, jobs):
+    result = run_finsurf(data, tmp_path, engine=engine, jobs=jobs,
+                         gene_file=data["genes"])
+    expected = gene_rows(baseline, read_lines(data["genes"]))
+    assert len(baseline) > len(expected) > 1
+    assert read_lines(result) == expected
+
+
+def test_whole_gene_names(data, baseline, tmp_path, capsys):
+    gene_file = tmp_path / "genes.txt"
+    gene_file.write_text("SOX\nGENEA\nNOTAGENE\n")
+    gene_table = tmp_path / "genes.tsv"
+    gene_table.write_text("GENEA\t1\nSOX9\t1\nSOX\t0\n")
+    result = run_finsurf(data, tmp_path / "out", gene_file=str(gene_file),
+                         gene_table=str(gene_table))
+    # 'SOX' does not select the elements of SOX9.
+    assert read_lines(result) == gene_rows(baseline, ["GENEA"])
+    err = capsys.readouterr().err
+    assert "no regulatory region for the genes: SOX" in err
+    assert "unrecognized genes: NOTAGENE" in err
@@ -0,0 +1,31 @@
+"""intersect_chunk: one batched score lookup per chunk, same results."""
+
+import gzip
+
+import pytest
+
+import tabix_utils
+
+from conftest import run_finsurf, read_lines
+
+
+@pytest.mark.parametrize("engine", ["tabix", "sweep"])
+def test_duplicate_regulatory_records(data, baseline, tmp_path, engine):
+    # Repeated records of the regulatory file give repeated hits, which are
+    # looked up once: the results are those of the file without repeats.
+    with gzip.open(data["regulatory"], "rt") as f:
+        lines = f.read().splitlines()
+    repeated = []
+    for k, line in enumerate(lines):
+        repeated += [line] * (1 + (k % 3 == 0))
+    regulatory = str(tmp_path / "regulatory.bed.gz")
+    tabix_utils.write_tabix(repeated, regulatory)
+    result = run_finsurf(dict(data, regulatory=regulatory), tmp_path / "out",
+                         engine=engine)
+    assert read_lines(result) == baseline
+
+
+@pytest.mark.parametrize("chunksize", [1, 7, 1000])
+def test_chunksize(data, baseline, tmp_path, chunksize):
+    result = run_finsurf(data, tmp_path, engine="sweep", chunksize=chunksize)
+    assert read_lines(result) == baseline
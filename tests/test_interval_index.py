@@ -0,0 +1,55 @@
+"""--engine interval: in-memory index of the regulatory file, and its cache."""
+
+import os
+import shutil
+
+import pytest
+
+import finsurf
+import interval_index
+
+from conftest import queries_at_boundaries, run_finsurf, read_lines
+
+
+def test_interval_hits(data):
+    df_regions = queries_at_boundaries(data["regulatory"])
+    hits = finsurf.bedfile_intersect_interval(df_regions, data["regulatory"])
+    assert hits == finsurf.bedfile_intersect_index(df_regions,
+                                                   data["regulatory"])
+
+
+def test_index_cache(data, tmp_path, monkeypatch):
+    regulatory = str(tmp_path / "regulatory.bed.gz")
+    shutil.copy(data["regulatory"], regulatory)
+    shutil.copy(data["regulatory"] + ".tbi", regulatory + ".tbi")
+    cache_dir = str(tmp_path / "cache")
+    built = interval_index.load(regulatory, cache_dir)
+    cached, = os.listdir(cache_dir)
+    assert cached.endswith(interval_index.CACHE_SUFFIX)
+
+    # Read back from the cache, without rebuilding.
+    def fail(path):
+        raise AssertionError("index rebuilt")
+    monkeypatch.setattr(interval_index.IntervalIndex, "from_file", fail)
+    loaded = interval_index.load(regulatory, cache_dir)
+    for chrom, (begs, ends, max_ends, fields) in built.chroms.items():
+        assert loaded.chroms[chrom][0].tolist() == begs.tolist()
+        assert loaded.chroms[chrom][1].tolist() == ends.tolist()
+        assert loaded.chroms[chrom][2].tolist() == max_ends.tolist()
+        assert loaded.chroms[chrom][3] == fields
+
+    # Rebuilt once the file changes.
+    stat = os.stat(regulatory)
+    os.utime(regulatory, (stat.st_atime, stat.st_mtime + 10))
+    with pytest.raises(AssertionError):
+        interval_index.load(regulatory, cache_dir)
+    monkeypatch.undo()
+    interval_index.load(regulatory, cache_dir)
+    assert os.listdir(cache_dir) == [cached]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_interval_matches_baseline(data, baseline, tmp_path, jobs):
+    result = run_finsurf(data, tmp_path, engine="interval", jobs=jobs,
+                         index_cache=str(tmp_path / "cache"))
+    assert read_lines(result) == baseline
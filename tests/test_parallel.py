@@ -0,0 +1,33 @@
+"""-j/--jobs: partitions of the chunks scored by worker processes."""
+
+import pytest
+
+import finsurf
+
+from conftest import run_finsurf, read_lines
+
+
+def test_partitions(data, monkeypatch):
+    monkeypatch.setattr(finsurf, "partition_bin_size", 1000)
+    chunk = next(iter(finsurf.build_reader(data["vcf"], chunksize=10000)))
+    records = finsurf.create_records_vcf(chunk, finsurf.Record)
+    partitions = finsurf.partition_records(records, 7)
+    assert len(partitions) > 10
+    lines = sorted(line for _, part_lines in partitions
+                   for line in part_lines)
+    assert lines == list(range(7, 7 + len(records)))
+    for part_records, part_lines in partitions:
+        assert len(set((record.chrom, record.start // 1000)
+                       for record in part_records)) == 1
+        assert part_lines == sorted(part_lines)
+
+
+@pytest.mark.parametrize("engine", ["tabix", "sweep"])
+def test_parallel_matches_baseline(data, baseline, tmp_path, monkeypatch,
+                                   engine):
+    # Small bins: the results of many partitions, scored out of order, are
+    # put back in the order of a serial run by their (line << 32) + rank keys.
+    monkeypatch.setattr(finsurf, "partition_bin_size", 1000)
+    result = run_finsurf(data, tmp_path, engine=engine, jobs=3,
+                         sort_buffer=10)
+    assert read_lines(result) == baseline
@@ -0,0 +1,262 @@
+"""plot_contribution.py: batch mode, output formats, feature stores."""
+
+import gzip
+import os
+import random
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_store
+import plot_contribution
+import tabix_utils
+
+TABLES = ["numFeat", "scaledNum", "featCont_transition",
+          "featCont_transversion"]
+N_FEATURES = 8
+
+
+@pytest.fixture
+def tables(tmp_path):
+    """ Feature tables (as the FINSURF ones: 0-based bed-like, values from
+    the 5th column) on a few bases of two chromosomes.
+    """
+    rng = random.Random(0)
+    positions = [("chr1", pos) for pos in range(1000, 1040)] \
+        + [("chr2", pos) for pos in range(500, 520)]
+    paths = {}
+    for name in TABLES:
+        paths[name] = str(tmp_path / (name + ".tsv.gz"))
+        tabix_utils.write_tabix(
+            ("{}\t{}\t{}\tN\t{}".format(chrom, pos, pos + 1, "\t".join(
+                "{:.4f}".format(rng.uniform(-1, 1))
+                for _ in range(N_FEATURES)))
+             for chrom, pos in positions),
+            paths[name], zero_based=True)
+    paths["rename"] = str(tmp_path / "rename_columns_model.tsv")
+    with open(paths["rename"], "w") as f:
+        f.write("old\tnew\ncol0\tVariant type\n")
+        for k in range(1, N_FEATURES):
+            f.write("col{0}\tfeature_{0}\n".format(k))
+    return paths
+
+
+def query(path, variant):
+    """ Values of a table at a variant "chrom:pos", as in 'do_plot'. """
+    pos = variant.split(":")[1]
+    values, = plot_contribution.query_values(path, variant + "-" + pos)
+    return values
+
+
+@pytest.mark.parametrize("engine", ["tabix", "sweep"])
+def test_batch_matches_single_queries(tables, tmp_path, monkeypatch, engine):
+    written = []
+    def write_figure(fig, out_dir='', prefix='plot', *args, **kwargs):
+        written.append(prefix)
+        return tuple(os.path.join(out_dir, prefix + "." + ext)
+                     for ext in ("svg", "jpeg", "png", "html"))
+    monkeypatch.setattr(plot_contribution, "write_figure", write_figure)
+
+    batch = [("chr1:1005", "transition"), ("chr2:510", "transversion"),
+             ("chr1:1010", "indel"), ("chr1:1005", "transversion"),
+             ("chr2:501", "transition"), ("chr1:5000", "transition")]
+    batch_file = tmp_path / "variants.txt"
+    batch_file.write_text("".join("{}\t{}\n".format(*v) for v in batch))
+    out_dir = str(tmp_path / "out")
+    os.makedirs(out_dir)
+    table_file, plots, errors = plot_contribution.do_plot_batch(
+        str(batch_file), tables["rename"], tables["numFeat"],
+        tables["scaledNum"], tables["featCont_transition"],
+        tables["featCont_transversion"], out_dir, engine)
+
+    assert [variant for variant, _ in errors] == ["chr1:5000"]
+    assert len(plots) == len(written) == len(batch) - 1
+    combined = pd.read_csv(table_file, sep="\t")
+    map_rename = plot_contribution.read_renaming(tables["rename"])
+    for variant, vartype in batch[:-1]:
+        chrom, pos = variant.split(":")
+        featCont = "featCont_" + ("transition" if vartype == "transition"
+                                  else "transversion")
+        expected = plot_contribution.feature_table(
+            query(tables["numFeat"], variant),
+            query(tables["scaledNum"], variant),
+            query(tables[featCont], variant), vartype, map_rename)
+        rows = combined[(combined.chrom == chrom)
+                        & (combined.pos == int(pos))
+                        & (combined.vartype == vartype)]
+        assert rows.feature.tolist() == expected.index.tolist()
+        for column in ("rawNum", "scaledNum", "featCont"):
+            assert rows[column].tolist() == expected[column].tolist()
+
+
+def test_batch_same_featcont_tables(tables, tmp_path, monkeypatch):
+    # One table for both variant types.
+    monkeypatch.setattr(plot_contribution, "write_figure",
+                        lambda *args, **kwargs: {})
+    batch_file = tmp_path / "variants.txt"
+    batch_file.write_text("chr1:1005\ttransition\nchr2:510\ttransversion\n"
+                          "chr1:1030\tindel\n")
+    table_file, plots, errors = plot_contribution.do_plot_batch(
+        str(batch_file), tables["rename"], tables["numFeat"],
+        tables["scaledNum"], tables["featCont_transition"],
+        tables["featCont_transition"], str(tmp_path / "out"))
+    assert not errors and len(plots) == 3
+    combined = pd.read_csv(table_file, sep="\t")
+    map_rename = plot_contribution.read_renaming(tables["rename"])
+    for variant, vartype in [("chr1:1005", "transition"),
+                             ("chr2:510", "transversion"),
+                             ("chr1:1030", "indel")]:
+        chrom, pos = variant.split(":")
+        expected = plot_contribution.feature_table(
+            query(tables["numFeat"], variant),
+            query(tables["scaledNum"], variant),
+            query(tables["featCont_transition"], variant), vartype,
+            map_rename)
+        rows = combined[(combined.chrom == chrom)
+                        & (combined.pos == int(pos))]
+        assert rows.featCont.tolist() == expected.featCont.tolist()
+
+
+def test_write_figure_formats(tables, tmp_path):
+    map_rename = plot_contribution.read_renaming(tables["rename"])
+    df = plot_contribution.feature_table(
+        query(tables["numFeat"], "chr1:1005"),
+        query(tables["scaledNum"], "chr1:1005"),
+        query(tables["featCont_transition"], "chr1:1005"), "transition",
+        map_rename)
+    fig = plot_contribution.make_figure(df, "chr1:1005")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    files = plot_contribution.write_figure(fig, str(out_dir), "plot",
+                                           ["html"])
+    assert list(files) == ["html"]
+    with open(files["html"]) as f:
+        assert "<html>" in f.read()
+    assert os.listdir(str(out_dir)) == [os.path.basename(files["html"])]
+
+    pytest.importorskip("kaleido")
+    files = plot_contribution.write_figure(fig, str(out_dir), "plot",
+                                           ["svg", "png"])
+    assert list(files) == ["svg", "png"]
+    with open(files["svg"], "rb") as f:
+        assert f.read(4) == b"<svg"
+    with open(files["png"], "rb") as f:
+        assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_do_plot_formats(tables, tmp_path, monkeypatch):
+    write_figure = plot_contribution.write_figure
+    monkeypatch.setattr(plot_contribution, "write_figure",
+                        lambda fig, out_dir='', prefix='plot', formats=("html",):
+                            write_figure(fig, str(tmp_path), prefix, formats))
+    files = plot_contribution.do_plot(
+        "chr2:510", "transversion", tables["rename"], tables["numFeat"],
+        tables["scaledNum"], tables["featCont_transition"],
+        tables["featCont_transversion"], ["html"])
+    assert files[:3] == (None, None, None)
+    assert os.path.exists(files[3])
+    error = plot_contribution.do_plot(
+        "chr2:5000", "transversion", tables["rename"], tables["numFeat"],
+        tables["scaledNum"], tables["featCont_transition"],
+        tables["featCont_transversion"], ["html"])
+    assert error[0].startswith("Error") and error[1:] == (None, None, None)
+
+
+def test_default_formats(tables):
+    # The four files, and the four lines printed, of the original script.
+    options = ["--rename_cols_table", tables["rename"],
+               "--numFeat_path", tables["numFeat"],
+               "--scaled_numFeat_path", tables["scaledNum"],
+               "--featCont_transition_path", tables["featCont_transition"],
+               "--featCont_transversion_path", tables["featCont_transversion"]]
+    parser = plot_contribution.argparser()
+    args = parser.parse_args(["--variant", "chr1:1005", "--vartype",
+                              "transition"] + options)
+    assert args.formats == ["svg", "jpeg", "png", "html"]
+    args = parser.parse_args(["--batch", "variants.txt", "--formats", "html"]
+                             + options)
+    assert args.formats == ["html"]
+
+
+def test_batch_jobs(tables, tmp_path):
+    batch_file = tmp_path / "variants.txt"
+    batch_file.write_text("chr1:1005 transition\nchr2:510\nchr1:1030\n"
+                          .replace(" ", "\t"))
+    table_file, plots, errors = plot_contribution.do_plot_batch(
+        str(batch_file), tables["rename"], tables["numFeat"],
+        tables["scaledNum"], tables["featCont_transition"],
+        tables["featCont_transversion"], str(tmp_path / "out"), "tabix",
+        ["html"], jobs=2)
+    assert not errors
+    assert [variant for variant, _ in plots] \
+        == ["chr1:1005", "chr2:510", "chr1:1030"]
+    assert all(list(files) == ["html"] and os.path.exists(files["html"])
+               for _, files in plots)
+
+
+def test_store_query_matches_tabix(tables, tmp_path):
+    store_dir = str(tmp_path / "store")
+    feature_store.build_store(tables["numFeat"], store_dir, chunk_rows=7)
+    store = feature_store.FeatureStore(store_dir)
+    with gzip.open(tables["numFeat"], "rt") as f:
+        records = [line.rstrip("\n").split("\t") for line in f]
+    positions = [("chr1", pos) for pos in range(995, 1045)] \
+        + [("chr2", 519), ("chr2", 521), ("chr3", 10)]
+    for chrom, pos in positions:
+        expected = [np.array(rec[4:], dtype="float32") for rec in records
+                    if rec[0] == chrom and int(rec[1]) < pos <= int(rec[2])]
+        found = store.query(chrom, pos)
+        assert len(found) == len(expected)
+        assert all((a == b).all() for a, b in zip(found, expected))
+    matrix, counts = store.matrix(positions)
+    assert counts.tolist() == [len(store.query(*p)) for p in positions]
+    assert np.isnan(matrix[counts != 1]).all()
+    store.close()
+
+    # A changed source table makes the store stale.
+    table = str(tmp_path / "table.tsv.gz")
+    shutil.copy(tables["numFeat"], table)
+    shutil.copy(tables["numFeat"] + ".tbi", table + ".tbi")
+    feature_store.build_store(table, str(tmp_path / "stale"))
+    stat = os.stat(table)
+    os.utime(table, (stat.st_atime, stat.st_mtime + 10))
+    with pytest.raises(feature_store.StaleStoreError):
+        feature_store.FeatureStore(str(tmp_path / "stale"))
+
+
+
+def test_store_missing_source(tables, tmp_path, capsys):
+    table = str(tmp_path / "table.tsv.gz")
+    shutil.copy(tables["numFeat"], table)
+    shutil.copy(tables["numFeat"] + ".tbi", table + ".tbi")
+    feature_store.build_store(table, str(tmp_path / "store"))
+    os.remove(table)
+    store = feature_store.FeatureStore(str(tmp_path / "store"))
+    assert "Warning: source {} of feature store".format(table) \
+        in capsys.readouterr().err
+    assert len(store.query("chr1", 1005)) == 1
+    store.close()
+
+def test_batch_with_stores(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(plot_contribution, "write_figure",
+                        lambda *args, **kwargs: {})
+    batch_file = tmp_path / "variants.txt"
+    batch_file.write_text("chr1:1005\ttransition\nchr2:510\nchr1:1030\t"
+                          "indel\nchr1:2000\n")
+    stores = dict(tables)
+    for name in TABLES:
+        stores[name] = str(tmp_path / (name + ".store"))
+        feature_store.build_store(tables[name], stores[name])
+    outputs = []
+    for paths in (tables, stores):
+        out_dir = str(tmp_path / "out_{}".format(len(outputs)))
+        table_file, plots, errors = plot_contribution.do_plot_batch(
+            str(batch_file), paths["rename"], paths["numFeat"],
+            paths["scaledNum"], paths["featCont_transition"],
+            paths["featCont_transversion"], out_dir)
+        assert [variant for variant, _ in errors] == ["chr1:2000"]
+        with open(table_file) as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,51 @@
+"""--profile and --metrics_json: figures of the stages, chunks and
+partitions of a run.
+"""
+
+import pytest
+
+import finsurf
+import profiling
+
+from conftest import run_finsurf, read_lines
+
+
+@pytest.fixture
+def profiler():
+    profiling.profiler.enable()
+    yield profiling.profiler
+    profiling.profiler.enabled = False
+    profiling.profiler.reset()
+
+
+def test_serial_chunks(data, baseline, tmp_path, profiler):
+    result = run_finsurf(data, tmp_path)
+    assert read_lines(result) == baseline
+    report = profiler.report()
+    chunks = report["chunks"]
+    assert [entry["chunk"] for entry in chunks] == list(range(len(chunks)))
+    assert len(chunks) > 1
+    assert all(entry["variants"] == 50 for entry in chunks[:-1])
+    assert report["partitions"] == [] and not report["worker_stages"]
+    assert "regulatory_query" in report["stages"]
+    summary = profiling.summary(report).splitlines()
+    assert summary[-1].split() == ["chunks", str(len(chunks))]
+
+
+def test_parallel_partitions(data, baseline, tmp_path, monkeypatch,
+                             profiler):
+    # The figures of the workers are those of partitions, not of chunks.
+    monkeypatch.setattr(finsurf, "partition_bin_size", 1000)
+    result = run_finsurf(data, tmp_path, jobs=2)
+    assert read_lines(result) == baseline
+    report = profiler.report()
+    assert report["chunks"] == []
+    partitions = report["partitions"]
+    assert len(partitions) > 3
+    assert [entry["partition"] for entry in partitions] \
+        == list(range(len(partitions)))
+    assert "chunk" not in partitions[0]
+    assert "regulatory_query" in report["worker_stages"]
+    summary = profiling.summary(report).splitlines()
+    assert summary[-1].split() == ["partitions", str(len(partitions))]
+    assert not any(line.startswith("chunks") for line in summary)
@@ -0,0 +1,64 @@
+"""--regions and --chrom: only the variants of some regions are scored."""
+
+import pytest
+
+import tabix_utils
+import vcf_reader
+
+from conftest import run_finsurf, read_lines
+
+REGIONS = ["chr1:3000-6000", "2:1-3000"]
+
+
+def in_regions(line, regions):
+    """ Whether the variant of a result line overlaps the regions, as for a
+    tabix query on its REF span.
+    """
+    fields = line.split("\t")
+    beg = int(fields[1]) - 1
+    end = beg + max(len(fields[5]), 1)
+    return any(b < end and beg < e for chrom, intervals in regions.items()
+               if vcf_reader.contig_key(chrom) ==
+               vcf_reader.contig_key(fields[0])
+               for b, e in intervals)
+
+
+def indexed_vcf(data, path):
+    """ The test variants, sorted, bgzipped and indexed with tabix. """
+    lines = read_lines(data["vcf"])
+    records = sorted(lines[1:], key=lambda line: (line.split("\t")[0],
+                                                  int(line.split("\t")[1])))
+    tabix_utils.write_tabix(lines[:1] + records, path, col_end=0)
+    return path
+
+
+def test_read_regions(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("chr3\t9\t20\n")
+    regions = vcf_reader.read_regions(["chr1:1,000-2,000", "X", str(bed)])
+    assert regions == {"chr1": [(999, 2000)], "chr3": [(9, 20)],
+                       "X": [(0, vcf_reader.MAX_POSITION)]}
+    with pytest.raises(ValueError):
+        vcf_reader.read_regions(["chr1:200-100"])
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_regions_match_baseline(data, baseline, tmp_path, indexed):
+    if indexed:
+        data = dict(data, vcf=indexed_vcf(data, str(tmp_path / "in.vcf.gz")))
+    result = run_finsurf(data, tmp_path / "out", regions=REGIONS)
+    regions = vcf_reader.read_regions(REGIONS)
+    expected = [line for line in baseline[1:] if in_regions(line, regions)]
+    assert 0 < len(expected) < len(baseline) - 1
+    lines = read_lines(result)
+    assert lines[0] == baseline[0]
+    # An indexed input is read in coordinate order.
+    assert (sorted(lines[1:]) if indexed else lines[1:]) == \
+        (sorted(expected) if indexed else expected)
+
+
+def test_chrom(data, baseline, tmp_path):
+    result = run_finsurf(data, tmp_path, chroms=["2"])
+    expected = [line for line in baseline if line.startswith("chr2\t")]
+    assert 0 < len(expected) < len(baseline) - 1
+    assert read_lines(result)[1:] == expected
@@ -0,0 +1,87 @@
+"""-rc/--result_cache: results of each variant reused across runs."""
+
+import sqlite3
+
+import pytest
+
+import finsurf
+import vcf_reader
+
+from conftest import SCORE, run_finsurf, read_lines
+
+
+def cache_stats(capsys):
+    """ (hits, misses) reported by the last run (counted since the cache was
+    opened in this process).
+    """
+    err = capsys.readouterr().err
+    line, = [line for line in err.splitlines()
+             if line.startswith("Result cache:")]
+    words = line.split()
+    return int(words[2]), int(words[4])
+
+
+def scored_variants(data):
+    """ Number of test variants on the chromosomes of the regulatory file
+    (the others are dropped while parsing).
+    """
+    contigs = set(vcf_reader.contig_key(chrom)
+                  for chrom in finsurf.tabix_list_chrom(data["regulatory"]))
+    return sum(vcf_reader.contig_key(line.split("\t")[0]) in contigs
+               for line in read_lines(data["vcf"])[1:])
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_cache_hits_give_same_rows(data, baseline, tmp_path, capsys, jobs):
+    variants = scored_variants(data)
+    cache_path = str(tmp_path / "cache.sqlite")
+    result = run_finsurf(data, tmp_path / "first", jobs=jobs,
+                         cache_path=cache_path)
+    assert read_lines(result) == baseline
+    # Only the repeated variants are found.
+    hits, misses = cache_stats(capsys)
+    assert hits + misses == variants and hits < 10
+    result = run_finsurf(data, tmp_path / "second", jobs=jobs,
+                         cache_path=cache_path)
+    assert read_lines(result) == baseline
+    assert cache_stats(capsys) == (hits + variants, misses)
+
+
+def test_cache_keys(data, baseline, tmp_path, capsys):
+    variants = scored_variants(data)
+    cache_path = str(tmp_path / "cache.sqlite")
+    run_finsurf(data, tmp_path / "first", cache_path=cache_path)
+    hits, misses = cache_stats(capsys)
+
+    # Another minimum score: nothing is reused.
+    result = run_finsurf(data, tmp_path / "min_score", cache_path=cache_path,
+                         min_score=0.5)
+    assert read_lines(result) == baseline[:1] + [
+        line for line in baseline[1:] if float(line.split("\t")[SCORE]) >= 0.5]
+    assert cache_stats(capsys)[1] > variants - 10
+
+    # Same variants under other ids: the ids are the ones of the input.
+    vcf = str(tmp_path / "renamed.vcf")
+    lines = read_lines(data["vcf"])
+    with open(vcf, "w") as f:
+        f.write(lines[0] + "\n")
+        for line in lines[1:]:
+            fields = line.split("\t")
+            fields[2] = "new_" + fields[2]
+            f.write("\t".join(fields) + "\n")
+    result = run_finsurf(dict(data, vcf=vcf), tmp_path / "renamed",
+                         cache_path=cache_path)
+    expected = baseline[:1]
+    for line in baseline[1:]:
+        fields = line.split("\t")
+        fields[4] = "new_" + fields[4]
+        expected.append("\t".join(fields))
+    assert read_lines(result) == expected
+    assert cache_stats(capsys) == (hits + variants, misses)
+
+    # The least recently used variants are evicted beyond --cache_size.
+    cache_path = str(tmp_path / "small_cache.sqlite")
+    run_finsurf(data, tmp_path / "small", cache_path=cache_path,
+                cache_size=10)
+    with sqlite3.connect(cache_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 10
@@ -0,0 +1,60 @@
+"""--output_format: tabix, Parquet and Arrow result files."""
+
+import gzip
+
+import pytest
+import tabix
+
+import finsurf
+
+from conftest import SCORE, run_finsurf
+
+
+def test_tabix_output_matches_baseline(data, baseline, tmp_path):
+    result = run_finsurf(data, tmp_path, output_format="tabix",
+                         sort_buffer=10)
+    assert result.endswith(".tsv.gz")
+    with gzip.open(result, "rt") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == baseline[0]
+    # Sorted by coordinates, in score order on equal coordinates.
+    rows = [line.split("\t") for line in lines[1:]]
+    expected = sorted((line.split("\t") for line in baseline[1:]),
+                      key=lambda row: (row[0], int(row[1]), int(row[2])))
+    assert rows == expected
+
+    handle = tabix.open(result)
+    window = [row for row in rows if row[0] == "chr1"
+              and int(row[1]) <= 6000 and int(row[2]) > 2000]
+    assert window
+    assert list(handle.query("chr1", 2000, 6000)) == window
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_arrow_outputs_match_baseline(data, baseline, tmp_path,
+                                      output_format):
+    pa = pytest.importorskip("pyarrow")
+    result = run_finsurf(data, tmp_path, output_format=output_format,
+                         jobs=2)
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(result)
+    else:
+        table = pa.ipc.open_file(result).read_all()
+    assert table.column_names == baseline[0][1:].split("\t")
+    assert table.schema.field("pos").type == pa.int64()
+    assert table.schema.field("score").type == pa.float64()
+    rows = [list(row.values()) for row in table.to_pylist()]
+    expected = [line.split("\t") for line in baseline[1:]]
+    assert [row[SCORE] for row in rows] \
+        == [float(row[SCORE]) for row in expected]
+    assert [[str(v) for k, v in enumerate(row) if k != SCORE]
+            for row in rows] \
+        == [[v for k, v in enumerate(row) if k != SCORE] for row in expected]
+
+
+def test_unknown_format(data, tmp_path):
+    error = finsurf.run_intersect(data["score"], data["regulatory"],
+                                  data["vcf"], 50, str(tmp_path),
+                                  output_format="csv")
+    assert error.startswith("Error")
@@ -0,0 +1,51 @@
+"""--top and --min_score: the first and the best-scored results."""
+
+import random
+
+import pytest
+
+import score_store
+
+from conftest import SCORE, run_finsurf, read_lines
+from result_sink import ResultSink
+
+
+def test_sink_top():
+    rng = random.Random(0)
+    rows = []
+    for i in range(500):
+        if rows and rng.random() < 0.2:
+            rows.append(list(rng.choice(rows)))
+        else:
+            rows.append(["chr1", str(i), str(i + 1),
+                         "{:.1f}".format(rng.random())])
+    full = ResultSink()
+    for row in rows:
+        full.add(row)
+    expected = [row for _, row in full]
+    for top in (0, 1, 25, 1000):
+        sink = ResultSink(top=top)
+        for row in rows:
+            sink.add(row)
+        assert [row for _, row in sink] == expected[:top]
+
+
+@pytest.mark.parametrize("top", [0, 1, 40, 10000])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_top_matches_baseline(data, baseline, tmp_path, top, jobs):
+    result = run_finsurf(data, tmp_path, top=top, jobs=jobs)
+    assert read_lines(result) == baseline[:top + 1]
+
+
+@pytest.mark.parametrize("min_score", [0.0, 0.5, 0.97, 2.0])
+def test_min_score_matches_baseline(data, baseline, tmp_path, min_score):
+    expected = baseline[:1] + [line for line in baseline[1:]
+                               if float(line.split("\t")[SCORE]) >= min_score]
+    result = run_finsurf(data, tmp_path / "tabix", min_score=min_score)
+    assert read_lines(result) == expected
+    # Same cut-off on the scores of a store.
+    store_dir = str(tmp_path / "store")
+    score_store.build_store(data["score"], store_dir)
+    result = run_finsurf(dict(data, score=store_dir), tmp_path / "store_out",
+                         min_score=min_score, top=20)
+    assert read_lines(result) == expected[:21]
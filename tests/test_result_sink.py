@@ -0,0 +1,81 @@
+"""ResultSink: deduplication, order of the results, external sort."""
+
+import os
+import random
+
+from conftest import run_finsurf, read_lines
+from result_sink import ResultSink
+
+
+def reference_order(rows):
+    """ Order of the original implementation: first occurrence of each row,
+    stable sort by descending score (compared as str).
+    """
+    unique = []
+    for row in rows:
+        if row not in unique:
+            unique.append(row)
+    return sorted(unique, key=lambda row: row[3], reverse=True)
+
+
+def random_rows(n, seed=0):
+    """ Result-like rows with many equal scores and some repeated rows. """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        if rows and rng.random() < 0.2:
+            rows.append(list(rng.choice(rows)))
+        else:
+            rows.append(["chr1", str(i), str(i + 1),
+                         "{:.1f}".format(rng.random()), "rs{}".format(i)])
+    return rows
+
+
+def sink_rows(sink):
+    return [row for _, row in sink]
+
+
+def test_order_and_duplicates():
+    rows = random_rows(500)
+    sink = ResultSink()
+    added = [sink.add(row) for row in rows]
+    expected = reference_order(rows)
+    assert sink_rows(sink) == expected
+    assert sink.n_results == len(expected) == sum(added)
+    assert sink.n_duplicates == len(rows) - len(expected)
+    sink.close()
+
+
+def test_spilled_runs_merge_as_in_memory(tmp_path):
+    rows = random_rows(500)
+    sink = ResultSink(buffer_size=7, tmp_dir=str(tmp_path))
+    for row in rows:
+        sink.add(row)
+    assert len(sink._runs) > 1
+    run_dir = sink._run_dir
+    assert sink_rows(sink) == reference_order(rows)
+    sink.close()
+    assert not os.path.exists(run_dir)
+
+
+def test_ties_ordered_by_key():
+    # Rows added out of order, as the partitions of a parallel run: rows with
+    # equal scores come out by increasing key, i.e. by first appearance.
+    rows = random_rows(200, seed=1)
+    items = list(enumerate(rows))
+    random.Random(2).shuffle(items)
+    sink = ResultSink(buffer_size=13)
+    for key, row in items:
+        sink.add(row, key)
+    keys = [key for key, _ in sink]
+    scores = [row[3] for _, row in sink]
+    for k in range(1, len(keys)):
+        assert scores[k - 1] > scores[k] or keys[k - 1] < keys[k]
+    sink.close()
+
+
+def test_spilled_run_matches_baseline(data, baseline, tmp_path):
+    result = run_finsurf(data, tmp_path, sort_buffer=10)
+    assert read_lines(result) == baseline
+    # The runs are removed once the result file is written.
+    assert sorted(os.listdir(str(tmp_path))) == [os.path.basename(result)]
@@ -0,0 +1,77 @@
+"""score_store: scores looked up in the store as with tabix queries."""
+
+import gzip
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import finsurf
+import score_store
+
+from conftest import run_finsurf, read_lines
+
+
+def test_lookup_matches_tabix(data, tmp_path):
+    store_dir = str(tmp_path / "store")
+    score_store.build_store(data["score"], store_dir, chunksize=500)
+    store = score_store.ScoreStore(store_dir)
+
+    with gzip.open(data["score"], "rt") as f:
+        positions = sorted(set((line.split("\t")[0], int(line.split("\t")[1]))
+                               for line in f))
+    rows = []
+    for chrom, pos in positions[::5]:
+        for start in (pos - 2, pos - 1, pos):
+            rows.append((chrom, len(rows), start, start + 1))
+    rows += [("chr3", len(rows), 10, 11), ("chr1", len(rows) + 1, 10 ** 7,
+                                           10 ** 7 + 1)]
+    df_regions = pd.DataFrame(rows, columns=["chrom", "pos", "start", "end"])
+    transition = [row[1] % 2 == 0 for row in rows]
+    hits = finsurf.bedfile_intersect_index(df_regions, data["score"])
+    expected = []
+    for row, is_transition in zip(rows, transition):
+        records = hits["@".join(map(str, row))][0] or []
+        expected.append([record[5] if is_transition else record[-1]
+                         for record in records])
+
+    scores = store.lookup(df_regions.chrom, df_regions.start, transition)
+    assert scores == expected
+    assert any(scores) and not all(scores)
+
+
+def test_store_matches_baseline(data, baseline, tmp_path):
+    store_dir = str(tmp_path / "store")
+    score_store.build_store(data["score"], store_dir)
+    result = run_finsurf(dict(data, score=store_dir), tmp_path / "out")
+    assert read_lines(result) == baseline
+
+
+def test_stale_store(data, tmp_path):
+    score = str(tmp_path / "score.tsv.gz")
+    shutil.copy(data["score"], score)
+    shutil.copy(data["score"] + ".tbi", score + ".tbi")
+    store_dir = str(tmp_path / "store")
+    score_store.build_store(score, store_dir)
+    stat = os.stat(score)
+    os.utime(score, (stat.st_atime, stat.st_mtime + 10))
+    error = finsurf.run_intersect(store_dir, data["regulatory"], data["vcf"],
+                                  50, str(tmp_path))
+    assert error.startswith("Error: ") and "rebuild" in error
+
+
+def test_missing_source(data, baseline, tmp_path, capsys):
+    # The store is used with a warning, but can't be verified.
+    score = str(tmp_path / "score.tsv.gz")
+    shutil.copy(data["score"], score)
+    shutil.copy(data["score"] + ".tbi", score + ".tbi")
+    store_dir = str(tmp_path / "store")
+    score_store.build_store(score, store_dir)
+    os.remove(score)
+    result = run_finsurf(dict(data, score=store_dir), tmp_path / "out")
+    assert read_lines(result) == baseline
+    assert "Warning: source {} of score store".format(score) \
+        in capsys.readouterr().err
+    with pytest.raises(score_store.StaleStoreError):
+        score_store.ScoreStore(store_dir, verify=True)
@@ -0,0 +1,93 @@
+"""finsurf_server: batches posted to /score give the result file content."""
+
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import finsurf
+import finsurf_server
+
+from conftest import read_lines
+
+
+@pytest.fixture(scope="module")
+def server(data, tmp_path_factory):
+    scorer = finsurf_server.Scorer(
+                data["score"], data["regulatory"], chunksize=50,
+                tmp_dir=str(tmp_path_factory.mktemp("server")), threads=2)
+    server = finsurf_server.make_server(scorer, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1]), scorer
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    scorer.close()
+
+
+@pytest.fixture
+def server_url(server):
+    return server[0]
+
+
+def post(url, body, content_type="text/plain"):
+    request = urllib.request.Request(url, data=body,
+                                     headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read().decode("utf8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf8")
+
+
+def test_score_vcf(data, baseline, server_url):
+    with open(data["vcf"], "rb") as f:
+        status, text = post(server_url + "/score", f.read())
+    assert status == 200
+    assert text.splitlines() == baseline
+
+
+def test_score_json(data, baseline, server_url):
+    variants = [line.split("\t") for line in read_lines(data["vcf"])[1:]]
+    status, text = post(server_url + "/score",
+                        json.dumps({"variants": variants}).encode("utf8"),
+                        "application/json")
+    assert status == 200
+    assert text.splitlines() == baseline
+    # A batch of one variant.
+    status, text = post(server_url + "/score",
+                        json.dumps(variants[:1]).encode("utf8"))
+    assert status == 200
+    assert text.splitlines()[0] == baseline[0]
+
+
+def test_errors(server_url):
+    assert post(server_url + "/score", b"")[0] == 400
+    assert post(server_url + "/score", b'{"variants": 3}')[0] == 400
+    status, text = post(server_url + "/score", b"chr1\tnot_a_position\n")
+    assert status == 400 and text.startswith("Error")
+    assert post(server_url + "/other", b"x")[0] == 404
+    with urllib.request.urlopen(server_url + "/health") as response:
+        assert response.read() == b"ok\n"
+
+
+@pytest.mark.parametrize("error,status", [(ValueError("invalid"), 400),
+                                          (RuntimeError("failure"), 500)])
+def test_scoring_errors(data, server, monkeypatch, error, status):
+    url, scorer = server
+    run_intersect_serial = finsurf.run_intersect_serial
+    def fail(*args, **kwargs):
+        run_intersect_serial(*args, **kwargs)
+        raise error
+    monkeypatch.setattr(finsurf, "run_intersect_serial", fail)
+    # Results spilled to sorted runs: these are removed as well.
+    monkeypatch.setattr(scorer, "sort_buffer", 10)
+    with open(data["vcf"], "rb") as f:
+        response_status, text = post(url + "/score", f.read())
+    assert response_status == status
+    assert text.startswith("Error") and str(error) in text
+    assert os.listdir(scorer.tmp_dir) == []
@@ -0,0 +1,49 @@
+"""--engine sweep: same hits as the tabix queries, same results."""
+
+import pytest
+
+import finsurf
+import tabix_utils
+
+from conftest import queries_at_boundaries, run_finsurf, read_lines
+
+
+@pytest.mark.parametrize("name", ["regulatory", "score"])
+def test_sweep_hits(data, name):
+    df_regions = queries_at_boundaries(data[name])
+    sweep = finsurf.bedfile_intersect_sweep(df_regions, data[name])
+    assert sweep == finsurf.bedfile_intersect_index(df_regions, data[name])
+    # Inclusive ends, overlapping records and missing contigs are all there.
+    assert any(len(hits[0]) > 1 for hits in sweep.values()
+               if hits[0] is not None)
+    assert any(key.startswith("chr3@") and hits == [None]
+               for key, hits in sweep.items())
+
+
+def test_sweep_skips_gaps(tmp_path, monkeypatch):
+    # Overlapping records every 100 bases over 2 Mb, and a few clusters of
+    # queries: the blocks between the clusters aren't read.
+    path = str(tmp_path / "sparse.bed.gz")
+    tabix_utils.write_tabix(["chr1\t{}\t{}\tEL{}\t{}".format(
+                                 beg, beg + 150, beg, "x" * 60)
+                             for beg in range(1000, 2001000, 100)],
+                            path, zero_based=True)
+    df_regions = queries_at_boundaries(path, n_records=5)
+    reads = []
+    read_block = tabix_utils.BgzfReader._read_block
+    def count_reads(self, coffset):
+        reads.append(coffset)
+        return read_block(self, coffset)
+    monkeypatch.setattr(tabix_utils.BgzfReader, "_read_block", count_reads)
+
+    n_blocks = len(list(tabix_utils.BgzfReader(path).lines())) and len(reads)
+    del reads[:]
+    sweep = finsurf.bedfile_intersect_sweep(df_regions, path)
+    assert sweep == finsurf.bedfile_intersect_index(df_regions, path)
+    assert n_blocks > 20 and len(reads) < n_blocks / 3
+
+
+@pytest.mark.parametrize("engine", ["tabix", "sweep"])
+def test_engine_matches_baseline(data, baseline, tmp_path, engine):
+    result = run_finsurf(data, tmp_path, engine=engine)
+    assert read_lines(result) == baseline
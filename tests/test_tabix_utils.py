@@ -0,0 +1,106 @@
+"""BgzfWriter and write_tabix: BGZF blocks, virtual offsets, '.tbi' index ;
+IndexRegistry shared by threads.
+"""
+
+import gzip
+import random
+import struct
+import threading
+import time
+
+import pytest
+import tabix
+
+import tabix_utils
+
+
+def bgzf_blocks(path):
+    """ (compressed offset, block size, uncompressed size) of each block. """
+    blocks = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b"\x1f\x8b\x08\x04"
+        bsize, = struct.unpack_from("<H", data, offset + 16)
+        isize, = struct.unpack_from("<I", data, offset + bsize - 3)
+        blocks.append((offset, bsize + 1, isize))
+        offset += bsize + 1
+    return blocks
+
+
+def test_bgzf_writer(tmp_path):
+    path = str(tmp_path / "data.gz")
+    rng = random.Random(0)
+    lines = ["line {}\t{}".format(i, "x" * rng.randint(0, 300))
+             for i in range(3000)]
+    writer = tabix_utils.BgzfWriter(path)
+    offsets = []
+    for line in lines:
+        offsets.append(writer.tell())
+        writer.write(line.encode("utf8") + b"\n")
+    writer.close()
+
+    with gzip.open(path, "rt") as f:
+        assert f.read().splitlines() == lines
+    blocks = bgzf_blocks(path)
+    assert len(blocks) > 2
+    assert all(isize <= tabix_utils.BgzfWriter.BLOCK_SIZE
+               for _, _, isize in blocks)
+    # Empty end-of-file block, as written by bgzip.
+    with open(path, "rb") as f:
+        assert f.read()[-28:] == tabix_utils.BgzfWriter.EOF_BLOCK
+    # Virtual offsets point to the start of each line.
+    reader = tabix_utils.BgzfReader(path)
+    for k in range(0, len(lines), 250):
+        assert next(reader.lines(offsets[k])) == lines[k]
+    reader.close()
+
+
+@pytest.mark.parametrize("zero_based", [False, True])
+def test_write_tabix_queries(tmp_path, zero_based):
+    rng = random.Random(0)
+    records = []
+    for chrom in ("chr1", "chr2"):
+        beg = 0
+        for _ in range(2000):
+            beg += rng.randint(0, 30)
+            records.append([chrom, str(beg + (not zero_based)),
+                            str(beg + rng.randint(1, 500)), "x"])
+    path = str(tmp_path / "records.bed.gz")
+    tabix_utils.write_tabix(("\t".join(rec) for rec in records), path,
+                            zero_based=zero_based)
+    index = tabix_utils.read_tbi(path)
+    assert index.names == ["chr1", "chr2"]
+    assert (index.col_seq, index.col_beg, index.col_end) == (1, 2, 3)
+
+    handle = tabix.open(path)
+    for _ in range(200):
+        chrom = rng.choice(index.names)
+        beg = rng.randint(0, 40000)
+        end = beg + rng.randint(1, 3000)
+        # Records overlapping the 0-based [beg, end) window.
+        expected = [rec for rec in records if rec[0] == chrom
+                    and int(rec[1]) - (not zero_based) < end
+                    and int(rec[2]) > beg]
+        assert list(handle.query(chrom, beg, end)) == expected
+
+
+def test_registry_threads(data):
+    # Threads asking for the index of a file at the same time open it once.
+    registry = tabix_utils.IndexRegistry()
+    opened = []
+    def read_tbi(path):
+        opened.append(path)
+        time.sleep(0.05)
+        return tabix_utils.read_tbi(path)
+    indexes = []
+    threads = [threading.Thread(target=lambda: indexes.append(
+                   registry._get("index", data["regulatory"], read_tbi)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(opened) == 1
+    assert len(indexes) == 8 and all(index is indexes[0] for index in indexes)
@@ -0,0 +1,91 @@
+"""vcf_reader: VCF with meta lines and extra columns, compressed inputs and
+multi-allelic records.
+"""
+
+import gzip
+
+import pytest
+
+import finsurf
+import tabix_utils
+import vcf_reader
+
+from conftest import run_finsurf, read_lines
+
+META = ["##fileformat=VCFv4.2", "##source=tests",
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+
+
+def full_vcf_lines(data):
+    """ The variants of the test VCF as a VCF 4.2 file (meta lines, header
+    and eight columns).
+    """
+    return META + [line + "\t.\tPASS\tDP=10"
+                   for line in read_lines(data["vcf"])[1:]]
+
+
+def write_lines(lines, path, compression=None):
+    if compression == "bgzip":
+        writer = tabix_utils.BgzfWriter(path)
+        for line in lines:
+            writer.write(line.encode("utf8") + b"\n")
+        writer.close()
+    else:
+        with (gzip.open(path, "wt") if compression == "gzip"
+              else open(path, "w")) as f:
+            f.writelines(line + "\n" for line in lines)
+    return path
+
+
+@pytest.mark.parametrize("compression,threads", [(None, 1), ("gzip", 1),
+                                                 ("bgzip", 1), ("bgzip", 3)])
+def test_vcf_matches_baseline(data, baseline, tmp_path, compression, threads):
+    vcf = write_lines(full_vcf_lines(data), str(tmp_path / "input.vcf.gz"),
+                      compression)
+    result = run_finsurf(dict(data, vcf=vcf), tmp_path / "out",
+                         read_threads=threads)
+    assert read_lines(result) == baseline
+
+
+def test_chunks(data, tmp_path):
+    vcf = write_lines(full_vcf_lines(data), str(tmp_path / "input.vcf.gz"),
+                      "bgzip")
+    reader = vcf_reader.VcfReader(vcf, chunksize=7, threads=2)
+    chunks = list(reader)
+    reader.close()
+    assert all(len(chunk) == 7 for chunk in chunks[:-1])
+    rows = [list(row) for chunk in chunks
+            for row in chunk.astype(str).itertuples(index=False)]
+    assert rows == [line.split("\t")
+                    for line in read_lines(data["vcf"])[1:]]
+
+
+def test_multi_allelic(data, tmp_path):
+    # Records with several ALT alleles give the results of one record per
+    # allele.
+    lines = read_lines(data["vcf"])[1:]
+    multi, split = [], []
+    for k, line in enumerate(lines):
+        fields = line.split("\t")
+        if k % 4 == 0 and len(fields[3]) == 1 and fields[4] in "ACGT":
+            other = [b for b in "ACGT" if b not in (fields[3], fields[4])][0]
+            multi.append("\t".join(fields[:4] + [fields[4] + "," + other]))
+            split += [line, "\t".join(fields[:4] + [other])]
+        else:
+            multi.append(line)
+            split.append(line)
+    assert len(split) > len(multi)
+    multi_vcf = write_lines(META[:2] + multi, str(tmp_path / "multi.vcf"))
+    split_vcf = write_lines(split, str(tmp_path / "split.vcf"))
+    multi_result = run_finsurf(dict(data, vcf=multi_vcf), tmp_path / "multi")
+    split_result = run_finsurf(dict(data, vcf=split_vcf), tmp_path / "split")
+    assert read_lines(multi_result) == read_lines(split_result)
+    assert len(read_lines(split_result)) > 1
+
+
+def test_errors(data, tmp_path):
+    for name, lines in [("empty", META), ("columns", ["chr1\t100\t.\tA"])]:
+        vcf = write_lines(lines, str(tmp_path / (name + ".vcf")))
+        error = finsurf.run_intersect(data["score"], data["regulatory"], vcf,
+                                      50, str(tmp_path))
+        assert error.startswith("Error")